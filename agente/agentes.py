@@ -0,0 +1,280 @@
+"""
+Registro de agentes RAG reutilizados entre perguntas.
+
+As partes sem estado (prompt, clientes HTTP, LLMs e retriever) são criadas
+uma única vez por processo e compartilhadas entre sessões. A cadeia
+ConversationalRetrievalChain, que guarda a memória da conversa, é mantida
+por sessão e reaproveitada enquanto a memória e a versão do índice não
+mudarem.
+
+A reescrita da pergunta é pulada quando ela é autocontida e os resultados
+do retriever são memorizados por versão do índice (ver recuperacao.py).
+
+O backend dos LLMs vem de SCR_LLM_BACKEND: "openai" (padrão) ou "fake",
+que responde localmente sem API (latência simulada por SCR_LLM_LATENCIA,
+em segundos), para testes e execução offline.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+from langchain_core.language_models.chat_models import SimpleChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_openai import ChatOpenAI
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.prompts import PromptTemplate
+
+from streaming import TAG_RESPOSTA
+from bm25 import RetrieverHibrido
+from recuperacao import CacheRecuperacao, CondensacaoSeNecessaria, RetrieverComCache
+
+
+TEMPLATE_RESPOSTA = """Você é um assistente especializado em documentos do Banco Central do Brasil,
+especificamente no documento SCR 3040. Sua função é ajudar usuários a entender e preencher
+corretamente este documento.
+
+Use APENAS as informações fornecidas no contexto abaixo para responder. Se a informação
+não estiver no contexto, seja honesto e diga que não tem essa informação nos documentos.
+
+Contexto:
+{context}
+
+Histórico da conversa:
+{chat_history}
+
+Pergunta: {question}
+
+Resposta detalhada e precisa:"""
+
+PROMPT_RESPOSTA = PromptTemplate(
+    template=TEMPLATE_RESPOSTA,
+    input_variables=["context", "question", "chat_history"]
+)
+
+# Parâmetros da busca MMR no vectorstore
+BUSCA_MMR = {
+    "k": 5,
+    "fetch_k": 10,
+    "lambda_mult": 0.7
+}
+
+# Modelo que resume os turnos antigos da memória (ver memoria.py)
+MODELO_RESUMO = "gpt-4o-mini"
+
+# Conexões keep-alive compartilhadas por todos os clientes OpenAI do processo
+LIMITES_HTTP = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60)
+
+
+class ChatFalso(SimpleChatModel):
+    """
+    Chat local para SCR_LLM_BACKEND=fake. Na reescrita da pergunta devolve a
+    própria pergunta (a busca continua significativa); nas respostas, um
+    texto fixo com o modelo e o tamanho do contexto recebido.
+    """
+
+    model_name: str = "fake"
+    latencia: float = 0.0
+    streaming: bool = False
+
+    @property
+    def _llm_type(self):
+        return "scr-fake"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name}
+
+    def _texto(self, messages):
+        prompt = "\n".join(str(m.content) for m in messages)
+        if "Follow Up Input:" in prompt:
+            return prompt.split("Follow Up Input:", 1)[1].split("Standalone question:", 1)[0].strip()
+        return f"[{self.model_name}] Resposta simulada com base em {len(prompt)} caracteres de contexto."
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latencia)
+        return self._texto(messages)
+
+    # Os tokens são repassados aos callbacks pelo BaseChatModel
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latencia)
+        for palavra in self._texto(messages).split(" "):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=palavra + " "))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latencia)
+        for palavra in self._texto(messages).split(" "):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=palavra + " "))
+
+    def _should_stream(self, *, async_api, run_manager=None, **kwargs):
+        return self.streaming or super()._should_stream(async_api=async_api, run_manager=run_manager, **kwargs)
+
+
+def backend_llm():
+    backend = os.getenv("SCR_LLM_BACKEND", "openai").lower()
+    if backend not in ("openai", "fake"):
+        raise ValueError(f"SCR_LLM_BACKEND inválido: {backend} (opções: openai, fake)")
+    return backend
+
+
+class RegistroAgentes:
+    """
+    Cache, por processo, dos componentes sem estado dos agentes.
+
+    Os LLMs são indexados por (modelo, streaming, timeout) e compartilham um
+    único httpx.Client, de modo que as conexões TLS com a API são reutilizadas
+    entre perguntas, modelos e sessões. O retriever depende do vectorstore (e do
+    índice BM25, se houver) e é descartado, junto com o cache de recuperação,
+    quando a versão do índice muda (ver sincronizar).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._http_client = None
+        self._llms = {}
+        self._retriever = None
+        self._vectorstore = None
+        self._bm25 = None
+        self.versao_indice = None
+        self.cache_recuperacao = CacheRecuperacao()
+        # Incrementada a cada troca de vectorstore; invalida os agentes das sessões
+        self.geracao = 0
+
+    @property
+    def http_client(self):
+        with self._lock:
+            return self._http_client_sem_lock()
+
+    def sincronizar(self, vectorstore, versao_indice, bm25=None):
+        """Descarta o retriever se o vectorstore foi reconstruído ou atualizado"""
+        with self._lock:
+            if (vectorstore is self._vectorstore and bm25 is self._bm25
+                    and versao_indice == self.versao_indice):
+                return
+            self._vectorstore = vectorstore
+            self._bm25 = bm25
+            self._retriever = None
+            self.cache_recuperacao.limpar()
+            self.versao_indice = versao_indice
+            self.geracao += 1
+
+    def invalidar(self):
+        """Esquece o vectorstore atual; os LLMs e o cliente HTTP são mantidos"""
+        self.sincronizar(None, None)
+
+    def retriever(self):
+        with self._lock:
+            if self._retriever is None:
+                if self._vectorstore is None:
+                    raise RuntimeError("Registro de agentes sem vectorstore; chame sincronizar()")
+                if self._bm25 is not None:
+                    # Híbrido: MMR + BM25 fundidos por RRF
+                    retriever = RetrieverHibrido(
+                        vectorstore=self._vectorstore, bm25=self._bm25, **BUSCA_MMR
+                    )
+                else:
+                    retriever = self._vectorstore.as_retriever(
+                        search_type="mmr",
+                        search_kwargs=BUSCA_MMR
+                    )
+                parametros = ",".join(f"{k}={v}" for k, v in sorted(BUSCA_MMR.items()))
+                self._retriever = RetrieverComCache(
+                    retriever=retriever,
+                    cache=self.cache_recuperacao,
+                    parametros=f"{'hibrido' if self._bm25 is not None else 'mmr'}:{parametros}",
+                    versao=self.versao_indice
+                )
+            return self._retriever
+
+    def llm(self, model_name, streaming=False, timeout=None):
+        """LLM que gera a resposta final (marcado para o streaming)"""
+        chave = ("resposta", model_name, streaming, timeout)
+        with self._lock:
+            if chave not in self._llms:
+                self._llms[chave] = self._criar_llm(
+                    model_name,
+                    temperature=0.1,
+                    max_tokens=2000,
+                    timeout=timeout,
+                    streaming=streaming,
+                    tags=[TAG_RESPOSTA]
+                )
+            return self._llms[chave]
+
+    def llm_condense(self, model_name, timeout=None):
+        """LLM sem streaming que reescreve a pergunta a partir do histórico"""
+        chave = ("condense", model_name, timeout)
+        with self._lock:
+            if chave not in self._llms:
+                self._llms[chave] = self._criar_llm(model_name, temperature=0, timeout=timeout)
+            return self._llms[chave]
+
+    def llm_resumo(self):
+        """LLM barato que resume o histórico antigo das conversas"""
+        return self.llm_condense(MODELO_RESUMO)
+
+    def _criar_llm(self, model_name, timeout=None, streaming=False, tags=None, **parametros):
+        if backend_llm() == "fake":
+            return ChatFalso(
+                model_name=model_name,
+                latencia=float(os.getenv("SCR_LLM_LATENCIA", "0")),
+                streaming=streaming,
+                tags=tags
+            )
+        return ChatOpenAI(
+            model_name=model_name,
+            request_timeout=timeout,
+            streaming=streaming,
+            # Uso de tokens também nas respostas em streaming (métricas)
+            stream_usage=True,
+            tags=tags,
+            http_client=self._http_client_sem_lock(),
+            **parametros
+        )
+
+    def _http_client_sem_lock(self):
+        if self._http_client is None:
+            self._http_client = httpx.Client(limits=LIMITES_HTTP)
+        return self._http_client
+
+    def criar_agente(self, memoria, model_name="gpt-4o-mini", timeout=None, streaming=False):
+        """Monta a cadeia com os componentes compartilhados e a memória informada"""
+        # Com streaming, a reescrita da pergunta usa um LLM próprio sem streaming,
+        # para que só os tokens da resposta final apareçam na tela
+        llm = self.llm(model_name, streaming, timeout)
+        condense_llm = self.llm_condense(model_name, timeout) if streaming else llm
+        cadeia = ConversationalRetrievalChain.from_llm(
+            llm=llm,
+            retriever=self.retriever(),
+            memory=memoria,
+            combine_docs_chain_kwargs={"prompt": PROMPT_RESPOSTA},
+            return_source_documents=True,
+            # Pergunta reescrita (chave do cache de respostas nas perguntas de seguimento)
+            return_generated_question=True,
+            verbose=False
+        )
+        # Perguntas autocontidas vão direto à busca, sem chamada de reescrita
+        cadeia.question_generator = CondensacaoSeNecessaria(llm=condense_llm, prompt=CONDENSE_QUESTION_PROMPT)
+        return cadeia
+
+    def obter_agente(self, agentes_sessao, memoria, model_name="gpt-4o-mini",
+                     timeout=None, streaming=False):
+        """
+        Agente da sessão para o modelo, reaproveitado entre perguntas.
+
+        agentes_sessao é um dict mantido pela sessão (ex.: st.session_state).
+        A cadeia é recriada se a memória foi trocada ou o vectorstore mudou.
+        """
+        chave = (model_name, timeout, streaming)
+        entrada = agentes_sessao.get(chave)
+        if entrada is not None:
+            geracao, memoria_cacheada, agente = entrada
+            if geracao == self.geracao and memoria_cacheada is memoria:
+                return agente
+        agente = self.criar_agente(memoria, model_name, timeout, streaming)
+        agentes_sessao[chave] = (self.geracao, memoria, agente)
+        return agente
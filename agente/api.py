@@ -0,0 +1,233 @@
+"""
+Serviço HTTP assíncrono (FastAPI) do agente SCR 3040.
+
+Endpoints:
+  GET    /saude                    estado e versão do índice
+  POST   /perguntar                resposta completa
+  POST   /perguntar/stream         resposta em Server-Sent Events (token a token)
+  POST   /comparar                 mesma pergunta a vários modelos, em paralelo
+  DELETE /conversas/{conversa_id}  descarta a memória da conversa
+  GET    /metricas                 métricas do worker no formato do Prometheus
+
+O modelo "Automático" (ou "auto") é escolhido por pergunta pelo roteador;
+no streaming, o evento "reinicio" indica que a resposta recomeçou em um
+modelo mais forte.
+
+Cada worker carrega o índice uma vez no startup (memory-mapped: as páginas
+são compartilhadas entre os processos) e mantém a memória das conversas;
+com vários workers, use afinidade por conversa_id no balanceador.
+Os workers abrem a versão do índice publicada (indice_versionado.py,
+somente-leitura) e passam para uma nova versão assim que ela é publicada,
+sem interromper as perguntas; com SCR_INDICE_MODO=compartilhado, as
+versões vêm do construtor e são as mesmas para todas as réplicas.
+
+Execução:
+  uvicorn api:app --app-dir agente --host 0.0.0.0 --port 8000 --workers 4
+Offline (testes/carga): SCR_LLM_BACKEND=fake SCR_EMBEDDINGS_BACKEND=fake
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from agentes import backend_llm
+from recursos import (MODELOS_DISPONIVEIS, NOME_AUTOMATICO, ROTULO_AUTOMATICO, TIMEOUT_MODELO_PADRAO,
+                      nome_do_modelo)
+from servico import Servico, criar_executor
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MODELO_PADRAO = "GPT-4o-mini"
+
+
+class PedidoPergunta(BaseModel):
+    pergunta: str = Field(min_length=1)
+    modelo: str = MODELO_PADRAO
+    conversa_id: Optional[str] = None
+    timeout: float = Field(TIMEOUT_MODELO_PADRAO, gt=0, le=600)
+    incluir_web: bool = False
+
+
+class PedidoComparacao(BaseModel):
+    pergunta: str = Field(min_length=1)
+    modelos: list[str] = ["GPT-4o", "GPT-3.5-turbo"]
+    conversa_id: Optional[str] = None
+    timeout: float = Field(TIMEOUT_MODELO_PADRAO, gt=0, le=600)
+
+
+async def _acompanhar_indice(servico):
+    """Verifica periodicamente a versão publicada do índice"""
+    while True:
+        await asyncio.sleep(servico.indice.intervalo)
+        try:
+            await asyncio.to_thread(servico.recarregar_indice)
+        except Exception:
+            logger.exception("Falha ao recarregar o índice")
+
+
+@asynccontextmanager
+async def ciclo_de_vida(app):
+    asyncio.get_running_loop().set_default_executor(criar_executor())
+    servico = app.state.servico = await asyncio.to_thread(Servico)
+    tarefa = asyncio.create_task(_acompanhar_indice(servico))
+    yield
+    tarefa.cancel()
+
+
+app = FastAPI(title="Agente SCR 3040", lifespan=ciclo_de_vida)
+
+
+def _modelo(modelo):
+    if modelo in (ROTULO_AUTOMATICO, NOME_AUTOMATICO):
+        return NOME_AUTOMATICO
+    nome = nome_do_modelo(modelo)
+    if nome is None:
+        opcoes = ", ".join([ROTULO_AUTOMATICO, *MODELOS_DISPONIVEIS])
+        raise HTTPException(400, f"Modelo desconhecido: {modelo} (opções: {opcoes})")
+    return nome
+
+
+def _fontes(documentos):
+    return [
+        {
+            "source": doc.metadata.get("source"),
+            "page": doc.metadata.get("page"),
+            "trecho": doc.page_content[:300],
+        }
+        for doc in documentos
+    ]
+
+
+def _corpo(resposta, conversa_id):
+    return {
+        "conversa_id": conversa_id,
+        "modelo": resposta.modelo,
+        "resposta": resposta.resposta,
+        "origem": resposta.origem,
+        "fontes": _fontes(resposta.documentos),
+        "duracao": resposta.duracao,
+        "tempo_primeiro_token": resposta.tempo_primeiro_token,
+        "resultado_web": resposta.resultado_web,
+        "metricas": resposta.metricas,
+        "rota": resposta.rota,
+    }
+
+
+@app.get("/saude")
+async def saude(request: Request):
+    servico = request.app.state.servico
+    return {
+        "status": "ok",
+        "versao_indice": servico.versao,
+        "versao_publicada": servico.indice.atual.nome,
+        "chunks": servico.vectorstore.index.ntotal,
+        "conversas": len(servico.conversas),
+        "backend_llm": backend_llm(),
+        "cache_recuperacao": servico.registro.cache_recuperacao.estatisticas(),
+    }
+
+
+@app.post("/perguntar")
+async def perguntar(pedido: PedidoPergunta, request: Request):
+    modelo = _modelo(pedido.modelo)
+    conversa_id = pedido.conversa_id or uuid.uuid4().hex
+    try:
+        resposta = await request.app.state.servico.perguntar(
+            pedido.pergunta, modelo, conversa_id, pedido.timeout, incluir_web=pedido.incluir_web
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(504, f"{pedido.modelo} não respondeu em {pedido.timeout:g}s")
+    return _corpo(resposta, conversa_id)
+
+
+def _evento(nome, dados):
+    return f"event: {nome}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+@app.post("/perguntar/stream")
+async def perguntar_stream(pedido: PedidoPergunta, request: Request):
+    modelo = _modelo(pedido.modelo)
+    conversa_id = pedido.conversa_id or uuid.uuid4().hex
+    servico = request.app.state.servico
+    loop = asyncio.get_running_loop()
+    fila = asyncio.Queue()
+
+    def ao_atualizar(texto):
+        loop.call_soon_threadsafe(fila.put_nowait, texto)
+
+    async def eventos():
+        tarefa = asyncio.create_task(servico.perguntar(
+            pedido.pergunta, modelo, conversa_id, pedido.timeout, ao_atualizar=ao_atualizar,
+            incluir_web=pedido.incluir_web
+        ))
+        enviado = 0
+        try:
+            while True:
+                espera = asyncio.ensure_future(fila.get())
+                await asyncio.wait({espera, tarefa}, return_when=asyncio.FIRST_COMPLETED)
+                if not espera.done():
+                    espera.cancel()
+                    break
+                texto = espera.result()
+                if texto is None:
+                    yield _evento("reinicio", {})
+                    enviado = 0
+                    continue
+                yield _evento("token", {"texto": texto[enviado:]})
+                enviado = len(texto)
+            resposta = tarefa.result()
+            # Respostas do dicionário/cache chegam inteiras, sem tokens
+            if len(resposta.resposta) > enviado:
+                yield _evento("token", {"texto": resposta.resposta[enviado:]})
+            yield _evento("fim", _corpo(resposta, conversa_id))
+        except asyncio.TimeoutError:
+            yield _evento("erro", {"erro": f"{pedido.modelo} não respondeu em {pedido.timeout:g}s"})
+        except Exception as e:
+            yield _evento("erro", {"erro": str(e)[:300]})
+        finally:
+            tarefa.cancel()
+
+    return StreamingResponse(eventos(), media_type="text/event-stream")
+
+
+@app.post("/comparar")
+async def comparar(pedido: PedidoComparacao, request: Request):
+    modelos = {rotulo: _modelo(rotulo) for rotulo in pedido.modelos}
+    conversa_id = pedido.conversa_id or uuid.uuid4().hex
+    resultados = await request.app.state.servico.comparar(
+        pedido.pergunta, list(modelos.values()), conversa_id, pedido.timeout
+    )
+    corpo = {"conversa_id": conversa_id, "modelos": {}}
+    for rotulo, nome in modelos.items():
+        resultado = resultados[nome]
+        if isinstance(resultado, asyncio.TimeoutError):
+            corpo["modelos"][rotulo] = {"erro": f"não respondeu em {pedido.timeout:g}s"}
+        elif isinstance(resultado, Exception):
+            corpo["modelos"][rotulo] = {"erro": str(resultado)[:300]}
+        else:
+            corpo["modelos"][rotulo] = _corpo(resultado, conversa_id)
+    return corpo
+
+
+@app.delete("/conversas/{conversa_id}")
+async def remover_conversa(conversa_id: str, request: Request):
+    if not request.app.state.servico.conversas.remover(conversa_id):
+        raise HTTPException(404, "Conversa não encontrada")
+    return {"removida": conversa_id}
+
+
+@app.get("/metricas", response_class=PlainTextResponse)
+async def metricas(request: Request):
+    return PlainTextResponse(request.app.state.servico.metricas.prometheus(),
+                             media_type="text/plain; version=0.0.4")
@@ -1,17 +1,16 @@
 import streamlit as st
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredExcelLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.tools import DuckDuckGoSearchRun
-from langchain.prompts import PromptTemplate
-from langchain.schema import Document
 from dotenv import load_dotenv
 import os
-from pathlib import Path
-import xml.etree.ElementTree as ET
+import time
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Só módulos leves antes do primeiro render: langchain, FAISS e os carregadores
+# são importados pelo aquecimento, em segundo plano (ver aquecimento.py)
+from aquecimento import (Aquecimento, carregar_recursos, recarregar_indice, reconstruir_indice,
+                         reverter_indice)
+from recursos import (MODELOS_DISPONIVEIS, TIMEOUT_MODELO_PADRAO,
+                      NOME_AUTOMATICO, ROTULO_AUTOMATICO, rotulo_do_modelo)
 
 
 load_dotenv()
@@ -31,13 +30,6 @@ if not OPENAI_API_KEY:
     st.stop()
 
 
-BASE_DIR = Path(__file__).parent
-PDF_PATH = BASE_DIR / "SCR_InstrucoesDePreenchimento_Doc3040.pdf"
-XLS_PATH = BASE_DIR / "SCR3040_Leiaute.xls"
-XLS_CRITICAS_PATH = BASE_DIR / "SCR3040_Criticas.xls"
-XML_PATH = BASE_DIR / "simulacao_3040.xml"
-VECTORSTORE_PATH = BASE_DIR / "vectorstore"
-
 st.set_page_config(
     page_title="Agente SCR 3040",
     page_icon="📘",
@@ -47,234 +39,88 @@ st.set_page_config(
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
-if "memory" not in st.session_state:
-    st.session_state.memory = ConversationBufferMemory(
-        memory_key="chat_history",
-        return_messages=True,
-        output_key="answer"
-    )
 # Memórias separadas para cada modelo (para comparação)
 if "memories_modelos" not in st.session_state:
     st.session_state.memories_modelos = {}
+if "tempos_primeiro_token" not in st.session_state:
+    st.session_state.tempos_primeiro_token = []
+if "agentes" not in st.session_state:
+    st.session_state.agentes = {}
 
 @st.cache_resource
-def carregar_vectorstore():
-    """Carrega ou cria o vectorstore com cache"""
-    import shutil
-    
-    # Verifica se o cache existe e está completo
-    index_faiss = VECTORSTORE_PATH / "index.faiss"
-    index_pkl = VECTORSTORE_PATH / "index.pkl"
-    
+def obter_aquecimento():
+    """
+    Carga inicial do processo, iniciada na primeira sessão e executada em
+    segundo plano enquanto a interface é exibida
+    """
+    return Aquecimento(carregar_recursos).iniciar()
+
+
+@st.cache_resource
+def obter_coletor_metricas():
+    """Métricas por etapa do processo (JSONL e, opcionalmente, Prometheus)"""
+    from metricas import criar_coletor
+    return criar_coletor()
+
+
+@st.cache_resource
+def obter_busca_web():
+    """Busca complementar na internet em segundo plano (backend via SCR_BUSCA_WEB_BACKEND)"""
+    from busca_web import BuscaWeb, criar_backend as criar_backend_busca_web
     try:
-        # Verifica se ambos os arquivos necessários existem
-        if VECTORSTORE_PATH.exists() and index_faiss.exists() and index_pkl.exists():
-            embeddings = OpenAIEmbeddings()
-            vectorstore = FAISS.load_local(
-                str(VECTORSTORE_PATH),
-                embeddings,
-                allow_dangerous_deserialization=True
-            )
-            st.success("✅ Vectorstore carregado do cache!")
-            return vectorstore
-        else:
-            # Cache incompleto, remove e recria
-            if VECTORSTORE_PATH.exists():
-                shutil.rmtree(VECTORSTORE_PATH)
-            st.info("ℹ️ Cache não encontrado ou incompleto. Criando novo vectorstore...")
+        return BuscaWeb(criar_backend_busca_web())
     except Exception as e:
-        # Erro ao carregar, remove cache corrompido e recria
-        st.warning(f"⚠️ Erro ao carregar cache: {str(e)[:100]}. Recriando vectorstore...")
-        try:
-            if VECTORSTORE_PATH.exists():
-                shutil.rmtree(VECTORSTORE_PATH)
-        except:
-            pass
-    
+        st.warning(f"⚠️ Busca na internet desativada: {e}")
+        return BuscaWeb(None)
 
-    with st.spinner("📚 Carregando e processando documentos..."):
-    
-        if not PDF_PATH.exists():
-            st.error(f"❌ Arquivo PDF não encontrado: {PDF_PATH}")
-            st.stop()
-        
-        loader_pdf = PyPDFLoader(str(PDF_PATH))
-        docs_pdf = loader_pdf.load()
-        
- 
-        if not XLS_PATH.exists():
-            st.error(f"❌ Arquivo XLS não encontrado: {XLS_PATH}")
-            st.stop()
-        
-        loader_xls = UnstructuredExcelLoader(str(XLS_PATH))
-        docs_xls = loader_xls.load()
-        
-        # Carrega arquivo XLS de Críticas
-        if XLS_CRITICAS_PATH.exists():
-            loader_xls_criticas = UnstructuredExcelLoader(str(XLS_CRITICAS_PATH))
-            docs_xls_criticas = loader_xls_criticas.load()
-        else:
-            st.warning(f"⚠️ Arquivo de críticas não encontrado: {XLS_CRITICAS_PATH}. Continuando sem ele...")
-            docs_xls_criticas = []
-        
-        # Carrega XML
-        if not XML_PATH.exists():
-            st.error(f"❌ Arquivo XML não encontrado: {XML_PATH}")
-            st.stop()
-        
-        # Carrega XML e extrai informações sobre tags e atributos
-        try:
-            tree = ET.parse(str(XML_PATH))
-            root = tree.getroot()
-            
-            # Extrai informações sobre a estrutura XML
-            xml_content = []
-            xml_content.append(f"Estrutura do XML SCR 3040 - Exemplo de preenchimento\n")
-            xml_content.append(f"Tag raiz: {root.tag}\n")
-            xml_content.append(f"Atributos da tag raiz: {root.attrib}\n\n")
-            
-            # Processa elementos e seus atributos
-            def processar_elemento(elem, nivel=0):
-                indent = "  " * nivel
-                xml_content.append(f"{indent}Tag: <{elem.tag}>")
-                if elem.attrib:
-                    xml_content.append(f"{indent}Atributos: {elem.attrib}")
-                if elem.text and elem.text.strip():
-                    xml_content.append(f"{indent}Conteúdo: {elem.text.strip()}")
-                xml_content.append("")
-                for child in elem:
-                    processar_elemento(child, nivel + 1)
-            
-            processar_elemento(root)
-            
-            # Cria documento do XML
-            xml_text = "\n".join(xml_content)
-            docs_xml = [Document(
-                page_content=xml_text,
-                metadata={"source": "XML", "type": "exemplo_preenchimento"}
-            )]
-        except Exception as e:
-            st.warning(f"⚠️ Erro ao processar XML: {e}. Tentando carregar como texto...")
-            # Fallback: carrega como texto simples
-            with open(XML_PATH, 'r', encoding='ISO-8859-1') as f:
-                xml_text = f.read()
-            docs_xml = [Document(
-                page_content=f"Exemplo de XML SCR 3040:\n\n{xml_text}",
-                metadata={"source": "XML", "type": "exemplo_preenchimento"}
-            )]
-        
-        # Junta todos os documentos
-        docs = docs_pdf + docs_xls + docs_xls_criticas + docs_xml
-        
-        # Adiciona metadados aos documentos
-        for i, doc in enumerate(docs):
-            if i < len(docs_pdf):
-                doc.metadata["source"] = "PDF"
-            elif i < len(docs_pdf) + len(docs_xls):
-                doc.metadata["source"] = "XLS_Leiaute"
-            elif i < len(docs_pdf) + len(docs_xls) + len(docs_xls_criticas):
-                doc.metadata["source"] = "XLS_Criticas"
-            else:
-                doc.metadata["source"] = "XML"
-            doc.metadata["doc_id"] = i
-        
-    
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1500,
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
-        
-        texts = text_splitter.split_documents(docs)
- 
-        embeddings = OpenAIEmbeddings()
-        vectorstore = FAISS.from_documents(texts, embeddings)
-        
-        try:
-            vectorstore.save_local(str(VECTORSTORE_PATH))
-        except Exception as e:
-            st.warning(f"⚠️ Não foi possível salvar cache: {e}")
-        
-        return vectorstore
-
-# Modelos disponíveis
-MODELOS_DISPONIVEIS = {
-    "GPT-4o-mini": {
-        "nome": "gpt-4o-mini",
-        "descricao": "Modelo mais rápido e econômico",
-        "custo": "Baixo"
-    },
-    "GPT-3.5-turbo": {
-        "nome": "gpt-3.5-turbo",
-        "descricao": "Modelo balanceado (velocidade/custo)",
-        "custo": "Muito Baixo"
-    },
-    "GPT-4o": {
-        "nome": "gpt-4o",
-        "descricao": "Modelo mais avançado e preciso",
-        "custo": "Alto"
-    },
-    "GPT-4-turbo": {
-        "nome": "gpt-4-turbo",
-        "descricao": "Modelo GPT-4 otimizado",
-        "custo": "Alto"
-    }
-}
+def _invocar_cronometrado(agente, pergunta, medidor):
+    """Executa o agente (em thread do pool) e mede a duração"""
+    inicio = time.perf_counter()
+    resultado = agente.invoke({"question": pergunta}, config={"callbacks": [medidor]})
+    medidor.registrar_resumo(agente.memory)
+    return resultado, time.perf_counter() - inicio
 
-def criar_agente(_vectorstore, _memory, model_name="gpt-4o-mini"):
-    """Cria o agente RAG com configurações otimizadas"""
-    
-    # Prompt template melhorado
-    template = """Você é um assistente especializado em documentos do Banco Central do Brasil, 
-especificamente no documento SCR 3040. Sua função é ajudar usuários a entender e preencher 
-corretamente este documento.
 
-Use APENAS as informações fornecidas no contexto abaixo para responder. Se a informação 
-não estiver no contexto, seja honesto e diga que não tem essa informação nos documentos.
+def _executar_agente(memoria, modelo_key, pergunta, medidor, area_resposta, usar_streaming):
+    """Executa o agente da sessão e mostra a resposta em area_resposta (token a token, com streaming)"""
+    agente = registro_agentes.obter_agente(
+        st.session_state.agentes, memoria,
+        model_name=modelo_key, streaming=usar_streaming
+    )
+    callbacks = [medidor]
+    handler = None
+    if usar_streaming:
+        area_resposta.markdown(f"🤔 Analisando com {rotulo_do_modelo(modelo_key)}...")
+        handler = StreamingResposta(lambda texto: area_resposta.markdown(texto + "▌"))
+        callbacks.append(handler)
+    resultado = agente.invoke({"question": pergunta}, config={"callbacks": callbacks})
+    area_resposta.markdown(resultado["answer"])
+    return resultado, handler
 
-Contexto:
-{context}
 
-Histórico da conversa:
-{chat_history}
+NOMES_ETAPAS = {
+    "condensacao": "Reescrita",
+    "recuperacao": "Busca",
+    "geracao": "Geração",
+    "resumo_memoria": "Resumo",
+    "busca_web": "Internet",
+    "total": "Total",
+}
 
-Pergunta: {question}
 
-Resposta detalhada e precisa:"""
-    
-    PROMPT = PromptTemplate(
-        template=template,
-        input_variables=["context", "question", "chat_history"]
-    )
-    
-   
-    retriever = _vectorstore.as_retriever(
-        search_type="mmr",  
-        search_kwargs={
-            "k": 5,  #
-            "fetch_k": 10,  
-            "lambda_mult": 0.7  
-        }
-    )
-    
-    
-    llm = ChatOpenAI(
-        model_name=model_name, 
-        temperature=0.1,  
-        max_tokens=2000
-    )
-    
-    qa_chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=retriever,
-        memory=_memory,
-        combine_docs_chain_kwargs={"prompt": PROMPT},
-        return_source_documents=True,
-        verbose=False
-    )
-    
-    return qa_chain
+def _resumo_metricas(registro):
+    """Linha com o tempo das etapas, os tokens e o custo de uma resposta"""
+    etapas = " | ".join(f"{NOMES_ETAPAS[e]} {d:.2f}s" for e, d in registro["etapas"].items())
+    tokens = registro["tokens"]
+    texto = f"⏱️ {etapas or 'sem LLM'}"
+    if tokens["entrada"] or tokens["saida"]:
+        texto += (f" | 🔢 {tokens['entrada']}+{tokens['saida']} tokens"
+                  + (" (estimados)" if tokens["estimado"] else "")
+                  + f" | 💵 US$ {registro['custo_usd']:.4f}")
+    return texto
+
+# Inicia a carga em segundo plano antes de montar a interface
+aquecimento = obter_aquecimento()
 
 # 🌐 Interface
 st.title("📘 Agente Inteligente do Documento SCR 3040")
@@ -287,47 +133,86 @@ with st.sidebar:
     st.markdown("### 🤖 Seleção de Modelo")
     modelo_selecionado = st.selectbox(
         "Escolha o modelo:",
-        options=list(MODELOS_DISPONIVEIS.keys()),
+        options=[ROTULO_AUTOMATICO] + list(MODELOS_DISPONIVEIS.keys()),
         index=0,
         help="Selecione o modelo de linguagem para gerar as respostas"
     )
     
     # Informações do modelo selecionado
-    modelo_info = MODELOS_DISPONIVEIS[modelo_selecionado]
-    st.caption(f"💡 {modelo_info['descricao']} | 💰 Custo: {modelo_info['custo']}")
+    if modelo_selecionado == ROTULO_AUTOMATICO:
+        st.caption("🧭 Escolhe por pergunta o modelo mais econômico adequado e refaz em um "
+                   "modelo mais forte se a resposta sair incerta")
+    else:
+        modelo_info = MODELOS_DISPONIVEIS[modelo_selecionado]
+        st.caption(f"💡 {modelo_info['descricao']} | 💰 Custo: {modelo_info['custo']}")
     
     # Opção de comparar modelos (melhor vs pior)
     st.markdown("---")
     comparar_modelos = st.checkbox(
-        "🔄 Comparar melhor vs pior modelo",
-        help="Compare GPT-4o (melhor) com GPT-3.5-turbo (mais econômico)"
+        "🔄 Comparar modelos lado a lado",
+        help="Executa os modelos escolhidos em paralelo; por padrão GPT-4o (melhor) e GPT-3.5-turbo (mais econômico)"
     )
     
     if comparar_modelos:
-        modelos_para_comparar = ["GPT-4o", "GPT-3.5-turbo"]
+        modelos_para_comparar = st.multiselect(
+            "Modelos para comparar:",
+            options=list(MODELOS_DISPONIVEIS.keys()),
+            default=["GPT-4o", "GPT-3.5-turbo"]
+        ) or [modelo_selecionado]
+        timeout_modelo = st.slider(
+            "⏱️ Tempo limite por modelo (s)",
+            min_value=10, max_value=180, value=TIMEOUT_MODELO_PADRAO, step=5,
+            help="Modelos que não responderem nesse tempo são marcados como expirados sem bloquear os demais"
+        )
     else:
         modelos_para_comparar = [modelo_selecionado]
+    
+    usar_streaming = st.checkbox(
+        "⚡ Exibir resposta em tempo real",
+        value=True,
+        help="Mostra a resposta à medida que é gerada (modo de um modelo)"
+    )
   
     if st.button("🗑️ Limpar Histórico"):
         st.session_state.messages = []
-        st.session_state.memory.clear()
         st.session_state.memories_modelos = {}
+        st.session_state.agentes = {}
         st.rerun()
     
-    if st.button("🔄 Recriar Vectorstore"):
-        import shutil
-        if VECTORSTORE_PATH.exists():
-            shutil.rmtree(VECTORSTORE_PATH)
-        st.cache_resource.clear()
-        st.success("✅ Vectorstore será recriado na próxima carga!")
+    # A reconstrução grava uma nova versão do índice ao lado da atual, que
+    # continua respondendo até a nova ser validada e publicada
+    recursos_carregados = aquecimento.resultado
+    reconstrucao = recursos_carregados["reconstrucao"] if recursos_carregados else None
+    reconstruindo = reconstrucao is not None and not reconstrucao.pronto
+    if st.button("🔄 Recriar Vectorstore", disabled=recursos_carregados is None or reconstruindo,
+                 help="Reconstrói o índice em segundo plano; as perguntas continuam sendo respondidas"):
+        reconstruir_indice(recursos_carregados)
         st.rerun()
+    if st.button("↩️ Voltar à versão anterior", disabled=recursos_carregados is None or reconstruindo,
+                 help="Publica de novo a versão do índice anterior à atual"):
+        from indice_versionado import IndiceOcupado
+        try:
+            versao_anterior = reverter_indice(recursos_carregados)
+        except IndiceOcupado:
+            st.warning("⏳ O índice está sendo reconstruído por outro processo; tente de novo em instantes")
+        else:
+            if versao_anterior:
+                st.success(f"✅ Índice de volta à versão {versao_anterior}")
+            else:
+                st.warning("⚠️ Não há versão anterior do índice")
+    if reconstruindo:
+        st.info(f"🔄 Recriando o índice: {reconstrucao.etapa_atual}... ({reconstrucao.decorrido:.0f}s)")
+    elif reconstrucao is not None and reconstrucao.erro is not None:
+        st.error(f"❌ Falha ao recriar o índice; a versão anterior continua em uso: {reconstrucao.erro}")
+    elif reconstrucao is not None:
+        st.success(f"✅ Índice recriado: versão {reconstrucao.resultado} ({reconstrucao.duracao:.0f}s)")
 
     st.markdown("---")
     st.markdown("### 📊 Informações")
     st.info(f"""
     **Modelo Atual:** {modelo_selecionado}  
     **Técnica:** RAG (Retrieval Augmented Generation)  
-    **Vectorstore:** FAISS com MMR  
+    **Vectorstore:** FAISS ({aquecimento.resultado["tipo_indice"] if aquecimento.resultado else "carregando"}) com MMR + BM25 (RRF)  
     **Cache:** Ativado
     
     **Documentos incluídos:**
@@ -340,13 +225,32 @@ with st.sidebar:
  
     if st.session_state.messages:
         st.metric("💬 Mensagens", len(st.session_state.messages))
+    
+    if st.session_state.tempos_primeiro_token:
+        tempos = st.session_state.tempos_primeiro_token
+        st.metric("⚡ Tempo até o 1º token", f"{sum(tempos) / len(tempos):.2f}s",
+                  help=f"Média das últimas {len(tempos)} respostas em streaming")
 
 
-try:
-    vectorstore = carregar_vectorstore()
-except Exception as e:
-    st.error(f"❌ Erro ao carregar documentos: {e}")
-    st.stop()
+with st.expander("🧪 Validar remessa Doc3040"):
+    st.caption("Executa as críticas do SCR3040_Criticas.xls sobre um XML antes do envio ao BCB")
+    arquivo_remessa = st.file_uploader("Arquivo XML da remessa", type=["xml"])
+    if arquivo_remessa is not None:
+        from remessa import ler_remessa
+        from validacao import validar, agrupar_violacoes
+        try:
+            with st.spinner("🔎 Executando críticas..."):
+                violacoes = validar(ler_remessa(arquivo_remessa))
+            if violacoes.empty:
+                st.success("✅ Nenhuma violação encontrada")
+            else:
+                st.warning(
+                    f"⚠️ {len(violacoes)} violação(ões) em "
+                    f"{violacoes['IPOC'].nunique()} operação(ões)"
+                )
+                st.dataframe(agrupar_violacoes(violacoes), use_container_width=True)
+        except Exception as e:
+            st.error(f"❌ Erro ao validar remessa: {e}")
 
 
 for message in st.session_state.messages:
@@ -354,6 +258,38 @@ for message in st.session_state.messages:
         st.markdown(message["content"])
 
 
+# Enquanto a carga não termina, a interface fica visível e as perguntas desabilitadas
+if not aquecimento.pronto:
+    st.info(f"⏳ Aquecendo o agente: {aquecimento.etapa_atual}... ({aquecimento.decorrido:.0f}s)")
+    st.chat_input("✍️ Faça sua pergunta sobre o SCR 3040:", disabled=True)
+    aquecimento.aguardar(0.5)
+    st.rerun()
+if aquecimento.erro is not None:
+    st.error(f"❌ Erro ao carregar documentos: {aquecimento.erro}")
+    st.stop()
+if not st.session_state.get("avisos_aquecimento_exibidos"):
+    st.session_state.avisos_aquecimento_exibidos = True
+    for nivel, texto in aquecimento.avisos:
+        getattr(st, nivel)(texto)
+
+# Já importados pelo aquecimento
+from memoria import copiar_memoria, criar_memoria, desfazer_ultimo_turno, historico_vazio  # noqa: E402
+from metricas import MedidorEtapas  # noqa: E402
+from recuperacao import pergunta_autocontida  # noqa: E402
+from streaming import StreamingResposta  # noqa: E402
+
+recursos_app = aquecimento.resultado
+# Troca para a versão do índice publicada por outro processo (ou revertida), se mudou
+versao_nova = recarregar_indice(recursos_app)
+if versao_nova:
+    st.toast(f"🔄 Índice atualizado para a versão {versao_nova}")
+versao = recursos_app["versao"]
+registro_agentes = recursos_app["registro_agentes"]
+cache_respostas = recursos_app["cache_respostas"]
+dicionario_leiaute = recursos_app["dicionario_leiaute"]
+roteador = recursos_app["roteador"]
+
+
 if pergunta := st.chat_input("✍️ Faça sua pergunta sobre o SCR 3040:"):
     st.session_state.messages.append({"role": "user", "content": pergunta})
     with st.chat_message("user"):
@@ -365,38 +301,131 @@ if pergunta := st.chat_input("✍️ Faça sua pergunta sobre o SCR 3040:"):
     if len(modelos_para_comparar) == 1:
         # Modo simples: um modelo
         modelo_nome = modelos_para_comparar[0]
-        modelo_key = MODELOS_DISPONIVEIS[modelo_nome]["nome"]
+        if modelo_nome == ROTULO_AUTOMATICO:
+            modelo_key = NOME_AUTOMATICO
+        else:
+            modelo_key = MODELOS_DISPONIVEIS[modelo_nome]["nome"]
+        
+        # Busca complementar na internet em paralelo com a busca nos documentos
+        busca_web = obter_busca_web().iniciar(pergunta)
+        medidor = MedidorEtapas(modelo_key)
         
         with st.chat_message("assistant"):
-            with st.spinner(f"🤔 Analisando com {modelo_nome}..."):
+            with st.spinner(f"🤔 Analisando com {modelo_nome}...") if not usar_streaming else nullcontext():
                 try:
                     # Usa memória compartilhada ou cria uma específica
                     if modelo_nome in st.session_state.memories_modelos:
                         memoria_modelo = st.session_state.memories_modelos[modelo_nome]
                     else:
-                        memoria_modelo = ConversationBufferMemory(
-                            memory_key="chat_history",
-                            return_messages=True,
-                            output_key="answer"
-                        )
+                        memoria_modelo = criar_memoria(registro_agentes.llm_resumo())
                         st.session_state.memories_modelos[modelo_nome] = memoria_modelo
                     
-                    agente = criar_agente(vectorstore, memoria_modelo, model_name=modelo_key)
-                    resultado = agente.invoke({"question": pergunta})
-                    resposta = resultado["answer"]
-                    documentos_fonte = resultado.get("source_documents", [])
+                    # Consultas diretas a um campo do leiaute dispensam o LLM
+                    resposta_direta = dicionario_leiaute.responder(pergunta) if dicionario_leiaute else None
+                    
+                    # Pergunta equivalente já respondida pelo mesmo modelo sobre o mesmo índice;
+                    # uma pergunta que depende da conversa ("E o prazo?") não consulta o cache
+                    pergunta_independente = historico_vazio(memoria_modelo) or pergunta_autocontida(pergunta)
+                    vetor_pergunta = None
+                    cacheada = None
+                    decisao = None
+                    if resposta_direta is None:
+                        try:
+                            vetor_pergunta = cache_respostas.vetor(pergunta)
+                        except Exception as e:
+                            st.caption(f"⚠️ Cache de respostas indisponível: {str(e)[:100]}")
+                        if modelo_key == NOME_AUTOMATICO:
+                            decisao = roteador.decidir(pergunta, vetor=vetor_pergunta)
+                            modelo_key = medidor.modelo = decisao.modelo
+                            st.caption(f"🧭 {ROTULO_AUTOMATICO}: {rotulo_do_modelo(modelo_key)} "
+                                       f"({'; '.join(decisao.motivos)})")
+                        if vetor_pergunta is not None and pergunta_independente:
+                            try:
+                                cacheada = cache_respostas.buscar(pergunta, modelo_key, versao, vetor=vetor_pergunta)
+                            except Exception as e:
+                                st.caption(f"⚠️ Cache de respostas indisponível: {str(e)[:100]}")
+                    
+                    handler = None
+                    if resposta_direta is not None:
+                        origem = "dicionario"
+                        resposta = resposta_direta
+                        documentos_fonte = []
+                        memoria_modelo.save_context({"question": pergunta}, {"answer": resposta})
+                        st.markdown(resposta)
+                        st.caption("📖 Resposta direta do dicionário do leiaute (sem LLM)")
+                    elif cacheada is not None:
+                        origem = "cache"
+                        resposta = cacheada.resposta
+                        documentos_fonte = cacheada.documentos
+                        memoria_modelo.save_context({"question": pergunta}, {"answer": resposta})
+                        st.markdown(resposta)
+                        st.caption(
+                            f"♻️ Resposta do cache (similaridade {cacheada.similaridade:.2f}, "
+                            f"~{cacheada.duracao_original:.1f}s economizados)"
+                        )
+                    else:
+                        origem = "modelo"
+                        area_resposta = st.empty()
+                        inicio = time.perf_counter()
+                        resultado, handler = _executar_agente(memoria_modelo, modelo_key, pergunta, medidor,
+                                                              area_resposta, usar_streaming)
+                        escalada = roteador.escalar(decisao, resultado["answer"]) if decisao else None
+                        if escalada is not None:
+                            # Resposta incerta: refeita no modelo mais forte, sem ficar no histórico
+                            desfazer_ultimo_turno(memoria_modelo)
+                            st.caption(f"🔁 Resposta incerta de {rotulo_do_modelo(modelo_key)}; "
+                                       f"refeita com {rotulo_do_modelo(escalada.modelo)}")
+                            decisao, modelo_key = escalada, escalada.modelo
+                            medidor.modelo = modelo_key
+                            resultado, handler = _executar_agente(memoria_modelo, modelo_key, pergunta, medidor,
+                                                                  area_resposta, usar_streaming)
+                        resposta = resultado["answer"]
+                        if handler is not None and handler.tempo_primeiro_token is not None:
+                            st.session_state.tempos_primeiro_token = (
+                                st.session_state.tempos_primeiro_token + [handler.tempo_primeiro_token]
+                            )[-50:]
+                        documentos_fonte = resultado.get("source_documents", [])
+                        duracao = time.perf_counter() - inicio
+                        if vetor_pergunta is not None:
+                            try:
+                                if pergunta_independente:
+                                    cache_respostas.gravar(pergunta, modelo_key, versao, resposta,
+                                                           documentos_fonte, duracao, vetor=vetor_pergunta)
+                                elif resultado.get("generated_question"):
+                                    # Pergunta de seguimento: gravada pela pergunta reescrita, autocontida
+                                    cache_respostas.gravar(resultado["generated_question"], modelo_key, versao,
+                                                           resposta, documentos_fonte, duracao)
+                            except Exception as e:
+                                st.caption(f"⚠️ Não foi possível gravar no cache de respostas: {str(e)[:100]}")
+                    
+                    # Fontes anexadas após a conclusão da resposta
+                    if documentos_fonte:
+                        with st.expander(f"📄 Fontes ({len(documentos_fonte)})"):
+                            for doc in documentos_fonte:
+                                pagina = doc.metadata.get("page")
+                                st.caption(
+                                    f"**{doc.metadata.get('source', '?')}**"
+                                    + (f" – página {pagina + 1}" if isinstance(pagina, int) else "")
+                                )
+                                st.text(doc.page_content[:300])
+                    if handler is not None and handler.tempo_primeiro_token is not None:
+                        st.caption(f"⚡ Primeiro token em {handler.tempo_primeiro_token:.2f}s")
                     
-                    st.markdown(resposta)
+                    # Busca complementar na internet: exibida só se terminou dentro do prazo
+                    resultado_web = busca_web.resultado() if busca_web else None
+                    if resultado_web:
+                        with st.expander("🌐 Informação complementar da internet"):
+                            st.write(resultado_web)
                     
-                    # Busca complementar na internet
-                    try:
-                        search = DuckDuckGoSearchRun()
-                        resultado_web = search.run(f"SCR 3040 Banco Central {pergunta}")
-                        if resultado_web and len(resultado_web.strip()) > 0:
-                            with st.expander("🌐 Informação complementar da internet"):
-                                st.write(resultado_web)
-                    except:
-                        pass
+                    medidor.registrar_resumo(memoria_modelo)
+                    if busca_web:
+                        medidor.registrar_etapa("busca_web", busca_web.duracao)
+                    registro_metricas = medidor.registro(
+                        origem, modo="simples", rota=decisao.como_dict() if decisao else None,
+                        tempo_primeiro_token=handler.tempo_primeiro_token if handler else None
+                    )
+                    obter_coletor_metricas().registrar(registro_metricas)
+                    st.caption(_resumo_metricas(registro_metricas))
                     
                     st.session_state.messages.append({
                         "role": "assistant",
@@ -414,53 +443,97 @@ if pergunta := st.chat_input("✍️ Faça sua pergunta sobre o SCR 3040:"):
                         "modelo": modelo_nome
                     })
     else:
-        # Modo comparação: melhor vs pior (2 modelos lado a lado)
-        st.markdown("### 🔄 Comparação: Melhor vs Mais Econômico")
+        # Modo comparação: N modelos lado a lado, executados em paralelo
+        st.markdown("### 🔄 Comparação de Modelos")
         
-        col1, col2 = st.columns(2)
+        colunas = st.columns(len(modelos_para_comparar))
         respostas_modelos = {}
+        placeholders = {}
+        futuros = {}
+        prazos = {}
+        medidores = {}
+        # Cada modelo responde sobre uma cópia da sua memória, aceita só se
+        # a resposta chegar no prazo: um modelo atrasado termina em segundo
+        # plano sem gravar na conversa um turno que o usuário não viu
+        memorias_trabalho = {}
+        executor = ThreadPoolExecutor(max_workers=len(modelos_para_comparar))
         
-        for idx, modelo_nome in enumerate(modelos_para_comparar):
+        for col, modelo_nome in zip(colunas, modelos_para_comparar):
             modelo_key = MODELOS_DISPONIVEIS[modelo_nome]["nome"]
-            col = col1 if idx == 0 else col2
             
             with col:
                 st.markdown(f"#### 🤖 {modelo_nome}")
                 st.caption(f"{MODELOS_DISPONIVEIS[modelo_nome]['descricao']} | 💰 {MODELOS_DISPONIVEIS[modelo_nome]['custo']}")
+                placeholders[modelo_nome] = st.empty()
+                placeholders[modelo_nome].info(f"⏳ Processando {modelo_nome}...")
+            
+            try:
+                # Usa ou cria memória específica para cada modelo
+                if modelo_nome in st.session_state.memories_modelos:
+                    memoria_modelo = st.session_state.memories_modelos[modelo_nome]
+                else:
+                    memoria_modelo = criar_memoria(registro_agentes.llm_resumo())
+                    st.session_state.memories_modelos[modelo_nome] = memoria_modelo
+                memorias_trabalho[modelo_nome] = copiar_memoria(memoria_modelo)
                 
-                with st.spinner(f"Processando {modelo_nome}..."):
-                    try:
-                        # Usa ou cria memória específica para cada modelo
-                        if modelo_nome in st.session_state.memories_modelos:
-                            memoria_modelo = st.session_state.memories_modelos[modelo_nome]
-                        else:
-                            memoria_modelo = ConversationBufferMemory(
-                                memory_key="chat_history",
-                                return_messages=True,
-                                output_key="answer"
-                            )
-                            st.session_state.memories_modelos[modelo_nome] = memoria_modelo
-                        
-                        agente = criar_agente(vectorstore, memoria_modelo, model_name=modelo_key)
-                        resultado = agente.invoke({"question": pergunta})
-                        resposta = resultado["answer"]
-                        documentos_fonte = resultado.get("source_documents", [])
-                        
-                        respostas_modelos[modelo_nome] = resposta
-                        
-                        st.markdown("**Resposta:**")
-                        st.markdown(resposta)
-                        
-                        # Informações adicionais (sem expander)
-                        st.caption(f"📄 Documentos utilizados: {len(documentos_fonte)}")
-                        
-                    except Exception as e:
-                        erro_msg = f"❌ Erro: {str(e)}"
-                        st.error(erro_msg)
-                        respostas_modelos[modelo_nome] = erro_msg
+                agente = registro_agentes.obter_agente(
+                    st.session_state.agentes, memorias_trabalho[modelo_nome],
+                    model_name=modelo_key, timeout=timeout_modelo
+                )
+                medidores[modelo_nome] = MedidorEtapas(modelo_key)
+                futuro = executor.submit(_invocar_cronometrado, agente, pergunta, medidores[modelo_nome])
+                futuros[futuro] = modelo_nome
+                prazos[futuro] = time.monotonic() + timeout_modelo
+            except Exception as e:
+                erro_msg = f"❌ Erro: {str(e)}"
+                placeholders[modelo_nome].error(erro_msg)
+                respostas_modelos[modelo_nome] = erro_msg
+        
+        # Cada coluna é preenchida assim que o respectivo modelo termina; cada
+        # modelo tem o seu prazo, contado a partir do seu início
+        pendentes = set(futuros)
+        try:
+            while pendentes:
+                proximo_prazo = min(prazos[futuro] for futuro in pendentes)
+                concluidos, _ = wait(pendentes, timeout=max(0.0, proximo_prazo - time.monotonic()),
+                                     return_when=FIRST_COMPLETED)
+                for futuro in concluidos:
+                    pendentes.discard(futuro)
+                    modelo_nome = futuros[futuro]
+                    with placeholders[modelo_nome].container():
+                        try:
+                            resultado, duracao = futuro.result()
+                            resposta = resultado["answer"]
+                            documentos_fonte = resultado.get("source_documents", [])
+                            respostas_modelos[modelo_nome] = resposta
+                            st.session_state.memories_modelos[modelo_nome] = memorias_trabalho[modelo_nome]
+                            
+                            st.markdown("**Resposta:**")
+                            st.markdown(resposta)
+                            
+                            # Informações adicionais (sem expander)
+                            st.caption(f"📄 Documentos utilizados: {len(documentos_fonte)} | ⏱️ {duracao:.1f}s")
+                            registro_metricas = medidores[modelo_nome].registro("modelo", modo="comparacao")
+                            obter_coletor_metricas().registrar(registro_metricas)
+                            st.caption(_resumo_metricas(registro_metricas))
+                        except Exception as e:
+                            erro_msg = f"❌ Erro: {str(e)}"
+                            st.error(erro_msg)
+                            respostas_modelos[modelo_nome] = erro_msg
+                agora = time.monotonic()
+                for futuro in [f for f in pendentes if prazos[f] <= agora]:
+                    pendentes.discard(futuro)
+                    modelo_nome = futuros[futuro]
+                    erro_msg = f"❌ Tempo limite de {timeout_modelo}s excedido"
+                    placeholders[modelo_nome].error(erro_msg)
+                    respostas_modelos[modelo_nome] = erro_msg
+        finally:
+            # Não espera modelos atrasados: suas threads terminam em segundo
+            # plano, gravando só na cópia descartada da memória
+            executor.shutdown(wait=False, cancel_futures=True)
         
         # Resumo comparativo simples
-        if len(respostas_modelos) == 2:
+        if len(respostas_modelos) >= 2:
             st.markdown("---")
             st.markdown("### 📊 Comparação Rápida")
             
@@ -473,18 +546,50 @@ if pergunta := st.chat_input("✍️ Faça sua pergunta sobre o SCR 3040:"):
                 modelos_sucesso = [m for m, r in respostas_modelos.items() if isinstance(r, str) and not r.startswith("❌")]
                 st.metric("Modelos com Sucesso", len(modelos_sucesso))
             with col3:
-                if len(modelos_sucesso) == 2:
-                    melhor = max(modelos_para_comparar, key=lambda m: len(respostas_modelos.get(m, "")))
+                if len(modelos_sucesso) >= 2:
+                    melhor = max(modelos_sucesso, key=lambda m: len(respostas_modelos.get(m, "")))
                     st.metric("Resposta Mais Detalhada", melhor)
         
-        # Salva todas as respostas no histórico
-        for modelo_nome, resposta in respostas_modelos.items():
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": resposta,
-                "modelo": modelo_nome
-            })
+        # Salva todas as respostas no histórico, na ordem dos modelos escolhidos
+        for modelo_nome in modelos_para_comparar:
+            if modelo_nome in respostas_modelos:
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": respostas_modelos[modelo_nome],
+                    "modelo": modelo_nome
+                })
 
 
 
-# rodar streamlit run agente/app_melhorado.py
\ No newline at end of file
+# Estatísticas do cache de respostas (após processar a pergunta atual)
+with st.sidebar:
+    stats_cache = cache_respostas.estatisticas()
+    if stats_cache["hits"] + stats_cache["misses"]:
+        col_cache1, col_cache2 = st.columns(2)
+        col_cache1.metric("♻️ Acertos do cache", f"{stats_cache['taxa_acerto']:.0%}",
+                          help=f"{stats_cache['hits']} de {stats_cache['hits'] + stats_cache['misses']} perguntas")
+        col_cache2.metric("⏱️ Tempo economizado", f"{stats_cache['tempo_economizado']:.1f}s")
+    
+    # Latência por etapa das últimas respostas (todas as sessões do processo)
+    coletor_metricas = obter_coletor_metricas()
+    percentis = coletor_metricas.percentis()
+    if percentis:
+        st.markdown("### ⏱️ Latência por etapa")
+        st.dataframe(
+            [{"Etapa": NOMES_ETAPAS[etapa], "p50 (s)": round(p50, 2), "p95 (s)": round(p95, 2), "n": n}
+             for etapa, (p50, p95, n) in percentis.items()],
+            hide_index=True, use_container_width=True
+        )
+        st.metric("💵 Custo estimado", f"US$ {coletor_metricas.custo_total():.4f}",
+                  help="Soma das respostas registradas por este processo")
+    rotas = coletor_metricas.rotas()
+    if rotas:
+        st.markdown(f"### 🧭 Rotas ({ROTULO_AUTOMATICO})")
+        st.dataframe(
+            [{"Rota": rota, "Perguntas": n, "Tempo médio (s)": round(duracao, 2), "Custo médio (US$)": round(valor, 5)}
+             for rota, (n, duracao, valor) in rotas.items()],
+            hide_index=True, use_container_width=True
+        )
+
+
+# rodar streamlit run agente/app_melhorado.py
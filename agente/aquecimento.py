@@ -0,0 +1,245 @@
+"""
+Carga inicial (aquecimento) em segundo plano.
+
+O app Streamlit importava langchain, FAISS e os carregadores e abria o
+índice antes do primeiro render. Aquecimento executa a função de carga em
+uma thread e guarda o estado (etapa atual, avisos, resultado ou erro) para
+que a interface seja exibida de imediato, com um aviso de "aquecendo", e
+passe a aceitar perguntas quando a carga terminar.
+
+A função de carga recebe o próprio Aquecimento e informa o progresso por
+etapa() e avisar(); ela não deve chamar a interface (st.*), que não está
+disponível fora da thread da sessão. carregar_recursos é a carga do app;
+reconstruir_indice, a reconstrução do índice pelo botão "Recriar
+Vectorstore", também executada por um Aquecimento enquanto a versão
+publicada continua respondendo.
+"""
+
+import importlib
+import logging
+import threading
+import time
+
+from recursos import (PDF_PATH, XLS_PATH, XLS_CRITICAS_PATH, XML_PATH,
+                      EMBEDDINGS_CACHE_PATH, RESPOSTAS_CACHE_PATH, LEIAUTE_CACHE_PATH)
+
+
+logger = logging.getLogger(__name__)
+
+
+class Aquecimento:
+    """Estado de uma carga executada uma vez em segundo plano"""
+
+    def __init__(self, carregar, nome="aquecimento"):
+        self._carregar = carregar
+        self.nome = nome
+        self.etapa_atual = "Iniciando"
+        # (nível, texto), com nível "info", "success", "warning" ou "caption"
+        self.avisos = []
+        self.resultado = None
+        self.erro = None
+        self.inicio = None
+        self.duracao = None
+        # Duração de cada etapa concluída, em segundos
+        self.etapas = {}
+        self._inicio_etapa = None
+        self._pronto = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def iniciar(self):
+        """Inicia a carga (uma única vez) e retorna o próprio objeto"""
+        with self._lock:
+            if self._thread is None:
+                self.inicio = self._inicio_etapa = time.perf_counter()
+                self._thread = threading.Thread(target=self._executar, name=self.nome, daemon=True)
+                self._thread.start()
+        return self
+
+    def _executar(self):
+        try:
+            self.resultado = self._carregar(self)
+        except Exception as e:
+            logger.exception("Falha em %s", self.nome)
+            self.erro = e
+        finally:
+            self.etapa("Concluído")
+            self.duracao = time.perf_counter() - self.inicio
+            logger.info("%s em %.2fs: %s", self.nome.capitalize(), self.duracao,
+                        ", ".join(f"{nome} {d:.2f}s" for nome, d in self.etapas.items()))
+            self._pronto.set()
+
+    def etapa(self, nome):
+        """Encerra a etapa atual (registrando a duração) e passa para a próxima"""
+        agora = time.perf_counter()
+        self.etapas[self.etapa_atual] = agora - self._inicio_etapa
+        self.etapa_atual, self._inicio_etapa = nome, agora
+
+    def avisar(self, nivel, texto):
+        self.avisos.append((nivel, texto))
+
+    @property
+    def pronto(self):
+        return self._pronto.is_set()
+
+    @property
+    def decorrido(self):
+        return 0.0 if self.inicio is None else time.perf_counter() - self.inicio
+
+    def aguardar(self, timeout=None):
+        """Espera o fim da carga; True se terminou (com ou sem erro)"""
+        return self._pronto.wait(timeout)
+
+
+_trava_reconstrucao = threading.Lock()
+
+# Usados só depois do aquecimento; importados por ele em segundo plano
+MODULOS_PRE_CARREGADOS = ("memoria", "metricas", "streaming", "busca_web")
+
+
+def carregar_recursos(aquecimento, registro_agentes=None):
+    """
+    Carga inicial do app (função de carga do Aquecimento): abre o índice
+    (no modo local, reindexando antes as fontes alteradas), o BM25, o
+    dicionário do leiaute e o cache de respostas. Retorna um dict com os
+    componentes; as mensagens para a tela vão para aquecimento.avisar.
+    """
+    for nome, caminho in (("PDF", PDF_PATH), ("XLS", XLS_PATH), ("XML", XML_PATH)):
+        if not caminho.exists():
+            raise FileNotFoundError(f"Arquivo {nome} não encontrado: {caminho}")
+    if not XLS_CRITICAS_PATH.exists():
+        aquecimento.avisar("warning", f"⚠️ Arquivo de críticas não encontrado: {XLS_CRITICAS_PATH}. Continuando sem ele...")
+
+    aquecimento.etapa("Importando bibliotecas")
+    from agentes import RegistroAgentes
+    from cache_embeddings import criar_embeddings
+    from cache_semantico import CacheSemantico
+    from dicionario_leiaute import carregar_dicionario
+    from indice_versionado import IndiceVersionado, modo_indice
+    from indices_faiss import tipo_do_indice
+    from roteador import Roteador
+    for modulo in MODULOS_PRE_CARREGADOS:
+        importlib.import_module(modulo)
+
+    aquecimento.etapa("Carregando o índice")
+    embeddings = criar_embeddings(EMBEDDINGS_CACHE_PATH)
+    indice = IndiceVersionado(embeddings)
+    # No modo compartilhado quem reindexa é o construtor; a versão publicada
+    # já vem com o BM25 e é somente-leitura
+    atual = indice.abrir(atualizar=modo_indice() == "local", ao_progredir=aquecimento.etapa)
+    _avisar_relatorio(aquecimento, indice, atual)
+    vectorstore, versao = atual.vectorstore, atual.versao
+    registro_agentes = registro_agentes or RegistroAgentes()
+    registro_agentes.sincronizar(vectorstore, versao, atual.bm25)
+
+    aquecimento.etapa("Dicionário do leiaute")
+    try:
+        # Relido só se a planilha mudar
+        dicionario_leiaute = carregar_dicionario(XLS_PATH, LEIAUTE_CACHE_PATH)
+    except Exception as e:
+        aquecimento.avisar("warning", f"⚠️ Dicionário do leiaute indisponível: {str(e)[:100]}")
+        dicionario_leiaute = None
+
+    aquecimento.etapa("Cache de respostas")
+    # Cache semântico de respostas; descarta as de versões anteriores do índice
+    cache_respostas = CacheSemantico(criar_embeddings(EMBEDDINGS_CACHE_PATH), RESPOSTAS_CACHE_PATH)
+    cache_respostas.invalidar_outras_versoes(versao)
+
+    return {
+        "vectorstore": vectorstore,
+        "versao": versao,
+        "tipo_indice": tipo_do_indice(vectorstore.index),
+        "registro_agentes": registro_agentes,
+        "cache_respostas": cache_respostas,
+        "dicionario_leiaute": dicionario_leiaute,
+        # Roteamento automático de modelo (refeito quando o índice muda)
+        "roteador": Roteador(vectorstore, dicionario_leiaute),
+        # Versão publicada em uso (ver recarregar_indice)
+        "indice": indice,
+        # Reconstrução em segundo plano, se houver (ver reconstruir_indice)
+        "reconstrucao": None,
+    }
+
+
+def _avisar_relatorio(aquecimento, indice, atual):
+    """Mensagens para a tela sobre a abertura (e a eventual atualização) do índice"""
+    from indices_faiss import tipo_do_indice
+
+    relatorio = indice.relatorio
+    # Só o manifesto regravado (fontes tocadas sem mudar) conta como carregado do cache
+    if relatorio is None or not (relatorio.houve_alteracao or relatorio.indice_convertido):
+        aquecimento.avisar("success", f"✅ Vectorstore carregado do cache! (versão {atual.nome})")
+        return
+    if relatorio.reconstruido:
+        aquecimento.avisar("info", f"ℹ️ Vectorstore criado (versão {atual.nome})")
+    elif relatorio.houve_alteracao:
+        alteradas = ", ".join(relatorio.fontes_alteradas + relatorio.fontes_removidas)
+        aquecimento.avisar(
+            "info",
+            f"ℹ️ Fontes atualizadas: {alteradas} "
+            f"(+{relatorio.chunks_adicionados} / -{relatorio.chunks_removidos} chunks)"
+        )
+    if relatorio.indice_convertido:
+        aquecimento.avisar("caption", f"🗂️ Índice FAISS convertido para {tipo_do_indice(atual.vectorstore.index)}")
+    stats = indice.embeddings.estatisticas()
+    aquecimento.avisar("caption", f"🧠 Embeddings: {stats['hits']} do cache, {stats['misses']} calculados")
+
+
+def recarregar_indice(recursos, forcar=False):
+    """
+    Passa os componentes carregados por carregar_recursos para a versão
+    publicada do índice, se ela mudou (nova versão, de outro processo ou de
+    reconstruir_indice, ou reversão). Retorna o nome da nova versão, ou None.
+    """
+    indice = recursos["indice"]
+
+    def usar_versao(atual):
+        from indices_faiss import tipo_do_indice
+        from roteador import Roteador
+        recursos["registro_agentes"].sincronizar(atual.vectorstore, atual.versao, atual.bm25)
+        recursos["cache_respostas"].invalidar_outras_versoes(atual.versao)
+        recursos.update(
+            vectorstore=atual.vectorstore,
+            versao=atual.versao,
+            tipo_indice=tipo_do_indice(atual.vectorstore.index),
+            roteador=Roteador(atual.vectorstore, recursos["dicionario_leiaute"]),
+        )
+
+    return indice.atual.nome if indice.atualizar(ao_trocar=usar_versao, forcar=forcar) else None
+
+
+def reconstruir_indice(recursos):
+    """
+    Inicia (se já não estiver em andamento) a reconstrução do índice do
+    zero em segundo plano: a nova versão é gravada ao lado, validada e
+    publicada, e só então os componentes passam para ela; até lá, e se
+    algo falhar, a versão atual continua respondendo. Retorna o Aquecimento
+    da reconstrução.
+    """
+    def reconstruir(aquecimento):
+        from indice_versionado import construir
+        indice = recursos["indice"]
+        nome, _ = construir(indice.embeddings, indice.raiz, do_zero=True, ao_progredir=aquecimento.etapa)
+        recarregar_indice(recursos, forcar=True)
+        return nome
+
+    # Sessões diferentes podem clicar ao mesmo tempo: uma reconstrução por vez
+    with _trava_reconstrucao:
+        reconstrucao = recursos.get("reconstrucao")
+        if reconstrucao is None or reconstrucao.pronto:
+            reconstrucao = Aquecimento(reconstruir, nome="reconstrução do índice").iniciar()
+            recursos["reconstrucao"] = reconstrucao
+    return reconstrucao
+
+
+def reverter_indice(recursos):
+    """
+    Volta para a versão anterior do índice e passa os componentes para ela;
+    retorna o nome ou None. Não espera uma construção em andamento em outro
+    processo: levanta indice_versionado.IndiceOcupado.
+    """
+    from indice_versionado import reverter
+    nome = reverter(recursos["indice"].raiz, esperar=False)
+    if nome is not None:
+        recarregar_indice(recursos, forcar=True)
+    return nome
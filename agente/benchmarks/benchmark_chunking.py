@@ -0,0 +1,176 @@
+"""
+Benchmark das estratégias de chunking: número de chunks, tamanho do índice,
+taxa de acerto da busca e tokens médios do prompt de resposta.
+
+Compara o splitter recursivo em todas as fontes com as estratégias por
+fonte de chunking.ESTRATEGIAS_POR_FONTE. As consultas são geradas das
+próprias fontes, com o trecho que a resposta precisa conter:
+  - uma por crítica da planilha de críticas (código + início da descrição)
+  - uma por item "No campo ... (atributo X)" do PDF de instruções (início
+    do texto do item)
+ou lidas de um arquivo JSONL com {"pergunta": ..., "esperado": ...}. Há
+acerto quando algum dos k chunks recuperados contém o trecho esperado.
+
+A busca é feita no FAISS com o backend de embeddings configurado (via
+cache) ou, com --busca bm25, só lexicalmente (roda sem API).
+
+Uso:
+  python benchmarks/benchmark_chunking.py [--k 5] [--busca faiss|bm25]
+                                          [--perguntas arquivo.jsonl]
+"""
+
+import argparse
+import copy
+import json
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import chunking  # noqa: E402
+from agentes import PROMPT_RESPOSTA  # noqa: E402
+from bm25 import IndiceBM25  # noqa: E402
+from dicionario_leiaute import carregar_leiaute  # noqa: E402
+from indexacao import Fonte, carregar_pdf, carregar_xls_linhas, carregar_xml, gerar_chunks  # noqa: E402
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Tamanho do trecho esperado nas consultas geradas
+TAMANHO_TRECHO = 60
+
+
+def fontes_padrao():
+    return [
+        Fonte("PDF", BASE_DIR / "SCR_InstrucoesDePreenchimento_Doc3040.pdf", carregar_pdf),
+        Fonte("XLS_Leiaute", BASE_DIR / "SCR3040_Leiaute.xls", carregar_leiaute),
+        Fonte("XLS_Criticas", BASE_DIR / "SCR3040_Criticas.xls", carregar_xls_linhas),
+        Fonte("XML", BASE_DIR / "simulacao_3040.xml", carregar_xml),
+    ]
+
+
+def _normalizar(texto):
+    return " ".join(texto.split()).lower()
+
+
+def consultas_geradas(docs_por_fonte):
+    consultas = []
+    for doc in docs_por_fonte.get("XLS_Criticas", []):
+        for linha in doc.page_content.split("\n")[1:]:
+            campos = dict(c.split(": ", 1) for c in linha.split("; ") if ": " in c)
+            if "Código" in campos and len(campos.get("Descrição", "")) >= TAMANHO_TRECHO:
+                consultas.append({
+                    "pergunta": f"O que verifica a crítica {campos['Código']} ({campos.get('Regra', '')})?",
+                    "esperado": campos["Descrição"][:TAMANHO_TRECHO],
+                })
+    texto_pdf = "\n".join(d.page_content for d in docs_por_fonte.get("PDF", []))
+    item = re.compile(r"^[IVXL]{1,6}\.\s+No[s]? c\s?ampos? “\s*([^”]+?)\s*”.*?\(atributo\s+“\s*(\w+)”\)(.*)$",
+                      re.MULTILINE)
+    for m in item.finditer(texto_pdf):
+        continuacao = texto_pdf[m.start(3):m.start(3) + 400]
+        trecho = " ".join(continuacao.split())[:TAMANHO_TRECHO]
+        if len(trecho) == TAMANHO_TRECHO:
+            consultas.append({
+                "pergunta": f"Como preencher o campo {m.group(1)} (atributo {m.group(2)})?",
+                "esperado": trecho,
+            })
+    return consultas
+
+
+def contar_tokens():
+    try:
+        import tiktoken
+        codificador = tiktoken.get_encoding("o200k_base")
+        return lambda texto: len(codificador.encode(texto)), "tiktoken o200k_base"
+    except Exception:
+        # Sem o arquivo de BPE (ex.: sem rede): ~4 caracteres por token
+        return lambda texto: len(texto) // 4, "estimativa 4 caracteres/token"
+
+
+def buscador(chunks, busca, k, diretorio):
+    """Função consulta -> textos dos k chunks, e tamanho do índice em disco (bytes)"""
+    if busca == "bm25":
+        indice = IndiceBM25.construir(chunks.items())
+        indice.salvar(diretorio)
+        tamanho = sum(p.stat().st_size for p in Path(diretorio).iterdir())
+        return lambda consulta: [chunks[id_] for id_, _ in indice.buscar(consulta, n=k)], tamanho
+
+    from langchain.schema import Document
+    from langchain_community.vectorstores import FAISS
+    from cache_embeddings import criar_embeddings
+    import indices_faiss
+    embeddings = criar_embeddings(BASE_DIR / "cache" / "embeddings.sqlite")
+    vectorstore = FAISS.from_documents(
+        [Document(page_content=texto) for texto in chunks.values()], embeddings, ids=list(chunks.keys())
+    )
+    indices_faiss.salvar_local(vectorstore, diretorio)
+    tamanho = sum(p.stat().st_size for p in Path(diretorio).iterdir())
+    return lambda consulta: [d.page_content for d in vectorstore.similarity_search(consulta, k=k)], tamanho
+
+
+def avaliar(nome, fontes, docs_por_fonte, consultas, args, tokens):
+    os.environ["SCR_CHUNKING"] = nome if nome != "por_fonte" else ""
+    contagem = {}
+    chunks = {}
+    for fonte in fontes:
+        gerados = gerar_chunks(fonte, docs=copy.deepcopy(docs_por_fonte[fonte.nome]))
+        contagem[fonte.nome] = len(gerados)
+        chunks.update((id_, c.page_content) for id_, c in gerados.items())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        buscar, tamanho = buscador(chunks, args.busca, args.k, tmp)
+        acertos = 0
+        total_tokens = 0
+        for consulta in consultas:
+            textos = buscar(consulta["pergunta"])
+            esperado = _normalizar(consulta["esperado"])
+            acertos += any(esperado in _normalizar(t) for t in textos)
+            prompt = PROMPT_RESPOSTA.format(context="\n\n".join(textos), question=consulta["pergunta"],
+                                            chat_history="")
+            total_tokens += tokens(prompt)
+
+    n = max(len(consultas), 1)
+    return {
+        "estrategia": nome,
+        "chunks": contagem,
+        "tamanho_medio": sum(map(len, chunks.values())) / max(len(chunks), 1),
+        "indice_mb": tamanho / 2 ** 20,
+        "acerto": acertos / n,
+        "tokens_prompt": total_tokens / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--busca", choices=("faiss", "bm25"), default="faiss")
+    parser.add_argument("--perguntas", help="JSONL com {\"pergunta\": ..., \"esperado\": ...} por linha")
+    args = parser.parse_args()
+
+    fontes = [f for f in fontes_padrao() if f.caminho.exists()]
+    docs_por_fonte = {f.nome: f.carregar(f.caminho) for f in fontes}
+    if args.perguntas:
+        with open(args.perguntas, encoding="utf-8") as f:
+            consultas = [json.loads(l) for l in f if l.strip()]
+    else:
+        consultas = consultas_geradas(docs_por_fonte)
+    tokens, descricao_tokens = contar_tokens()
+    print(f"{len(consultas)} consultas; busca {args.busca}; k={args.k}; tokens: {descricao_tokens}\n")
+
+    resultados = [avaliar(nome, fontes, docs_por_fonte, consultas, args, tokens)
+                  for nome in ("recursivo", "por_fonte")]
+
+    nomes = [f.nome for f in fontes]
+    print(f"{'Estratégia':<12}" + "".join(f"{n:>14}" for n in nomes)
+          + f"{'média chars':>13}{'índice MB':>11}{'acerto@' + str(args.k):>10}{'tokens':>9}")
+    for r in resultados:
+        print(f"{r['estrategia']:<12}" + "".join(f"{r['chunks'][n]:>14}" for n in nomes)
+              + f"{r['tamanho_medio']:>13.0f}{r['indice_mb']:>11.2f}{r['acerto']:>10.3f}{r['tokens_prompt']:>9.0f}")
+    print("\npor_fonte: " + ", ".join(f"{n}={chunking.ESTRATEGIAS_POR_FONTE.get(n, chunking.ESTRATEGIA_PADRAO)}"
+                                     for n in nomes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark dos tipos de índice FAISS: recall@k, latência p50/p99 e memória.
+
+Usa os vetores da versão publicada do índice (agente/vectorstore) como corpus. As
+consultas são vetores de chunks sorteados com ruído gaussiano (ou perguntas
+de um arquivo, embedadas com o backend configurado). A verdade de
+referência é a busca exata (Flat). Cada tipo é gravado em disco e medido em
+um processo separado, para que a memória residente (RSS) reflita só a carga
+daquele índice, com e sem mmap.
+
+Uso:
+  python benchmarks/benchmark_indices.py [--indice DIR] [--k 5] [--consultas 200]
+                                         [--replicar 1] [--perguntas arquivo.txt]
+"""
+
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import indices_faiss  # noqa: E402
+from recursos import EMBEDDINGS_CACHE_PATH, VECTORSTORE_PATH  # noqa: E402
+
+
+def _rss_kb():
+    with open("/proc/self/status") as f:
+        for linha in f:
+            if linha.startswith("VmRSS:"):
+                return int(linha.split()[1])
+    return 0
+
+
+def _medir(caminho, mmap, consultas, k, fila):
+    """Executado em processo filho: carrega o índice, busca e mede"""
+    antes = _rss_kb()
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    index = indices_faiss.ajustar_busca(faiss.read_index(caminho, flags))
+    tempos = []
+    resultados = []
+    for q in consultas:
+        inicio = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        tempos.append(time.perf_counter() - inicio)
+        resultados.append(ids[0])
+    fila.put((np.array(resultados), np.array(tempos), _rss_kb() - antes))
+
+
+def medir_em_subprocesso(caminho, mmap, consultas, k):
+    contexto = multiprocessing.get_context("spawn")
+    fila = contexto.Queue()
+    processo = contexto.Process(target=_medir, args=(str(caminho), mmap, consultas, k, fila))
+    processo.start()
+    resultado = fila.get()
+    processo.join()
+    return resultado
+
+
+def recall_at_k(resultados, referencia):
+    acertos = [len(set(r) & set(g)) / len(g) for r, g in zip(resultados, referencia)]
+    return float(np.mean(acertos))
+
+
+def carregar_vetores(diretorio):
+    """Vetores exatos do índice salvo (reembeda via cache se não for Flat)"""
+    index = faiss.read_index(str(Path(diretorio) / "index.faiss"))
+    if indices_faiss.tipo_do_indice(index) == "Flat":
+        return index.reconstruct_n(0, index.ntotal)
+    from cache_embeddings import criar_embeddings
+    vectorstore = indices_faiss.carregar_local(
+        diretorio, criar_embeddings(EMBEDDINGS_CACHE_PATH), mmap=False
+    )
+    indices_faiss.para_flat_mutavel(vectorstore, vectorstore.embeddings)
+    return vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+
+
+def gerar_consultas(vetores, n, perguntas=None, semente=42):
+    if perguntas:
+        from cache_embeddings import criar_embeddings_backend
+        textos = [l.strip() for l in Path(perguntas).read_text(encoding="utf-8").splitlines() if l.strip()]
+        return np.array(criar_embeddings_backend().embed_documents(textos), dtype=np.float32)
+    rng = np.random.default_rng(semente)
+    escolhidos = vetores[rng.choice(len(vetores), size=min(n, len(vetores)), replace=False)]
+    escala = np.linalg.norm(escolhidos, axis=1, keepdims=True) * 0.05 / np.sqrt(vetores.shape[1])
+    return (escolhidos + rng.normal(size=escolhidos.shape) * escala).astype(np.float32)
+
+
+def replicar(vetores, fator, semente=7):
+    """Simula um corpus maior: cópias com ruído dos vetores originais"""
+    if fator <= 1:
+        return vetores
+    rng = np.random.default_rng(semente)
+    escala = np.linalg.norm(vetores, axis=1, keepdims=True) * 0.1 / np.sqrt(vetores.shape[1])
+    copias = [vetores] + [vetores + rng.normal(size=vetores.shape) * escala for _ in range(fator - 1)]
+    return np.vstack(copias).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--indice", help="diretório de uma versão do índice (padrão: a publicada)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--replicar", type=int, default=1,
+                        help="multiplica o corpus com cópias ruidosas (simula mais documentos)")
+    parser.add_argument("--perguntas", help="arquivo com uma pergunta por linha")
+    args = parser.parse_args()
+
+    if args.indice is None:
+        from indice_versionado import caminho_versao, versao_publicada
+        nome = versao_publicada(VECTORSTORE_PATH)
+        if nome is None:
+            parser.error(f"nenhuma versão publicada em {VECTORSTORE_PATH}; rode o app ou indice_versionado.py")
+        args.indice = caminho_versao(nome, VECTORSTORE_PATH)
+    vetores = replicar(carregar_vetores(args.indice), args.replicar)
+    consultas = gerar_consultas(vetores, args.consultas, args.perguntas)
+    print(f"Corpus: {len(vetores)} vetores de dimensão {vetores.shape[1]}; "
+          f"{len(consultas)} consultas; k={args.k}\n")
+
+    referencia = None
+    linhas = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for tipo in indices_faiss.TIPOS_INDICE:
+            efetivo = indices_faiss.tipo_efetivo(tipo, len(vetores))
+            inicio = time.perf_counter()
+            index = indices_faiss.criar_indice(tipo, vetores)
+            construcao = time.perf_counter() - inicio
+            caminho = Path(tmp) / f"{tipo}.faiss"
+            faiss.write_index(index, str(caminho))
+            del index
+            for mmap in (False, True):
+                ids, tempos, rss = medir_em_subprocesso(caminho, mmap, consultas, args.k)
+                if referencia is None:
+                    referencia = ids
+                linhas.append((
+                    tipo if efetivo == tipo else f"{tipo}->{efetivo}",
+                    "sim" if mmap else "não",
+                    recall_at_k(ids, referencia),
+                    np.percentile(tempos, 50) * 1e3,
+                    np.percentile(tempos, 99) * 1e3,
+                    rss / 1024,
+                    caminho.stat().st_size / 2 ** 20,
+                    construcao,
+                ))
+
+    print(f"{'Índice':<18}{'mmap':<6}{'recall@' + str(args.k):>10}{'p50 ms':>9}{'p99 ms':>9}"
+          f"{'RSS MB':>9}{'disco MB':>10}{'build s':>9}")
+    for tipo, mmap, recall, p50, p99, rss, disco, construcao in linhas:
+        print(f"{tipo:<18}{mmap:<6}{recall:>10.3f}{p50:>9.3f}{p99:>9.3f}{rss:>9.1f}{disco:>10.1f}{construcao:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark da inicialização do app: tempo de importação antes do primeiro
+render e tempo até a primeira pergunta respondida.
+
+Cada medida roda em um processo novo (importações e índice a frio no
+interpretador; o cache de disco do sistema continua quente). Compara os
+módulos que o app importava no topo com os que importa agora, antes de
+iniciar o aquecimento em segundo plano, e mede as etapas do aquecimento
+(aquecimento.py) e a primeira pergunta feita assim que ele termina.
+SCR_LLM_BACKEND=fake e SCR_EMBEDDINGS_BACKEND=fake rodam sem API.
+
+Uso:
+  python benchmarks/benchmark_inicializacao.py [--repeticoes 5] [--modelo gpt-4o-mini]
+                                               [--pergunta "..."]
+"""
+
+import argparse
+import importlib.util
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+AGENTE_DIR = Path(__file__).resolve().parent.parent
+
+# Importados no topo do app antes do aquecimento em segundo plano
+MODULOS_ANTES = ("dotenv", "langchain.memory", "indexacao", "dicionario_leiaute", "indices_faiss",
+                 "recursos", "cache_embeddings", "remessa", "validacao", "streaming", "agentes",
+                 "memoria", "metricas", "roteador", "bm25", "cache_semantico", "busca_web")
+MODULOS_AGORA = ("dotenv", "aquecimento", "recursos")
+
+PERGUNTA = "Qual o prazo de envio do documento 3040 ao Banco Central?"
+
+
+def tempo_de_importacao(modulos, repeticoes):
+    """Mediana, em segundos, de importar os módulos em um processo novo"""
+    codigo = f"import time; t = time.perf_counter(); import {', '.join(modulos)}; print(time.perf_counter() - t)"
+    tempos = []
+    for _ in range(repeticoes):
+        saida = subprocess.run([sys.executable, "-c", codigo], cwd=AGENTE_DIR,
+                               capture_output=True, text=True, check=True)
+        tempos.append(float(saida.stdout.split()[-1]))
+    return statistics.median(tempos)
+
+
+def primeira_pergunta(args):
+    """Executado no processo filho: importação leve, aquecimento e primeira pergunta"""
+    sys.path.insert(0, str(AGENTE_DIR))
+    inicio = time.perf_counter()
+    from aquecimento import Aquecimento, carregar_recursos
+    interface = time.perf_counter() - inicio
+
+    aquecimento = Aquecimento(carregar_recursos).iniciar()
+    aquecimento.aguardar()
+    if aquecimento.erro is not None:
+        raise aquecimento.erro
+    pronto = time.perf_counter() - inicio
+
+    from memoria import criar_memoria
+    registro = aquecimento.resultado["registro_agentes"]
+    agente = registro.obter_agente({}, criar_memoria(registro.llm_resumo()), model_name=args.modelo)
+    inicio_pergunta = time.perf_counter()
+    agente.invoke({"question": args.pergunta})
+    print(json.dumps({
+        "interface": interface,
+        "pronto": pronto,
+        "pergunta": time.perf_counter() - inicio_pergunta,
+        "total": time.perf_counter() - inicio,
+        "etapas": aquecimento.etapas,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--modelo", default="gpt-4o-mini")
+    parser.add_argument("--pergunta", default=PERGUNTA)
+    parser.add_argument("--filho", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.filho:
+        primeira_pergunta(args)
+        return
+
+    com_streamlit = importlib.util.find_spec("streamlit") is not None
+    extras = ("streamlit",) if com_streamlit else ()
+    print(f"Importações antes do primeiro render (mediana de {args.repeticoes} processos"
+          f"{'' if com_streamlit else ', sem streamlit instalado'}):")
+    antes = tempo_de_importacao(extras + MODULOS_ANTES, args.repeticoes)
+    agora = tempo_de_importacao(extras + MODULOS_AGORA, args.repeticoes)
+    print(f"  {'antes (tudo no topo)':<28}{antes:>8.2f}s")
+    print(f"  {'agora (aquecimento à parte)':<28}{agora:>8.2f}s\n")
+
+    medidas = []
+    for _ in range(args.repeticoes):
+        saida = subprocess.run([sys.executable, __file__, "--filho", "--modelo", args.modelo,
+                                "--pergunta", args.pergunta],
+                               capture_output=True, text=True, check=True)
+        medidas.append(json.loads(saida.stdout.splitlines()[-1]))
+
+    def mediana(chave):
+        return statistics.median(m[chave] for m in medidas)
+
+    print(f"Inicialização a frio até a primeira pergunta ({args.modelo}; mediana de {args.repeticoes}):")
+    print(f"  {'interface utilizável':<28}{mediana('interface'):>8.2f}s")
+    for etapa in medidas[0]["etapas"]:
+        duracao = statistics.median(m["etapas"].get(etapa, 0.0) for m in medidas)
+        print(f"    {etapa:<26}{duracao:>8.2f}s")
+    print(f"  {'aquecimento concluído':<28}{mediana('pronto'):>8.2f}s")
+    print(f"  {'primeira pergunta':<28}{mediana('pergunta'):>8.2f}s")
+    print(f"  {'total até a resposta':<28}{mediana('total'):>8.2f}s")
+    # Antes, a carga do índice (sem as importações, já contadas) vinha depois das importações
+    carga = mediana("pronto") - mediana("interface") - statistics.median(
+        m["etapas"].get("Importando bibliotecas", 0.0) for m in medidas)
+    print(f"\nAntes, o título só aparecia depois das importações e da carga (~{antes + carga:.2f}s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark da memória das conversas: tamanho dos prompts ao longo de uma
+sessão longa, com o buffer completo e com o orçamento de tokens.
+
+Simula uma conversa de N turnos (perguntas sobre campos do leiaute e
+respostas do tamanho típico) e mede, a cada turno, os tokens do histórico
+e dos dois prompts que o recebem: a reescrita da pergunta (condense) e a
+resposta (com um contexto fixo do tamanho de k chunks). Os resumos do modo
+orçamento são feitos pelo LLM de resumo do backend configurado
+(SCR_LLM_BACKEND=fake roda sem API).
+
+Uso:
+  python benchmarks/benchmark_memoria.py [--turnos 100] [--resposta 1200]
+                                         [--contexto 7500]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain.chains.conversational_retrieval.base import _get_chat_history  # noqa: E402
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT  # noqa: E402
+
+from agentes import PROMPT_RESPOSTA, RegistroAgentes, backend_llm  # noqa: E402
+from memoria import contar_tokens, criar_memoria  # noqa: E402
+
+CAMPOS = ["DtBase", "CNPJ", "TpCli", "Autorzc", "PorteCli", "IniRelactCli", "FatAnual",
+          "Contrt", "Mod", "OrigemRec", "Indx", "VarCamb", "DtVencOp", "ClassOp", "CEP"]
+MARCOS = (1, 5, 10, 25, 50, 75, 100)
+
+
+def conversa(turnos, tamanho_resposta):
+    """Pares (pergunta, resposta) sintéticos, com o tamanho de resposta pedido"""
+    frase = ("O preenchimento segue o leiaute do documento 3040, observando o domínio do "
+             "atributo, a data-base da remessa e as críticas aplicáveis ao campo. ")
+    for i in range(turnos):
+        campo = CAMPOS[i % len(CAMPOS)]
+        pergunta = f"E como devo preencher o atributo {campo} quando a operação é renegociada (caso {i + 1})?"
+        resposta = f"Para o atributo {campo}: " + (frase * (tamanho_resposta // len(frase) + 1))[:tamanho_resposta]
+        yield pergunta, resposta
+
+
+def simular(modo, args, llm_resumo):
+    memoria = criar_memoria(llm_resumo, modo=modo)
+    contexto = "x " * (args.contexto // 2)
+    medidas = []
+    tempo_memoria = 0.0
+    for pergunta, resposta in conversa(args.turnos, args.resposta):
+        historico = _get_chat_history(memoria.load_memory_variables({})["chat_history"])
+        medidas.append({
+            "historico": contar_tokens(historico),
+            "condense": contar_tokens(CONDENSE_QUESTION_PROMPT.format(chat_history=historico, question=pergunta)),
+            "resposta": contar_tokens(PROMPT_RESPOSTA.format(context=contexto, question=pergunta,
+                                                             chat_history=historico)),
+        })
+        inicio = time.perf_counter()
+        memoria.save_context({"question": pergunta}, {"answer": resposta})
+        tempo_memoria += time.perf_counter() - inicio
+    return medidas, tempo_memoria, getattr(memoria, "turnos_resumidos", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turnos", type=int, default=100)
+    parser.add_argument("--resposta", type=int, default=1200, help="caracteres por resposta")
+    parser.add_argument("--contexto", type=int, default=7500, help="caracteres do contexto recuperado")
+    args = parser.parse_args()
+
+    llm_resumo = RegistroAgentes().llm_resumo()
+    print(f"{args.turnos} turnos; respostas de {args.resposta} caracteres; backend {backend_llm()}\n")
+    marcos = [m for m in MARCOS if m <= args.turnos]
+    print(f"{'Modo':<10}{'Prompt':<10}" + "".join(f"{'t' + str(m):>8}" for m in marcos) + f"{'máx':>8}")
+    for modo in ("completa", "orcamento"):
+        medidas, tempo, resumidos = simular(modo, args, llm_resumo)
+        for chave in ("historico", "condense", "resposta"):
+            valores = [medidas[m - 1][chave] for m in marcos]
+            print(f"{modo:<10}{chave:<10}" + "".join(f"{v:>8}" for v in valores)
+                  + f"{max(m[chave] for m in medidas):>8}")
+        total = sum(m["condense"] + m["resposta"] for m in medidas)
+        print(f"{'':<10}tokens de entrada na sessão: {total}; turnos resumidos: {resumidos}; "
+              f"tempo na memória: {tempo:.2f}s\n")
+
+
+if __name__ == "__main__":
+    main()
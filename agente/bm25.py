@@ -0,0 +1,179 @@
+"""
+Índice lexical BM25 dos chunks do vectorstore e busca híbrida.
+
+Perguntas do SCR 3040 citam códigos exatos (v130, Mod 0299, CaracEspecial,
+ContInstFinRes4966, números de críticas) que a busca por embeddings nem
+sempre recupera. O índice invertido BM25 é gravado em bm25.json ao lado do
+índice FAISS e consultado em paralelo com a busca vetorial; as duas listas
+são combinadas por reciprocal rank fusion (RRF).
+"""
+
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from langchain_core.retrievers import BaseRetriever
+
+from texto import sem_acentos
+
+
+logger = logging.getLogger(__name__)
+
+BM25_NOME = "bm25.json"
+VERSAO_FORMATO = 1
+K1 = 1.5
+B = 0.75
+# Constante da fusão RRF (valor usual da literatura)
+K_RRF = 60
+
+_TOKEN = re.compile(r"[a-z0-9_]+")
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="busca_hibrida")
+
+
+def tokenizar(texto):
+    """Minúsculas, sem acentos; códigos como v130 e 0299 viram tokens inteiros"""
+    return _TOKEN.findall(sem_acentos(texto))
+
+
+class IndiceBM25:
+    """Índice invertido BM25 sobre os ids do docstore"""
+
+    def __init__(self, ids, comprimentos, postings, versao=None):
+        self.ids = ids
+        self.comprimentos = comprimentos
+        self.postings = postings
+        self.versao = versao
+        self.media_comprimento = (sum(comprimentos) / len(comprimentos)) if comprimentos else 0.0
+        n = len(ids)
+        self.idf = {
+            token: math.log(1 + (n - len(lista) + 0.5) / (len(lista) + 0.5))
+            for token, lista in postings.items()
+        }
+
+    @classmethod
+    def construir(cls, documentos, versao=None):
+        """documentos: iterável de (id, texto)"""
+        ids = []
+        comprimentos = []
+        postings = defaultdict(list)
+        for i, (id_, texto) in enumerate(documentos):
+            tokens = tokenizar(texto)
+            ids.append(id_)
+            comprimentos.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                postings[token].append((i, tf))
+        return cls(ids, comprimentos, dict(postings), versao)
+
+    @classmethod
+    def do_vectorstore(cls, vectorstore, versao=None):
+        """Constrói o índice a partir dos chunks do docstore do FAISS"""
+        ids = list(vectorstore.index_to_docstore_id.values())
+        return cls.construir(
+            ((id_, vectorstore.docstore.search(id_).page_content) for id_ in ids), versao
+        )
+
+    def buscar(self, consulta, n=10):
+        """Lista de (id, score) dos n chunks mais relevantes"""
+        scores = defaultdict(float)
+        media = self.media_comprimento or 1.0
+        for token in set(tokenizar(consulta)):
+            lista = self.postings.get(token)
+            if not lista:
+                continue
+            idf = self.idf[token]
+            for i, tf in lista:
+                norma = K1 * (1 - B + B * self.comprimentos[i] / media)
+                scores[i] += idf * tf * (K1 + 1) / (tf + norma)
+        melhores = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(self.ids[i], score) for i, score in melhores]
+
+    def salvar(self, diretorio):
+        caminho = Path(diretorio) / BM25_NOME
+        temporario = caminho.with_suffix(".json.tmp")
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump({
+                "versao_formato": VERSAO_FORMATO,
+                "versao": self.versao,
+                "ids": self.ids,
+                "comprimentos": self.comprimentos,
+                "postings": self.postings,
+            }, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temporario, caminho)
+
+    @classmethod
+    def carregar(cls, diretorio, versao=None):
+        """Índice salvo em diretorio, ou None se ausente ou de outra versão do índice"""
+        caminho = Path(diretorio) / BM25_NOME
+        if not caminho.exists():
+            return None
+        try:
+            with open(caminho, "r", encoding="utf-8") as f:
+                dados = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Índice BM25 ilegível (%s); será reconstruído", e)
+            return None
+        if dados.get("versao_formato") != VERSAO_FORMATO:
+            return None
+        if versao is not None and dados.get("versao") != versao:
+            return None
+        postings = {token: [tuple(p) for p in lista] for token, lista in dados["postings"].items()}
+        return cls(dados["ids"], dados["comprimentos"], postings, dados.get("versao"))
+
+
+def carregar_ou_construir(vectorstore, diretorio, versao):
+    """BM25 salvo para esta versão do índice, ou um novo (já gravado em disco)"""
+    indice = IndiceBM25.carregar(diretorio, versao)
+    if indice is not None:
+        return indice
+    indice = IndiceBM25.do_vectorstore(vectorstore, versao)
+    try:
+        indice.salvar(diretorio)
+    except OSError as e:
+        logger.warning("Não foi possível salvar o índice BM25: %s", e)
+    return indice
+
+
+def fundir_rrf(*rankings, k=K_RRF):
+    """Reciprocal rank fusion de listas de ids; retorna os ids ordenados"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for posicao, id_ in enumerate(ranking):
+            scores[id_] += 1.0 / (k + posicao + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class RetrieverHibrido(BaseRetriever):
+    """MMR no FAISS e BM25 consultados em paralelo e fundidos por RRF"""
+
+    vectorstore: Any
+    bm25: Any
+    k: int = 5
+    fetch_k: int = 10
+    lambda_mult: float = 0.7
+    candidatos: int = 10
+
+    def _busca_vetorial(self, consulta):
+        return self.vectorstore.max_marginal_relevance_search(
+            consulta, k=self.candidatos, fetch_k=max(self.fetch_k, self.candidatos * 2),
+            lambda_mult=self.lambda_mult
+        )
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        futuro_vetorial = _executor.submit(self._busca_vetorial, query)
+        lexicos = [id_ for id_, _ in self.bm25.buscar(query, self.candidatos)]
+        vetoriais = futuro_vetorial.result()
+
+        por_id = {doc.id: doc for doc in vetoriais if doc.id}
+        ordem = fundir_rrf([doc.id for doc in vetoriais], lexicos)[:self.k]
+        documentos = []
+        for id_ in ordem:
+            doc = por_id.get(id_) or self.vectorstore.docstore.search(id_)
+            if hasattr(doc, "page_content"):
+                documentos.append(doc)
+        return documentos
@@ -0,0 +1,173 @@
+"""
+Busca complementar na internet fora do caminho crítico da resposta.
+
+A consulta é disparada em segundo plano junto com a pergunta e só é
+exibida se terminar dentro do prazo. Resultados ficam em cache por
+consulta normalizada.
+
+O backend é escolhido pela variável de ambiente SCR_BUSCA_WEB_BACKEND:
+  - "duckduckgo" (padrão): DuckDuckGoSearchRun
+  - "stub": resposta fixa local, para ambientes sem internet
+  - "nenhuma": desativa a busca
+  - uma URL http(s): GET <url>?q=<consulta>, o corpo da resposta é o resultado
+Outros backends podem ser registrados com registrar_backend().
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from cache_embeddings import normalizar_texto
+
+
+logger = logging.getLogger(__name__)
+
+PRAZO_SEGUNDOS = 5.0
+MAX_BUSCAS_PARALELAS = 4
+MAX_ITENS_CACHE = 256
+TTL_CACHE_SEGUNDOS = 6 * 3600
+PREFIXO_CONSULTA = "SCR 3040 Banco Central"
+
+
+def _backend_duckduckgo():
+    from langchain_community.tools import DuckDuckGoSearchRun
+    busca = DuckDuckGoSearchRun()
+    return busca.run
+
+
+def _backend_stub():
+    return lambda consulta: f"[stub] Resultado simulado da busca na internet para: {consulta}"
+
+
+def _backend_url(url):
+    cliente = httpx.Client(timeout=PRAZO_SEGUNDOS)
+
+    def buscar(consulta):
+        resposta = cliente.get(url, params={"q": consulta})
+        resposta.raise_for_status()
+        return resposta.text
+    return buscar
+
+
+# nome -> fábrica que devolve uma função consulta -> texto
+BACKENDS = {
+    "duckduckgo": _backend_duckduckgo,
+    "stub": _backend_stub,
+}
+
+
+def registrar_backend(nome, fabrica):
+    BACKENDS[nome] = fabrica
+
+
+def criar_backend(nome=None):
+    """Função de busca do backend configurado (None se desativada)"""
+    nome = (nome or os.getenv("SCR_BUSCA_WEB_BACKEND", "duckduckgo")).strip()
+    if nome.lower() == "nenhuma":
+        return None
+    if nome.startswith(("http://", "https://")):
+        return _backend_url(nome)
+    if nome not in BACKENDS:
+        raise ValueError(f"Backend de busca web desconhecido: {nome}")
+    return BACKENDS[nome]()
+
+
+def normalizar_consulta(consulta):
+    return normalizar_texto(consulta).lower()
+
+
+class BuscaWeb:
+    """Executa buscas em segundo plano, com prazo e cache por consulta"""
+
+    def __init__(self, backend=None, prazo=PRAZO_SEGUNDOS, max_itens=MAX_ITENS_CACHE,
+                 ttl_segundos=TTL_CACHE_SEGUNDOS):
+        self.backend = backend
+        self.prazo = prazo
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_BUSCAS_PARALELAS,
+                                            thread_name_prefix="busca_web")
+
+    @property
+    def ativa(self):
+        return self.backend is not None
+
+    def _do_cache(self, chave):
+        with self._lock:
+            item = self._cache.get(chave)
+            if item is None:
+                return None
+            instante, texto = item
+            if time.time() - instante > self.ttl_segundos:
+                del self._cache[chave]
+                return None
+            self._cache.move_to_end(chave)
+            return texto
+
+    def _guardar(self, chave, texto):
+        with self._lock:
+            self._cache[chave] = (time.time(), texto)
+            self._cache.move_to_end(chave)
+            while len(self._cache) > self.max_itens:
+                self._cache.popitem(last=False)
+
+    def _executar(self, chave, consulta):
+        try:
+            texto = (self.backend(consulta) or "").strip()
+        except Exception as e:
+            logger.info("Busca web falhou para %r: %s", consulta, e)
+            return None
+        self._guardar(chave, texto)
+        return texto
+
+    def iniciar(self, pergunta):
+        """Dispara a busca da pergunta; retorna um BuscaEmAndamento (ou None se desativada)"""
+        if not self.ativa:
+            return None
+        consulta = f"{PREFIXO_CONSULTA} {pergunta}"
+        chave = normalizar_consulta(consulta)
+        inicio = time.monotonic()
+        texto = self._do_cache(chave)
+        if texto is not None:
+            return BuscaEmAndamento(None, texto, inicio, self.prazo)
+        futuro = self._executor.submit(self._executar, chave, consulta)
+        return BuscaEmAndamento(futuro, None, inicio, self.prazo)
+
+
+class BuscaEmAndamento:
+    """Busca disparada; resultado() espera no máximo até o prazo final"""
+
+    def __init__(self, futuro, texto, inicio, prazo):
+        self.futuro = futuro
+        self.texto = texto
+        self.inicio = inicio
+        self.prazo_final = inicio + prazo
+        self.fim = inicio if futuro is None else None
+        if futuro is not None:
+            futuro.add_done_callback(self._terminou)
+
+    def _terminou(self, futuro):
+        self.fim = time.monotonic()
+
+    @property
+    def duracao(self):
+        """Segundos até o resultado (0 se veio do cache); None se ainda não terminou"""
+        return None if self.fim is None else self.fim - self.inicio
+
+    def resultado(self):
+        """Texto encontrado, ou None se vazio, com erro ou fora do prazo"""
+        if self.futuro is None:
+            return self.texto or None
+        restante = max(0.0, self.prazo_final - time.monotonic())
+        try:
+            return self.futuro.result(timeout=restante) or None
+        except Exception:
+            # Fora do prazo: a busca termina em segundo plano e alimenta o cache
+            return None
@@ -0,0 +1,170 @@
+"""
+Cache persistente de embeddings em SQLite.
+
+Cada vetor é guardado pela chave (modelo de embedding, hash do texto
+normalizado do chunk). Numa reconstrução do índice só os chunks ainda não
+vistos são enviados ao backend, em lotes de tamanho fixo submetidos em
+paralelo.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from langchain_core.embeddings import Embeddings
+
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE_PADRAO = 256
+MAX_LOTES_PARALELOS = 4
+# Limite de parâmetros por consulta SQLite (SQLITE_MAX_VARIABLE_NUMBER antigo)
+_MAX_PARAMETROS = 500
+
+
+def normalizar_texto(texto):
+    """Normaliza unicode e espaços para que variações triviais compartilhem a chave"""
+    return " ".join(unicodedata.normalize("NFC", texto).split())
+
+
+def hash_texto(texto):
+    return hashlib.sha256(normalizar_texto(texto).encode("utf-8")).hexdigest()
+
+
+def nome_modelo_embeddings(embeddings):
+    """Identificador do modelo usado como parte da chave do cache"""
+    modelo = getattr(embeddings, "model", None)
+    if modelo:
+        return str(modelo)
+    tamanho = getattr(embeddings, "size", None)
+    nome = type(embeddings).__name__
+    return f"{nome}-{tamanho}" if tamanho else nome
+
+
+class EmbeddingsComCache(Embeddings):
+    """Envolve um backend de embeddings com cache em disco e lotes paralelos"""
+
+    def __init__(self, embeddings, caminho_db, tamanho_lote=TAMANHO_LOTE_PADRAO,
+                 max_lotes_paralelos=MAX_LOTES_PARALELOS):
+        self.embeddings = embeddings
+        self.caminho_db = Path(caminho_db)
+        self.tamanho_lote = tamanho_lote
+        self.max_lotes_paralelos = max_lotes_paralelos
+        self.modelo = nome_modelo_embeddings(embeddings)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.caminho_db.parent.mkdir(parents=True, exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " modelo TEXT NOT NULL,"
+                " hash TEXT NOT NULL,"
+                " vetor BLOB NOT NULL,"
+                " PRIMARY KEY (modelo, hash)"
+                ") WITHOUT ROWID"
+            )
+
+    def _conectar(self):
+        return sqlite3.connect(str(self.caminho_db), timeout=30)
+
+    def _buscar(self, hashes):
+        encontrados = {}
+        with self._conectar() as conn:
+            for i in range(0, len(hashes), _MAX_PARAMETROS):
+                grupo = hashes[i:i + _MAX_PARAMETROS]
+                marcadores = ",".join("?" * len(grupo))
+                linhas = conn.execute(
+                    f"SELECT hash, vetor FROM embeddings WHERE modelo = ? AND hash IN ({marcadores})",
+                    [self.modelo, *grupo],
+                )
+                for hash_, vetor in linhas:
+                    encontrados[hash_] = array("f", vetor).tolist()
+        return encontrados
+
+    def _gravar(self, vetores):
+        with self._conectar() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (modelo, hash, vetor) VALUES (?, ?, ?)",
+                [(self.modelo, h, array("f", v).tobytes()) for h, v in vetores.items()],
+            )
+
+    def embed_documents(self, texts):
+        hashes = [hash_texto(t) for t in texts]
+        encontrados = self._buscar(list(set(hashes)))
+
+        # Textos ausentes do cache, sem repetição, na ordem em que aparecem
+        pendentes = {}
+        for h, texto in zip(hashes, texts):
+            if h not in encontrados and h not in pendentes:
+                pendentes[h] = texto
+
+        with self._lock:
+            self.hits += len(texts) - sum(1 for h in hashes if h in pendentes)
+            self.misses += sum(1 for h in hashes if h in pendentes)
+
+        if pendentes:
+            itens = list(pendentes.items())
+            lotes = [itens[i:i + self.tamanho_lote] for i in range(0, len(itens), self.tamanho_lote)]
+            with ThreadPoolExecutor(max_workers=self.max_lotes_paralelos) as executor:
+                resultados = executor.map(
+                    lambda lote: self.embeddings.embed_documents([t for _, t in lote]),
+                    lotes,
+                )
+                novos = {}
+                for lote, vetores in zip(lotes, resultados):
+                    novos.update((h, v) for (h, _), v in zip(lote, vetores))
+            self._gravar(novos)
+            encontrados.update(novos)
+            logger.info(
+                "Embeddings: %d do cache, %d novos em %d lotes",
+                len(texts) - len(pendentes), len(pendentes), len(lotes),
+            )
+
+        return [encontrados[h] for h in hashes]
+
+    def embed_query(self, text):
+        # Consultas raramente se repetem literalmente; vão direto ao backend
+        return self.embeddings.embed_query(text)
+
+    def estatisticas(self):
+        """Contadores de acertos e faltas desde a criação"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "taxa_acerto": self.hits / total if total else 0.0,
+            }
+
+    def zerar_estatisticas(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+def criar_embeddings_backend():
+    """
+    Backend de embeddings conforme SCR_EMBEDDINGS_BACKEND.
+
+    "openai" (padrão) usa OpenAIEmbeddings; "fake" usa embeddings
+    determinísticos locais, para execução offline e testes.
+    """
+    backend = os.getenv("SCR_EMBEDDINGS_BACKEND", "openai").lower()
+    if backend == "fake":
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        return DeterministicFakeEmbedding(size=1536)
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings()
+
+
+def criar_embeddings(caminho_db):
+    """Embeddings do backend configurado, com cache persistente em caminho_db"""
+    return EmbeddingsComCache(criar_embeddings_backend(), caminho_db)
@@ -0,0 +1,213 @@
+"""
+Cache semântico de respostas do agente em SQLite.
+
+Perguntas com embedding suficientemente próximo (similaridade de cosseno
+acima do limiar) de uma já respondida, pelo mesmo modelo e sobre a mesma
+versão do índice, reaproveitam a resposta e os documentos-fonte sem passar
+pela reescrita da pergunta, pela busca e pelo LLM.
+
+As entradas expiram após ttl_segundos e, acima de max_itens, as menos
+usadas recentemente são descartadas (LRU). Entradas de outras versões do
+índice são apagadas por invalidar_outras_versoes().
+
+A chave é só a pergunta: quem usa o cache consulta e grava apenas
+perguntas que não dependem da conversa (sem histórico ou autocontidas,
+ver recuperacao.pergunta_autocontida); a resposta a uma pergunta de
+seguimento ("E o prazo?") é gravada pela pergunta reescrita pelo agente.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+from langchain.schema import Document
+
+from cache_embeddings import nome_modelo_embeddings, normalizar_texto
+
+
+logger = logging.getLogger(__name__)
+
+LIMIAR_SIMILARIDADE = 0.95
+MAX_ITENS = 1000
+TTL_SEGUNDOS = 7 * 24 * 3600
+
+
+@dataclass
+class RespostaCacheada:
+    pergunta: str
+    resposta: str
+    documentos: list = field(default_factory=list)
+    similaridade: float = 1.0
+    duracao_original: float = 0.0
+
+
+def _normalizar_vetor(vetor):
+    vetor = np.asarray(vetor, dtype=np.float32)
+    norma = np.linalg.norm(vetor)
+    return vetor / norma if norma else vetor
+
+
+def _documentos_para_json(documentos):
+    return json.dumps(
+        [{"page_content": d.page_content, "metadata": d.metadata} for d in documentos],
+        ensure_ascii=False, default=str
+    )
+
+
+def _documentos_de_json(texto):
+    return [Document(page_content=d["page_content"], metadata=d["metadata"])
+            for d in json.loads(texto)]
+
+
+class CacheSemantico:
+    """Cache de respostas por similaridade do embedding da pergunta"""
+
+    def __init__(self, embeddings, caminho_db, limiar=LIMIAR_SIMILARIDADE,
+                 max_itens=MAX_ITENS, ttl_segundos=TTL_SEGUNDOS):
+        self.embeddings = embeddings
+        self.modelo_embeddings = nome_modelo_embeddings(embeddings)
+        self.caminho_db = Path(caminho_db)
+        self.limiar = limiar
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        self.hits = 0
+        self.misses = 0
+        self.tempo_economizado = 0.0
+        self._lock = threading.Lock()
+        # (modelo, versao) -> (ids, matriz de vetores normalizados)
+        self._matrizes = {}
+        self.caminho_db.parent.mkdir(parents=True, exist_ok=True)
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS respostas ("
+                " id INTEGER PRIMARY KEY,"
+                " modelo_embeddings TEXT NOT NULL,"
+                " modelo TEXT NOT NULL,"
+                " versao_indice TEXT NOT NULL,"
+                " pergunta TEXT NOT NULL,"
+                " vetor BLOB NOT NULL,"
+                " resposta TEXT NOT NULL,"
+                " documentos TEXT NOT NULL,"
+                " duracao REAL NOT NULL,"
+                " criado REAL NOT NULL,"
+                " acessado REAL NOT NULL"
+                ")"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS respostas_chave"
+                " ON respostas (modelo_embeddings, modelo, versao_indice)"
+            )
+
+    def _conectar(self):
+        return sqlite3.connect(str(self.caminho_db), timeout=30)
+
+    def _matriz(self, conn, modelo, versao_indice):
+        chave = (modelo, versao_indice)
+        if chave not in self._matrizes:
+            linhas = conn.execute(
+                "SELECT id, vetor FROM respostas"
+                " WHERE modelo_embeddings = ? AND modelo = ? AND versao_indice = ?",
+                (self.modelo_embeddings, modelo, versao_indice)
+            ).fetchall()
+            ids = np.array([l[0] for l in linhas], dtype=np.int64)
+            if linhas:
+                matriz = np.vstack([np.frombuffer(l[1], dtype=np.float32) for l in linhas])
+            else:
+                matriz = np.empty((0, 0), dtype=np.float32)
+            self._matrizes[chave] = (ids, matriz)
+        return self._matrizes[chave]
+
+    def vetor(self, pergunta):
+        """Embedding normalizado da pergunta (reutilizável em gravar)"""
+        return _normalizar_vetor(self.embeddings.embed_query(normalizar_texto(pergunta)))
+
+    def buscar(self, pergunta, modelo, versao_indice, vetor=None):
+        """Resposta cacheada mais próxima acima do limiar e não expirada, ou None"""
+        if vetor is None:
+            vetor = self.vetor(pergunta)
+        agora = time.time()
+        with self._lock, self._conectar() as conn:
+            ids, matriz = self._matriz(conn, modelo, versao_indice)
+            if not len(ids) or matriz.shape[1] != len(vetor):
+                self.misses += 1
+                return None
+            similaridades = matriz @ vetor
+            candidatos = np.flatnonzero(similaridades >= self.limiar)
+            # Da mais para a menos similar: uma entrada expirada não esconde a seguinte
+            for melhor in candidatos[np.argsort(-similaridades[candidatos])]:
+                linha = conn.execute(
+                    "SELECT pergunta, resposta, documentos, duracao, criado FROM respostas WHERE id = ?",
+                    (int(ids[melhor]),)
+                ).fetchone()
+                if linha is not None and agora - linha[4] <= self.ttl_segundos:
+                    break
+            else:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE respostas SET acessado = ? WHERE id = ?", (agora, int(ids[melhor])))
+            self.hits += 1
+            self.tempo_economizado += linha[3]
+        return RespostaCacheada(
+            pergunta=linha[0],
+            resposta=linha[1],
+            documentos=_documentos_de_json(linha[2]),
+            similaridade=float(similaridades[melhor]),
+            duracao_original=linha[3],
+        )
+
+    def gravar(self, pergunta, modelo, versao_indice, resposta, documentos, duracao, vetor=None):
+        """Guarda a resposta e aplica as políticas de expiração e LRU"""
+        if vetor is None:
+            vetor = self.vetor(pergunta)
+        agora = time.time()
+        with self._lock, self._conectar() as conn:
+            conn.execute(
+                "INSERT INTO respostas (modelo_embeddings, modelo, versao_indice, pergunta, vetor,"
+                " resposta, documentos, duracao, criado, acessado)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.modelo_embeddings, modelo, versao_indice, pergunta,
+                 array("f", np.asarray(vetor, dtype=np.float32)).tobytes(),
+                 resposta, _documentos_para_json(documentos), duracao, agora, agora)
+            )
+            self._despejar(conn, agora)
+            self._matrizes.clear()
+
+    def _despejar(self, conn, agora):
+        conn.execute("DELETE FROM respostas WHERE criado < ?", (agora - self.ttl_segundos,))
+        conn.execute(
+            "DELETE FROM respostas WHERE id IN ("
+            " SELECT id FROM respostas ORDER BY acessado DESC LIMIT -1 OFFSET ?)",
+            (self.max_itens,)
+        )
+
+    def invalidar_outras_versoes(self, versao_indice):
+        """Remove respostas calculadas sobre outras versões do índice"""
+        with self._lock, self._conectar() as conn:
+            removidas = conn.execute(
+                "DELETE FROM respostas WHERE versao_indice != ?", (versao_indice,)
+            ).rowcount
+            self._matrizes.clear()
+        if removidas:
+            logger.info("Cache semântico: %d respostas de versões anteriores removidas", removidas)
+        return removidas
+
+    def limpar(self):
+        with self._lock, self._conectar() as conn:
+            conn.execute("DELETE FROM respostas")
+            self._matrizes.clear()
+
+    def estatisticas(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "taxa_acerto": self.hits / total if total else 0.0,
+            "tempo_economizado": self.tempo_economizado,
+        }
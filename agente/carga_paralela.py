@@ -0,0 +1,81 @@
+"""
+Carga paralela das fontes do vectorstore.
+
+Cada fonte vira uma ou mais tarefas executadas em um pool de processos
+(o parsing de PDF e de planilhas é CPU-bound e não escala com threads).
+Uma fonte pode ter um particionar(caminho, n_partes) (Fonte.particionar)
+que devolve tarefas (funcao, argumentos) para partes da fonte, por exemplo
+faixas de páginas de um PDF. Os resultados são concatenados na ordem das
+fontes e das partes, então o resultado é idêntico ao da carga sequencial.
+
+O número de processos vem de SCR_PROCESSOS_CARGA (padrão: núcleos da
+máquina); 1 desliga o pool.
+"""
+
+import logging
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+logger = logging.getLogger(__name__)
+
+
+def processos_configurados():
+    valor = os.getenv("SCR_PROCESSOS_CARGA")
+    if valor:
+        return max(1, int(valor))
+    return os.cpu_count() or 1
+
+
+def _tarefas_da_fonte(fonte, processos):
+    if fonte.particionar is not None and processos > 1:
+        return fonte.particionar(fonte.caminho, processos)
+    return [(fonte.carregar, (fonte.caminho,))]
+
+
+def _serializavel(funcao):
+    try:
+        pickle.dumps(funcao)
+        return True
+    except Exception:
+        return False
+
+
+def _executar(funcao, argumentos):
+    return funcao(*argumentos)
+
+
+def carregar_fontes(fontes, processos=None):
+    """Carrega as fontes em paralelo; retorna a lista de documentos de cada fonte, na ordem"""
+    processos = processos or processos_configurados()
+    tarefas = [
+        (i, tarefa)
+        for i, fonte in enumerate(fontes)
+        for tarefa in _tarefas_da_fonte(fonte, processos)
+    ]
+    resultados = [None] * len(tarefas)
+
+    no_pool = [j for j, (_, (funcao, _)) in enumerate(tarefas) if _serializavel(funcao)]
+    if processos > 1 and len(no_pool) > 1:
+        # spawn: o processo principal (Streamlit) tem threads, fork não é seguro
+        contexto = multiprocessing.get_context("spawn")
+        try:
+            with ProcessPoolExecutor(min(processos, len(no_pool)), mp_context=contexto) as pool:
+                futuros = {j: pool.submit(_executar, *tarefas[j][1]) for j in no_pool}
+                for j, futuro in futuros.items():
+                    resultados[j] = futuro.result()
+        except BrokenProcessPool as e:
+            logger.warning("Pool de carga indisponível (%s); carregando sequencialmente", e)
+            resultados = [None] * len(tarefas)
+
+    for j, (_, (funcao, argumentos)) in enumerate(tarefas):
+        if resultados[j] is None:
+            resultados[j] = _executar(funcao, argumentos)
+
+    documentos = [[] for _ in fontes]
+    for (i, _), docs in zip(tarefas, resultados):
+        documentos[i].extend(docs)
+    return documentos
@@ -0,0 +1,222 @@
+"""
+Divisão dos documentos em chunks, com uma estratégia por fonte.
+
+  - recursivo: RecursiveCharacterTextSplitter em tudo (comportamento original)
+  - secoes_pdf: segue as seções do PDF de instruções (A., 1., IV., ...),
+    sem cortar um item no meio sempre que ele cabe em um chunk, e prefixa
+    cada chunk com o caminho da seção
+  - grupos_de_linhas: planilhas com um registro por linha; agrupa linhas
+    inteiras e repete a linha de cabeçalho do documento em cada chunk
+  - elementos_xml: agrupa elementos filhos inteiros de <Cli>/<Op>,
+    repetindo a tag e os atributos do pai em cada chunk
+
+A estratégia de cada fonte vem de ESTRATEGIAS_POR_FONTE; SCR_CHUNKING
+força uma única estratégia para todas (ex.: "recursivo" para comparar).
+Partes que não cabem em um chunk caem no splitter recursivo.
+"""
+
+import os
+import re
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+
+# Parâmetros de chunking; se mudarem, todas as fontes são reprocessadas
+CONFIG_CHUNKING = {
+    "chunk_size": 1500,
+    "chunk_overlap": 200,
+    "separators": ["\n\n", "\n", ". ", " ", ""],
+}
+
+ESTRATEGIA_PADRAO = "recursivo"
+ESTRATEGIAS_POR_FONTE = {
+    "PDF": "secoes_pdf",
+    "XLS_Leiaute": "grupos_de_linhas",
+    "XLS_Criticas": "grupos_de_linhas",
+    "XML": "elementos_xml",
+}
+
+# Cabeçalho repetido em todas as páginas do PDF de instruções
+_CABECALHO_PAGINA = re.compile(
+    r"^\s*(SCR\s*[–-]\s*Sistema de Informações de Crédito.*Instruções de Preenchimento|Página\s+\d+)\s*$"
+)
+_SECAO_LETRA = re.compile(r"^([A-Z])\.\s+\S")
+_SECAO_NUMERO = re.compile(r"^\d{1,2}\.\s+\S")
+_SECAO_ROMANO = re.compile(r"^[IVXL]{1,6}\.\s+\S")
+# Linhas do sumário ("A. Instruções Gerais ......... 3") não abrem seção
+_SUMARIO = re.compile(r"\.{5,}|\.{3,}\s*\d+\s*$")
+# Títulos longos (itens romanos são frases) são truncados no prefixo
+_MAX_TITULO = 90
+
+
+def criar_text_splitter():
+    """Cria o splitter padrão (estratégia recursivo e fallback das demais)"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CONFIG_CHUNKING["chunk_size"],
+        chunk_overlap=CONFIG_CHUNKING["chunk_overlap"],
+        length_function=len,
+        separators=CONFIG_CHUNKING["separators"]
+    )
+
+
+def _splitter_para(espaco, splitter):
+    """Splitter do fallback, reduzido para caber junto com o cabeçalho"""
+    if espaco >= CONFIG_CHUNKING["chunk_size"]:
+        return splitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=espaco,
+        chunk_overlap=min(CONFIG_CHUNKING["chunk_overlap"], espaco // 4),
+        length_function=len,
+        separators=CONFIG_CHUNKING["separators"]
+    )
+
+
+def estrategia_da_fonte(nome_fonte):
+    forcada = os.getenv("SCR_CHUNKING")
+    if forcada:
+        if forcada not in ESTRATEGIAS:
+            raise ValueError(f"SCR_CHUNKING inválido: {forcada} (opções: {', '.join(ESTRATEGIAS)})")
+        return forcada
+    return ESTRATEGIAS_POR_FONTE.get(nome_fonte, ESTRATEGIA_PADRAO)
+
+
+def _agrupar(cabecalho, blocos, splitter):
+    """
+    Junta blocos (texto, metadata) inteiros em chunks de até chunk_size,
+    cada um começando pelo cabeçalho. A metadata do chunk é a do primeiro
+    bloco. Um bloco maior que o espaço disponível é dividido pelo splitter.
+    """
+    limite = CONFIG_CHUNKING["chunk_size"]
+    prefixo = f"{cabecalho}\n" if cabecalho else ""
+    espaco = max(limite - len(prefixo), limite // 2)
+    splitter = _splitter_para(espaco, splitter)
+    chunks = []
+    atual, metadata, tamanho = [], None, 0
+
+    def emitir():
+        chunks.append(Document(page_content=prefixo + "\n".join(atual), metadata=dict(metadata)))
+
+    for texto, meta in blocos:
+        if len(texto) > espaco:
+            if atual:
+                emitir()
+                atual, tamanho = [], 0
+            for parte in splitter.split_text(texto):
+                chunks.append(Document(page_content=prefixo + parte, metadata=dict(meta)))
+            continue
+        if atual and tamanho + len(texto) + 1 > espaco:
+            emitir()
+            atual, tamanho = [], 0
+        if not atual:
+            metadata = meta
+        atual.append(texto)
+        tamanho += len(texto) + 1
+    if atual:
+        emitir()
+    return chunks
+
+
+def dividir_recursivo(docs, splitter):
+    return splitter.split_documents(docs)
+
+
+def dividir_secoes_pdf(docs, splitter):
+    """Seções A./1./I. do PDF de instruções, atravessando quebras de página"""
+    secoes = []
+    letra = numero = None
+    proxima_letra = "A"
+    atual = None
+    for doc in docs:
+        for linha in doc.page_content.split("\n"):
+            if _CABECALHO_PAGINA.match(linha) or not linha.strip():
+                continue
+            titulo = linha.strip()
+            nova = False
+            if not _SUMARIO.search(titulo):
+                m = _SECAO_LETRA.match(titulo)
+                # "I." é seção de letra só quando é a próxima letra esperada; senão é romano
+                if m and m.group(1) == proxima_letra:
+                    letra, numero = titulo[:_MAX_TITULO], None
+                    proxima_letra = chr(ord(proxima_letra) + 1)
+                    nova = True
+                elif _SECAO_NUMERO.match(titulo):
+                    numero = titulo[:_MAX_TITULO]
+                    nova = True
+                elif _SECAO_ROMANO.match(titulo):
+                    nova = True
+            if nova or atual is None:
+                atual = {"caminho": tuple(t for t in (letra, numero) if t), "linhas": [], "metadata": doc.metadata}
+                secoes.append(atual)
+            atual["linhas"].append(titulo)
+
+    chunks = []
+    i = 0
+    while i < len(secoes):
+        # Seções consecutivas sob o mesmo caminho são empacotadas juntas
+        caminho = secoes[i]["caminho"]
+        grupo = []
+        while i < len(secoes) and secoes[i]["caminho"] == caminho:
+            grupo.append(("\n".join(secoes[i]["linhas"]), secoes[i]["metadata"]))
+            i += 1
+        cabecalho = f"[{' > '.join(caminho)}]" if caminho else ""
+        for chunk in _agrupar(cabecalho, grupo, splitter):
+            if caminho:
+                chunk.metadata["secao"] = " > ".join(caminho)
+            chunks.append(chunk)
+    return chunks
+
+
+def dividir_grupos_de_linhas(docs, splitter):
+    """Documentos tabulares: a primeira linha é o cabeçalho, cada linha seguinte um registro"""
+    chunks = []
+    for doc in docs:
+        if len(doc.page_content) <= CONFIG_CHUNKING["chunk_size"]:
+            chunks.append(doc)
+            continue
+        cabecalho, *linhas = doc.page_content.split("\n")
+        chunks.extend(_agrupar(cabecalho, [(l, doc.metadata) for l in linhas if l.strip()], splitter))
+    return chunks
+
+
+def _blocos_xml(texto):
+    """Separa o texto de um elemento (formatado por doc3040) em cabeçalho e filhos"""
+    linhas = texto.split("\n")
+    padrao = re.compile(r"^  Tag: <") if any(l.startswith("  Tag: <") for l in linhas) \
+        else re.compile(r"^Tag: <")
+    cabecalho, blocos = [], []
+    for linha in linhas:
+        if padrao.match(linha):
+            blocos.append([linha])
+        elif blocos:
+            blocos[-1].append(linha)
+        else:
+            cabecalho.append(linha)
+    return "\n".join(cabecalho).rstrip(), ["\n".join(b).rstrip() for b in blocos]
+
+
+def dividir_elementos_xml(docs, splitter):
+    chunks = []
+    for doc in docs:
+        if len(doc.page_content) <= CONFIG_CHUNKING["chunk_size"]:
+            chunks.append(doc)
+            continue
+        cabecalho, blocos = _blocos_xml(doc.page_content)
+        if not blocos:
+            chunks.extend(splitter.split_documents([doc]))
+            continue
+        chunks.extend(_agrupar(cabecalho, [(b, doc.metadata) for b in blocos], splitter))
+    return chunks
+
+
+ESTRATEGIAS = {
+    "recursivo": dividir_recursivo,
+    "secoes_pdf": dividir_secoes_pdf,
+    "grupos_de_linhas": dividir_grupos_de_linhas,
+    "elementos_xml": dividir_elementos_xml,
+}
+
+
+def dividir(docs, estrategia, splitter=None):
+    """Divide os documentos de uma fonte com a estratégia dada"""
+    return ESTRATEGIAS[estrategia](docs, splitter or criar_text_splitter())
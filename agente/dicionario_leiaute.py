@@ -0,0 +1,479 @@
+"""
+Dicionário estruturado de campos a partir do SCR3040_Leiaute.xls.
+
+A planilha "Doc3040" vira um dicionário tag -> atributo -> campo (formato,
+tipo, tamanho, obrigatoriedade, descrição, observações e anexos de
+domínio), e as planilhas "Anexo" e "Anexo 26 - InfosAdicionais" viram as
+tabelas de domínio. O resultado é gravado em JSON compacto (chaveado pelo
+hash da planilha) para não reler o XLS a cada inicialização.
+
+Perguntas de consulta pura ("o que é o campo IPOC?", "qual o formato de
+DtVencOp?", "o que significa v130?") são respondidas direto do dicionário,
+sem LLM. As fichas de cada campo também alimentam a busca no lugar dos
+chunks de texto da planilha.
+"""
+
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+import pandas as pd
+from langchain.schema import Document
+
+from indexacao import hash_arquivo
+from texto import sem_acentos
+
+
+logger = logging.getLogger(__name__)
+
+VERSAO_FORMATO = 1
+ABA_CAMPOS = "Doc3040"
+ABA_ANEXOS = "Anexo"
+ABA_ANEXO_26 = "Anexo 26 - InfosAdicionais"
+
+_TIPOS_FORMATO = {"A": "alfanumérico", "N": "numérico", "I": "inteiro"}
+_ANEXO = re.compile(r"Anexo\s*(\d+)", re.IGNORECASE)
+_TITULO_ANEXO = re.compile(r"^\s*Anexo\s*(\d+)\s*:\s*(.+)$", re.IGNORECASE | re.DOTALL)
+_IDENTIFICADOR = re.compile(r"^[A-Za-z][A-Za-z0-9]*$")
+_VENCIMENTO = re.compile(r"\bv(\d{2,3})\b", re.IGNORECASE)
+
+# Perguntas de consulta (respondíveis pelo dicionário) ...
+_PALAVRAS_CONSULTA = (
+    "o que e", "o que significa", "significado", "qual o formato", "qual formato",
+    "formato", "tamanho", "tipo do campo", "tipo de dado", "dominio", "valores possiveis",
+    "quais os valores", "descricao", "definicao", "obrigatorio", "e obrigatorio",
+    "quantas posicoes", "quantos caracteres",
+)
+# ... e marcadores de perguntas interpretativas, que vão para o LLM
+_PALAVRAS_INTERPRETACAO = (
+    "como ", "quando ", "por que", "porque", "devo", "posso", "deve ", "exemplo",
+    "diferenca", "explique", "situacao", "caso ", "se a operacao", "se o cliente",
+)
+MAX_PALAVRAS_CONSULTA = 14
+
+
+def _texto(valor):
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return ""
+    return " ".join(str(valor).split())
+
+
+def interpretar_formato(formato):
+    """'A14' -> ('alfanumérico', 14, None); 'N19,2' -> ('numérico', 19, 2)"""
+    m = re.search(r"([ANI])\s*(\d+)(?:\s*,\s*(\d+))?", formato or "")
+    if not m:
+        return None, None, None
+    decimais = int(m.group(3)) if m.group(3) else None
+    return _TIPOS_FORMATO[m.group(1)], int(m.group(2)), decimais
+
+
+@dataclass
+class Campo:
+    """Atributo de uma tag do leiaute"""
+    tag: str
+    atributo: str
+    nome: str = ""
+    formato: str = ""
+    obrigatorio: str = ""
+    descricao: str = ""
+    observacoes: list = field(default_factory=list)
+    fidc: str = ""
+    anexos: list = field(default_factory=list)
+
+    @property
+    def tipo(self):
+        return interpretar_formato(self.formato)[0]
+
+    @property
+    def tamanho(self):
+        return interpretar_formato(self.formato)[1]
+
+    def descrever_formato(self):
+        tipo, tamanho, decimais = interpretar_formato(self.formato)
+        if tipo is None:
+            return self.formato or "não especificado"
+        texto = f"{self.formato} ({tipo}, {tamanho} {'posição' if tamanho == 1 else 'posições'}"
+        if decimais:
+            texto += f", {decimais} decimais"
+        return texto + ")"
+
+
+@dataclass
+class Anexo:
+    """Tabela de domínio de um anexo do leiaute"""
+    numero: int
+    titulo: str
+    valores: dict = field(default_factory=dict)
+    subdominios: dict = field(default_factory=dict)
+
+
+class DicionarioLeiaute:
+    """Campos por tag e atributo, e tabelas de domínio por número de anexo"""
+
+    def __init__(self, campos, anexos, hash_planilha=None):
+        self.campos = {}
+        for campo in campos:
+            self.campos.setdefault(campo.tag, {})[campo.atributo] = campo
+        self.anexos = {anexo.numero: anexo for anexo in anexos}
+        self.hash_planilha = hash_planilha
+        # atributo (minúsculo) -> campos com esse nome em qualquer tag
+        self._por_nome = {}
+        for campo in campos:
+            self._por_nome.setdefault(campo.atributo.lower(), []).append(campo)
+        self._tags = {tag.lower(): tag for tag in self.campos}
+
+    def __len__(self):
+        return sum(len(atributos) for atributos in self.campos.values())
+
+    def campo(self, tag, atributo):
+        return self.campos.get(tag, {}).get(atributo)
+
+    def buscar_atributo(self, atributo, tag=None):
+        campos = self._por_nome.get(atributo.lower(), [])
+        if tag:
+            campos = [c for c in campos if c.tag.lower() == tag.lower()]
+        return campos
+
+    # -- Persistência --------------------------------------------------
+
+    def para_json(self):
+        return {
+            "versao_formato": VERSAO_FORMATO,
+            "hash_planilha": self.hash_planilha,
+            "campos": [asdict(c) for atributos in self.campos.values() for c in atributos.values()],
+            "anexos": [asdict(a) for a in self.anexos.values()],
+        }
+
+    @classmethod
+    def de_json(cls, dados):
+        return cls(
+            [Campo(**c) for c in dados["campos"]],
+            [Anexo(numero=a["numero"], titulo=a["titulo"], valores=a["valores"],
+                   subdominios=a["subdominios"]) for a in dados["anexos"]],
+            dados.get("hash_planilha"),
+        )
+
+    def salvar(self, caminho):
+        caminho = Path(caminho)
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        temporario = caminho.with_suffix(caminho.suffix + ".tmp")
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(self.para_json(), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temporario, caminho)
+
+    # -- Fichas para a busca -------------------------------------------
+
+    def ficha(self, campo, max_valores=40):
+        """Texto de consulta de um campo, com o domínio resumido"""
+        linhas = [
+            f"Campo do leiaute SCR 3040: {campo.nome or campo.atributo}",
+            f"Tag: <{campo.tag}>  Atributo: {campo.atributo}",
+            f"Formato: {campo.descrever_formato()}",
+        ]
+        if campo.obrigatorio:
+            linhas.append(f"Obrigatório: {campo.obrigatorio}")
+        if campo.descricao:
+            linhas.append(f"Descrição: {campo.descricao}")
+        for obs in campo.observacoes:
+            linhas.append(f"Observação: {obs}")
+        if campo.fidc and campo.fidc != "normal":
+            linhas.append(f"FIDCs: {campo.fidc}")
+        for numero in campo.anexos:
+            anexo = self.anexos.get(numero)
+            if not anexo:
+                continue
+            valores = list(anexo.valores.items())
+            linhas.append(f"Domínio (Anexo {numero} - {anexo.titulo}):")
+            linhas.extend(f"  {cod}: {desc}" for cod, desc in valores[:max_valores])
+            if len(valores) > max_valores:
+                linhas.append(f"  ... ({len(valores) - max_valores} valores adicionais no Anexo {numero})")
+        return "\n".join(linhas)
+
+    def documentos(self):
+        """Uma ficha por campo e um documento por anexo, para indexação"""
+        docs = []
+        for atributos in self.campos.values():
+            for campo in atributos.values():
+                docs.append(Document(
+                    page_content=self.ficha(campo),
+                    metadata={"source": "Leiaute", "type": "campo_leiaute",
+                              "tag": campo.tag, "atributo": campo.atributo}
+                ))
+        for anexo in self.anexos.values():
+            linhas = [f"Anexo {anexo.numero} do leiaute SCR 3040: {anexo.titulo}", "Domínio: descrição"]
+            for cod, desc in anexo.valores.items():
+                linhas.append(f"{cod}: {desc}")
+                for sub, desc_sub in anexo.subdominios.get(cod, {}).items():
+                    linhas.append(f"  {cod}.{sub}: {desc_sub}")
+            docs.append(Document(
+                page_content="\n".join(linhas),
+                metadata={"source": "Leiaute", "type": "anexo_leiaute", "anexo": anexo.numero}
+            ))
+        return docs
+
+    # -- Respostas diretas ---------------------------------------------
+
+    def _mencoes(self, pergunta):
+        """
+        Campos citados na pergunta (tag opcional + atributo); None se a
+        pergunta cita uma tag que não tem o atributo citado.
+        """
+        palavras = re.findall(r"[A-Za-z][A-Za-z0-9]*", pergunta)
+        tags = [self._tags[p.lower()] for p in palavras if p.lower() in self._tags]
+        encontrados = []
+        for palavra in palavras:
+            candidatos = self._por_nome.get(palavra.lower())
+            if not candidatos:
+                continue
+            # Nomes que são palavras comuns ("Valor", "Ordem") só contam com a grafia exata
+            comum = palavra[1:].islower() and not any(ch.isdigit() for ch in palavra)
+            if comum and palavra != candidatos[0].atributo:
+                continue
+            exatos = [c for c in candidatos if c.atributo == palavra]
+            candidatos = exatos or candidatos
+            if tags:
+                candidatos = [c for c in candidatos if c.tag in tags]
+                if not candidatos:
+                    return None
+            for c in candidatos:
+                if c not in encontrados:
+                    encontrados.append(c)
+        return encontrados
+
+    def campos_mencionados(self, pergunta):
+        """Campos do leiaute citados na pergunta"""
+        return self._mencoes(pergunta) or []
+
+    def _resposta_vencimento(self, codigo):
+        anexo = self.anexos.get(1)
+        if not anexo:
+            return None
+        descricao = anexo.valores.get(codigo)
+        if not descricao:
+            return None
+        return (
+            f"**v{codigo}** (atributo da tag `<Venc>`): {descricao}.\n\n"
+            f"Código de vencimento do Anexo 1 ({anexo.titulo})."
+        )
+
+    def responder(self, pergunta):
+        """
+        Resposta direta para perguntas de consulta sobre um campo ou código
+        de vencimento; None se a pergunta exige interpretação (vai ao LLM).
+        """
+        normalizada = sem_acentos(pergunta)
+        if len(normalizada.split()) > MAX_PALAVRAS_CONSULTA:
+            return None
+        if any(p in normalizada for p in _PALAVRAS_INTERPRETACAO):
+            return None
+        if not any(p in normalizada for p in _PALAVRAS_CONSULTA):
+            return None
+
+        vencimentos = _VENCIMENTO.findall(pergunta)
+        mencoes = self._mencoes(pergunta)
+        if mencoes is None:
+            return None
+        campos = [c for c in mencoes if not _VENCIMENTO.fullmatch(c.atributo)]
+        if len(vencimentos) == 1 and not campos:
+            return self._resposta_vencimento(vencimentos[0])
+        if not campos or len(campos) > 3 or vencimentos:
+            return None
+
+        partes = []
+        for campo in campos:
+            linhas = [
+                f"**{campo.atributo}** (tag `<{campo.tag}>`) — {campo.nome or campo.atributo}",
+                f"- **Formato:** {campo.descrever_formato()}",
+            ]
+            if campo.obrigatorio:
+                linhas.append(f"- **Obrigatório:** {campo.obrigatorio}")
+            if campo.descricao:
+                linhas.append(f"- **Descrição:** {campo.descricao}")
+            for obs in campo.observacoes:
+                linhas.append(f"- **Observação:** {obs}")
+            for numero in campo.anexos:
+                anexo = self.anexos.get(numero)
+                if anexo:
+                    valores = list(anexo.valores.items())
+                    amostra = "; ".join(f"{cod} = {desc}" for cod, desc in valores[:10])
+                    resto = f" (+{len(valores) - 10} no Anexo {numero})" if len(valores) > 10 else ""
+                    linhas.append(f"- **Domínio (Anexo {numero} – {anexo.titulo}):** {amostra}{resto}")
+            partes.append("\n".join(linhas))
+        return "\n\n".join(partes)
+
+
+# -- Leitura da planilha ----------------------------------------------------
+
+def _atributos_da_celula(texto):
+    """Uma célula pode listar vários atributos ('DtBase, CNPJ, Parte, ...')"""
+    nomes = []
+    for parte in re.split(r"[,\n]", texto):
+        parte = parte.strip().rstrip("*").strip()
+        if _IDENTIFICADOR.match(parte):
+            nomes.append(parte)
+    return nomes
+
+
+def _trecho_do_atributo(descricao, atributo):
+    """Em células com vários atributos, o trecho 'Atributo: ...' da descrição"""
+    m = re.search(rf"\b{re.escape(atributo)}\s*:\s*(.+?)(?:;|\n|$|(?=\b[A-Z][A-Za-z]+\s*:))", descricao)
+    return m.group(1).strip(" .,") if m else ""
+
+
+def ler_campos(caminho_xls):
+    planilha = pd.read_excel(caminho_xls, sheet_name=ABA_CAMPOS, header=3, dtype=str)
+    campos = {}
+    tag = None
+    ultimo = None
+    for _, linha in planilha.iterrows():
+        nome = _texto(linha.get("Campo"))
+        elemento = _texto(linha.get("Elemento (Tag)"))
+        atributo = _texto(linha.get("Atributo"))
+        descricao = _texto(linha.get("Descrição"))
+        observacao = _texto(linha.get("Observações"))
+        if nome == "Campo":
+            # Cabeçalho repetido no início de cada seção
+            continue
+        if elemento:
+            tag = elemento
+            ultimo = None
+            if not atributo:
+                continue
+        if not atributo:
+            # Linha de continuação: observações adicionais do último campo
+            if ultimo is not None and observacao and not nome:
+                for c in ultimo:
+                    c.observacoes.append(observacao)
+            elif nome and not any([descricao, observacao]):
+                ultimo = None
+            continue
+        if tag is None:
+            continue
+
+        # "Tp (concatenado)" é o subtipo do atributo Tp
+        base = atributo.split("(")[0].strip()
+        if base != atributo and (tag, base) in campos:
+            campos[(tag, base)].observacoes.append(f"{nome}: {descricao}")
+            ultimo = [campos[(tag, base)]]
+            continue
+
+        ultimo = []
+        nomes_atributos = _atributos_da_celula(atributo)
+        for nome_atributo in nomes_atributos:
+            descricao_atributo = descricao
+            if len(nomes_atributos) > 1:
+                descricao_atributo = _trecho_do_atributo(descricao, nome_atributo) or descricao
+            anexos = sorted({int(n) for n in _ANEXO.findall(f"{descricao_atributo} {observacao}")})
+            chave = (tag, nome_atributo)
+            if chave in campos:
+                # Mesmo atributo em outro contexto (ex.: <Venc> sob <Agreg>)
+                if descricao_atributo:
+                    campos[chave].observacoes.append(descricao_atributo)
+                ultimo.append(campos[chave])
+                continue
+            campo = Campo(
+                tag=tag,
+                atributo=nome_atributo,
+                nome=nome,
+                formato=_texto(linha.get("Formato")),
+                obrigatorio=_texto(linha.get("Obrigatório")),
+                descricao=descricao_atributo,
+                observacoes=[observacao] if observacao else [],
+                fidc=_texto(linha.get("FIDCs")),
+                anexos=anexos,
+            )
+            campos[chave] = campo
+            ultimo.append(campo)
+    return list(campos.values())
+
+
+def ler_anexos(caminho_xls):
+    planilha = pd.read_excel(caminho_xls, sheet_name=ABA_ANEXOS, header=None, dtype=str)
+    anexos = []
+    atual = None
+    dominio = None
+    for _, linha in planilha.iterrows():
+        celulas = [_texto(v) for v in linha.values]
+        primeira = celulas[0] if celulas else ""
+        m = _TITULO_ANEXO.match(primeira)
+        if m:
+            atual = Anexo(numero=int(m.group(1)), titulo=m.group(2).strip())
+            anexos.append(atual)
+            dominio = None
+            continue
+        if atual is None or primeira == "Domínio":
+            continue
+        codigo, descricao = celulas[0], celulas[1] if len(celulas) > 1 else ""
+        sub = celulas[2] if len(celulas) > 2 else ""
+        desc_sub = celulas[3] if len(celulas) > 3 else ""
+        if codigo and descricao:
+            atual.valores[codigo] = descricao
+            dominio = codigo
+        elif codigo and not descricao:
+            # Subtítulo dentro do anexo (ex.: "Pessoa Física")
+            dominio = None
+            continue
+        if sub and desc_sub and dominio:
+            atual.subdominios.setdefault(dominio, {})[sub] = desc_sub
+    return anexos
+
+
+def ler_anexo_26(caminho_xls):
+    """Tipos e subtipos de informações adicionais (<Inf Tp>)"""
+    planilha = pd.read_excel(caminho_xls, sheet_name=ABA_ANEXO_26, header=None, dtype=str)
+    anexo = Anexo(numero=26, titulo="Informações Adicionais - Inf")
+    tipo = None
+    for _, linha in planilha.iloc[3:].iterrows():
+        celulas = [_texto(v) for v in linha.values]
+        if celulas[0] and celulas[1]:
+            tipo = celulas[0]
+            anexo.valores[tipo] = celulas[1]
+        if tipo and len(celulas) > 3 and celulas[2] and celulas[3]:
+            detalhes = [f"{rotulo}: {valor}" for rotulo, valor in
+                        zip(("Cd", "Ident", "Valor", "Perc", "Qtd"), celulas[4:9]) if valor]
+            texto = celulas[3] + (f" ({'; '.join(detalhes)})" if detalhes else "")
+            anexo.subdominios.setdefault(tipo, {})[celulas[2]] = texto
+    return anexo
+
+
+def ler_planilha(caminho_xls):
+    """Monta o dicionário a partir da planilha do leiaute"""
+    anexos = ler_anexos(caminho_xls)
+    try:
+        anexos.append(ler_anexo_26(caminho_xls))
+    except ValueError as e:
+        logger.warning("Aba do Anexo 26 não lida: %s", e)
+    campos = ler_campos(caminho_xls)
+    # vCOD referencia o Anexo 1 pelo título, não pela descrição
+    for campo in campos:
+        if campo.atributo == "vCOD" and 1 not in campo.anexos:
+            campo.anexos.append(1)
+    return DicionarioLeiaute(campos, anexos, hash_arquivo(caminho_xls))
+
+
+def carregar_dicionario(caminho_xls, caminho_cache=None):
+    """Dicionário do JSON em cache, ou da planilha se ela mudou (regravando o cache)"""
+    hash_atual = hash_arquivo(caminho_xls)
+    if caminho_cache and Path(caminho_cache).exists():
+        try:
+            with open(caminho_cache, "r", encoding="utf-8") as f:
+                dados = json.load(f)
+            if dados.get("versao_formato") == VERSAO_FORMATO and dados.get("hash_planilha") == hash_atual:
+                return DicionarioLeiaute.de_json(dados)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Cache do dicionário do leiaute ilegível (%s); relendo a planilha", e)
+    dicionario = ler_planilha(caminho_xls)
+    if caminho_cache:
+        try:
+            dicionario.salvar(caminho_cache)
+        except OSError as e:
+            logger.warning("Não foi possível gravar o cache do dicionário: %s", e)
+    return dicionario
+
+
+def carregar_leiaute(caminho):
+    """Loader de Fonte: fichas de campo e anexos no lugar do texto da planilha"""
+    return ler_planilha(caminho).documentos()
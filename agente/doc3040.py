@@ -0,0 +1,147 @@
+"""
+Leitura em streaming de arquivos XML do Doc3040.
+
+Usa ET.iterparse e descarta cada filho da raiz (<Cli>, <Agreg>, ...) logo
+após o uso, de modo que a memória fica constante independentemente do
+tamanho da remessa.
+"""
+
+import xml.etree.ElementTree as ET
+
+from langchain.schema import Document
+
+
+# Tamanho máximo (em caracteres) de cada documento gerado a partir do XML
+MAX_CARACTERES_DOCUMENTO = 4000
+
+
+def _origem(caminho):
+    """iterparse aceita caminho ou arquivo aberto (ex.: upload do Streamlit)"""
+    return caminho if hasattr(caminho, "read") else str(caminho)
+
+
+def iterar_elementos(caminho):
+    """
+    Gera (raiz, elemento) para cada filho direto da raiz.
+
+    O elemento só é válido durante a iteração: em seguida é limpo e
+    removido da árvore. A raiz mantém apenas seus atributos.
+    """
+    raiz = None
+    profundidade = 0
+    for evento, elem in ET.iterparse(_origem(caminho), events=("start", "end")):
+        if evento == "start":
+            if raiz is None:
+                raiz = elem
+            profundidade += 1
+            continue
+        profundidade -= 1
+        if profundidade == 1:
+            yield raiz, elem
+            raiz.remove(elem)
+            elem.clear()
+
+
+def ler_cabecalho(caminho):
+    """Lê apenas os atributos da tag raiz (<Doc3040>)"""
+    for evento, elem in ET.iterparse(_origem(caminho), events=("start",)):
+        return elem.tag, dict(elem.attrib)
+    return None, {}
+
+
+def formatar_elemento(elem, nivel=0):
+    """Linhas de texto descrevendo o elemento, seus atributos e filhos"""
+    indent = "  " * nivel
+    linhas = [f"{indent}Tag: <{elem.tag}>"]
+    if elem.attrib:
+        linhas.append(f"{indent}Atributos: {elem.attrib}")
+    if elem.text and elem.text.strip():
+        linhas.append(f"{indent}Conteúdo: {elem.text.strip()}")
+    linhas.append("")
+    for child in elem:
+        linhas.extend(formatar_elemento(child, nivel + 1))
+    return linhas
+
+
+class _ResumoEsquema:
+    """Acumula as tags e atributos vistos no arquivo"""
+
+    def __init__(self):
+        self.tags = {}
+
+    def registrar(self, elem):
+        for e in elem.iter():
+            contagem, atributos = self.tags.setdefault(e.tag, [0, set()])
+            self.tags[e.tag][0] = contagem + 1
+            atributos.update(e.attrib)
+
+    def documento(self, tag_raiz, cabecalho):
+        linhas = [
+            "Estrutura do XML SCR 3040 - Resumo das tags e atributos do exemplo de preenchimento\n",
+            f"Tag raiz: {tag_raiz}",
+            f"Atributos da tag raiz: {cabecalho}\n",
+        ]
+        for tag, (contagem, atributos) in self.tags.items():
+            if tag == tag_raiz:
+                continue
+            linhas.append(f"Tag: <{tag}> - {contagem} ocorrência(s)")
+            if atributos:
+                linhas.append(f"Atributos: {', '.join(sorted(atributos))}")
+            linhas.append("")
+        return Document(
+            page_content="\n".join(linhas),
+            metadata={"source": "XML", "type": "esquema_xml"}
+        )
+
+
+def _documentos_do_elemento(elem, max_caracteres):
+    """Divide um <Cli> em documentos limitados, repetindo o cabeçalho do cliente"""
+    cabecalho = [f"Tag: <{elem.tag}>"]
+    if elem.attrib:
+        cabecalho.append(f"Atributos: {elem.attrib}")
+    cabecalho.append("")
+    cd = elem.get("Cd", "")
+    titulo = f"Exemplo de preenchimento do XML SCR 3040 - <{elem.tag}> {cd}".rstrip()
+
+    blocos = ["\n".join(formatar_elemento(filho, 1)) for filho in elem]
+    parte = 1
+    atual = []
+    tamanho = 0
+    base = len(titulo) + sum(len(l) + 1 for l in cabecalho)
+
+    def emitir():
+        texto = "\n".join([f"{titulo} (parte {parte})", *cabecalho, *atual])
+        return Document(
+            page_content=texto,
+            metadata={"source": "XML", "type": "exemplo_preenchimento",
+                      "tag": elem.tag, "cliente": cd, "parte": parte}
+        )
+
+    for bloco in blocos:
+        if atual and base + tamanho + len(bloco) > max_caracteres:
+            yield emitir()
+            parte += 1
+            atual = []
+            tamanho = 0
+        atual.append(bloco)
+        tamanho += len(bloco) + 1
+    if atual or parte == 1:
+        yield emitir()
+
+
+def iterar_documentos(caminho, max_caracteres=MAX_CARACTERES_DOCUMENTO):
+    """
+    Gera documentos de tamanho limitado a partir do XML: um (ou mais, se
+    muito grande) por grupo <Cli>/<Op>, e ao final um resumo do esquema
+    com as tags e atributos encontrados.
+    """
+    resumo = _ResumoEsquema()
+    raiz = None
+    for raiz, elem in iterar_elementos(caminho):
+        resumo.registrar(elem)
+        yield from _documentos_do_elemento(elem, max_caracteres)
+    if raiz is None:
+        tag_raiz, cabecalho = ler_cabecalho(caminho)
+    else:
+        tag_raiz, cabecalho = raiz.tag, dict(raiz.attrib)
+    yield resumo.documento(tag_raiz, cabecalho)
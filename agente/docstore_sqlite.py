@@ -0,0 +1,129 @@
+"""
+Docstore em SQLite para o vectorstore FAISS.
+
+Substitui o index.pkl (docstore inteiro serializado com pickle): o texto e
+os metadados de cada chunk ficam em chunks.sqlite, indexados pelo id, e só
+são lidos para os resultados de uma busca. A tabela "posicoes" guarda o
+mapeamento posição no índice FAISS -> id do chunk.
+"""
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+
+
+CHUNKS_NOME = "chunks.sqlite"
+
+
+def _conectar(caminho):
+    # Acessado pelas threads do retriever híbrido (serializado pelo lock)
+    conn = sqlite3.connect(str(caminho), timeout=30, check_same_thread=False)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS chunks ("
+        " id TEXT PRIMARY KEY,"
+        " texto TEXT NOT NULL,"
+        " metadata TEXT NOT NULL"
+        ") WITHOUT ROWID"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS posicoes ("
+        " posicao INTEGER PRIMARY KEY,"
+        " id TEXT NOT NULL"
+        ")"
+    )
+    return conn
+
+
+def _linha(id_, doc):
+    return id_, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False, default=str)
+
+
+class DocstoreSQLite(Docstore, AddableMixin):
+    """Docstore com leitura preguiçosa por id"""
+
+    def __init__(self, caminho):
+        self.caminho = Path(caminho)
+        self._lock = threading.Lock()
+        self._conn = _conectar(self.caminho)
+
+    def search(self, search):
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT texto, metadata FROM chunks WHERE id = ?", (search,)
+            ).fetchone()
+        if linha is None:
+            # Mesmo comportamento do InMemoryDocstore
+            return f"ID {search} not found."
+        return Document(id=search, page_content=linha[0], metadata=json.loads(linha[1]))
+
+    def add(self, texts):
+        with self._lock, self._conn:
+            existentes = [
+                id_ for id_ in texts
+                if self._conn.execute("SELECT 1 FROM chunks WHERE id = ?", (id_,)).fetchone()
+            ]
+            if existentes:
+                raise ValueError(f"Tried to add ids that already exist: {set(existentes)}")
+            self._conn.executemany(
+                "INSERT INTO chunks (id, texto, metadata) VALUES (?, ?, ?)",
+                [_linha(id_, doc) for id_, doc in texts.items()]
+            )
+
+    def delete(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(id_,) for id_ in ids])
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def gravar_posicoes(self, index_to_docstore_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM posicoes")
+            self._conn.executemany(
+                "INSERT INTO posicoes (posicao, id) VALUES (?, ?)",
+                sorted(index_to_docstore_id.items())
+            )
+
+    def ler_posicoes(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT posicao, id FROM posicoes"))
+
+    def em_memoria(self):
+        """Cópia completa em um InMemoryDocstore (usada antes de atualizações)"""
+        with self._lock:
+            linhas = self._conn.execute("SELECT id, texto, metadata FROM chunks").fetchall()
+        return InMemoryDocstore({
+            id_: Document(id=id_, page_content=texto, metadata=json.loads(metadata))
+            for id_, texto, metadata in linhas
+        })
+
+    def fechar(self):
+        with self._lock:
+            self._conn.close()
+
+
+def gravar_docstore(vectorstore, diretorio):
+    """
+    Grava o docstore e as posições do vectorstore em diretorio/chunks.sqlite,
+    na ordem do índice. O arquivo deve ser novo: a troca do anterior é feita
+    por rename em indexacao.salvar_indice.
+    """
+    destino = Path(diretorio) / CHUNKS_NOME
+    destino.unlink(missing_ok=True)
+    docstore = vectorstore.docstore
+    novo = DocstoreSQLite(destino)
+    ids = [id_ for _, id_ in sorted(vectorstore.index_to_docstore_id.items())]
+    with novo._conn:
+        novo._conn.executemany(
+            "INSERT INTO chunks (id, texto, metadata) VALUES (?, ?, ?)",
+            [_linha(id_, docstore.search(id_)) for id_ in ids]
+        )
+    novo.gravar_posicoes(vectorstore.index_to_docstore_id)
+    novo.fechar()
+    return destino
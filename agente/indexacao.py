@@ -0,0 +1,403 @@
+"""
+Construção e atualização incremental do vectorstore FAISS do SCR 3040.
+
+Um manifesto (manifest.json) gravado ao lado do índice registra o hash de cada
+arquivo-fonte e os ids dos chunks que ele gerou. Na inicialização apenas as
+fontes alteradas são recarregadas: chunks novos são embedados e inseridos,
+chunks que deixaram de existir são removidos do índice FAISS.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+from langchain_community.vectorstores import FAISS
+from langchain.schema import Document
+import pandas as pd
+
+from doc3040 import iterar_documentos as iterar_documentos_xml
+import carga_paralela
+from chunking import CONFIG_CHUNKING, dividir, estrategia_da_fonte
+import indices_faiss
+
+
+logger = logging.getLogger(__name__)
+
+MANIFESTO_NOME = "manifest.json"
+VERSAO_MANIFESTO = 1
+
+# Faixas menores que isso não compensam o custo de abrir o PDF em outro processo
+MIN_PAGINAS_POR_PARTE = 8
+
+
+@dataclass
+class Fonte:
+    """Arquivo-fonte indexado no vectorstore"""
+    nome: str
+    caminho: Path
+    carregar: Callable
+    obrigatoria: bool = True
+    # particionar(caminho, n_partes) -> [(funcao, argumentos)]: carga em partes
+    # paralelas com o mesmo resultado de carregar (ver carga_paralela)
+    particionar: Optional[Callable] = None
+
+
+@dataclass
+class RelatorioAtualizacao:
+    """Resumo do que mudou em uma atualização do vectorstore"""
+    fontes_alteradas: list = field(default_factory=list)
+    fontes_removidas: list = field(default_factory=list)
+    chunks_adicionados: int = 0
+    chunks_removidos: int = 0
+    reconstruido: bool = False
+    indice_convertido: bool = False
+    # Tamanho/data de modificação de fontes inalteradas renovados no manifesto
+    manifesto_atualizado: bool = False
+
+    @property
+    def houve_alteracao(self):
+        return bool(self.fontes_alteradas or self.fontes_removidas)
+
+    @property
+    def precisa_salvar(self):
+        return self.houve_alteracao or self.indice_convertido or self.manifesto_atualizado
+
+
+def carregar_pdf(caminho):
+    """Carrega o PDF de instruções, uma página por documento"""
+    # Carregadores importados sob demanda: pesados e usados só na (re)indexação
+    from langchain_community.document_loaders import PyPDFLoader
+    return PyPDFLoader(str(caminho)).load()
+
+
+def _metadados_pdf(leitor, caminho):
+    """
+    Metadados do documento no formato do PyPDFLoader: chaves sem "/" e em
+    minúsculas, datas do PDF em ISO 8601, demais valores como texto
+    """
+    metadados = {}
+    for chave, valor in ({"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+                         | dict(leitor.metadata or {})).items():
+        chave = chave.lstrip("/").lower()
+        valor = valor if isinstance(valor, (str, int)) else str(valor)
+        if chave in ("creationdate", "moddate"):
+            try:
+                valor = datetime.strptime(valor.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                pass
+        elif isinstance(valor, str):
+            valor = valor.strip()
+        metadados[chave] = valor
+    return metadados | {"source": str(caminho), "total_pages": len(leitor.pages)}
+
+
+def carregar_pdf_paginas(caminho, inicio, fim):
+    """Páginas [inicio, fim) do PDF, com os mesmos textos e metadados de carregar_pdf"""
+    import pypdf
+    leitor = pypdf.PdfReader(str(caminho))
+    metadados = _metadados_pdf(leitor, caminho)
+    return [
+        Document(
+            page_content=leitor.pages[i].extract_text(extraction_mode="plain").strip(),
+            metadata=metadados | {"page": i, "page_label": leitor.page_labels[i]},
+        )
+        for i in range(inicio, min(fim, len(leitor.pages)))
+    ]
+
+
+def particionar_pdf(caminho, n_partes):
+    """Tarefas de carga do PDF por faixas contíguas de páginas"""
+    import pypdf
+    total = len(pypdf.PdfReader(str(caminho)).pages)
+    n_partes = max(1, min(n_partes, total // MIN_PAGINAS_POR_PARTE))
+    if n_partes == 1:
+        return [(carregar_pdf, (caminho,))]
+    limites = [round(total * k / n_partes) for k in range(n_partes + 1)]
+    return [(carregar_pdf_paginas, (caminho, inicio, fim)) for inicio, fim in zip(limites, limites[1:])]
+
+
+def carregar_xls(caminho):
+    """Carrega uma planilha XLS como texto"""
+    from langchain_community.document_loaders import UnstructuredExcelLoader
+    return UnstructuredExcelLoader(str(caminho)).load()
+
+
+def _celula(valor):
+    texto = " ".join(str(valor).split())
+    # Datas lidas como texto vêm com horário zerado
+    return texto[:-9] if texto.endswith(" 00:00:00") else texto
+
+
+def carregar_xls_linhas(caminho):
+    """
+    Carrega cada aba da planilha como um documento com uma linha por
+    registro ("Coluna: valor; ..."). A primeira linha identifica a aba
+    (título e descrição acima da linha de cabeçalho da tabela).
+    """
+    docs = []
+    for aba, planilha in pd.read_excel(caminho, sheet_name=None, header=None, dtype=str).items():
+        planilha = planilha.dropna(how="all")
+        preenchidas = planilha.notna().sum(axis=1)
+        if not (preenchidas >= 2).any():
+            continue
+        inicio = planilha.index.get_loc((preenchidas >= 2).idxmax())
+        titulo = [_celula(v) for v in planilha.iloc[:inicio].stack()]
+        colunas = [_celula(v) if isinstance(v, str) else f"Coluna {i + 1}"
+                   for i, v in enumerate(planilha.iloc[inicio])]
+        linhas = [f"Aba {aba} de {Path(caminho).name}: {' '.join(titulo)}".rstrip(": ")]
+        for _, registro in planilha.iloc[inicio + 1:].iterrows():
+            campos = [f"{col}: {_celula(v)}" for col, v in zip(colunas, registro) if isinstance(v, str)]
+            if campos:
+                linhas.append("; ".join(campos))
+        docs.append(Document(
+            page_content="\n".join(linhas),
+            metadata={"source": str(caminho), "aba": aba, "registros": len(linhas) - 1}
+        ))
+    return docs
+
+
+def carregar_xml(caminho):
+    """Carrega o XML em streaming: um documento por grupo <Cli>/<Op> e um resumo do esquema"""
+    try:
+        return list(iterar_documentos_xml(caminho))
+    except ET.ParseError as e:
+        logger.warning("Erro ao processar XML: %s. Carregando como texto...", e)
+        # Fallback: carrega como texto simples
+        with open(caminho, 'r', encoding='ISO-8859-1') as f:
+            xml_text = f.read()
+        return [Document(
+            page_content=f"Exemplo de XML SCR 3040:\n\n{xml_text}",
+            metadata={"source": "XML", "type": "exemplo_preenchimento"}
+        )]
+
+
+def hash_arquivo(caminho):
+    """SHA-256 do conteúdo do arquivo"""
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def hash_chunk(texto):
+    """SHA-256 do texto de um chunk"""
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def id_chunk(nome_fonte, texto):
+    """Id estável do chunk no docstore: fonte + hash do texto"""
+    return f"{nome_fonte}:{hash_chunk(texto)}"
+
+
+def manifesto_vazio():
+    return {
+        "versao_manifesto": VERSAO_MANIFESTO,
+        "config_chunking": CONFIG_CHUNKING,
+        "fontes": {},
+    }
+
+
+def versao_indice(manifesto):
+    """Identificador curto do conteúdo indexado (muda se qualquer fonte mudar)"""
+    conteudo = {
+        "config_chunking": manifesto.get("config_chunking"),
+        "fontes": {nome: [reg["hash"], reg.get("carregador"), reg.get("chunking")]
+                   for nome, reg in sorted(manifesto["fontes"].items())},
+    }
+    return hashlib.sha256(json.dumps(conteudo, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def ler_manifesto(caminho_indice):
+    """Lê o manifesto do índice; retorna None se ausente ou incompatível"""
+    caminho = Path(caminho_indice) / MANIFESTO_NOME
+    if not caminho.exists():
+        return None
+    try:
+        with open(caminho, "r", encoding="utf-8") as f:
+            manifesto = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Manifesto ilegível (%s); o índice será reconstruído", e)
+        return None
+    if manifesto.get("versao_manifesto") != VERSAO_MANIFESTO:
+        return None
+    return manifesto
+
+
+def gravar_manifesto(manifesto, caminho_indice):
+    """Grava o manifesto de forma atômica (arquivo temporário + rename)"""
+    caminho = Path(caminho_indice) / MANIFESTO_NOME
+    temporario = caminho.with_suffix(".json.tmp")
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=1)
+    os.replace(temporario, caminho)
+
+
+def nome_carregador(fonte):
+    """Identifica a função de carga; trocá-la força o reprocessamento da fonte"""
+    return f"{fonte.carregar.__module__}.{fonte.carregar.__qualname__}"
+
+
+def _arquivo_inalterado(fonte, registro):
+    """
+    Verifica se o arquivo da fonte corresponde ao registrado no manifesto.
+    Retorna (inalterado, hash calculado ou None se o atalho bastou); se só o
+    tamanho/data mudaram, o registro é atualizado para o atalho valer de novo.
+    """
+    if not registro:
+        return False, None
+    if registro.get("carregador") != nome_carregador(fonte):
+        return False, None
+    if registro.get("chunking") != estrategia_da_fonte(fonte.nome):
+        return False, None
+    stat = fonte.caminho.stat()
+    # Atalho: mesmo tamanho e data de modificação dispensam recalcular o hash
+    if registro.get("tamanho") == stat.st_size and registro.get("mtime") == stat.st_mtime_ns:
+        return True, None
+    hash_atual = hash_arquivo(fonte.caminho)
+    if hash_atual != registro.get("hash"):
+        return False, hash_atual
+    registro["tamanho"], registro["mtime"] = stat.st_size, stat.st_mtime_ns
+    return True, hash_atual
+
+
+def gerar_chunks(fonte, splitter=None, docs=None):
+    """
+    Carrega uma fonte (se docs não for dado) e divide em chunks com ids
+    estáveis, usando a estratégia de chunking da fonte (ver chunking)
+    """
+    if docs is None:
+        docs = fonte.carregar(fonte.caminho)
+    for i, doc in enumerate(docs):
+        doc.metadata["source"] = fonte.nome
+        # doc_id é relativo à fonte para não depender das demais fontes
+        doc.metadata["doc_id"] = i
+
+    chunks = {}
+    for chunk in dividir(docs, estrategia_da_fonte(fonte.nome), splitter):
+        # Chunks com texto idêntico na mesma fonte são indexados uma única vez
+        chunks.setdefault(id_chunk(fonte.nome, chunk.page_content), chunk)
+    return chunks
+
+
+def atualizar_vectorstore(vectorstore, fontes, embeddings, caminho_indice, splitter=None,
+                          tipo_indice=indices_faiss.TIPO_PADRAO, processos=None):
+    """
+    Sincroniza o vectorstore com as fontes, reembedando só o que mudou.
+
+    Retorna (vectorstore, manifesto, relatorio). Se vectorstore for None ou o
+    manifesto estiver ausente/incompatível, o índice é construído do zero.
+    O índice final é do tipo tipo_indice (ver indices_faiss). As fontes
+    alteradas são carregadas em paralelo por carga_paralela.
+    """
+    relatorio = RelatorioAtualizacao()
+    manifesto = ler_manifesto(caminho_indice) if vectorstore is not None else None
+    if manifesto is None or manifesto.get("config_chunking") != CONFIG_CHUNKING:
+        vectorstore = None
+        manifesto = manifesto_vazio()
+        relatorio.reconstruido = True
+
+    novos_docs = {}
+    remover = set()
+    nomes_fontes = set()
+    alteradas = []
+
+    for fonte in fontes:
+        nomes_fontes.add(fonte.nome)
+        registro = manifesto["fontes"].get(fonte.nome)
+
+        if not fonte.caminho.exists():
+            if fonte.obrigatoria:
+                raise FileNotFoundError(f"Arquivo não encontrado: {fonte.caminho}")
+            if registro:
+                remover.update(registro["chunks"])
+                del manifesto["fontes"][fonte.nome]
+                relatorio.fontes_removidas.append(fonte.nome)
+            continue
+
+        inalterado, hash_atual = _arquivo_inalterado(fonte, registro)
+        if inalterado:
+            # Arquivo tocado sem mudar o conteúdo: só o manifesto é regravado
+            relatorio.manifesto_atualizado |= hash_atual is not None
+            continue
+        alteradas.append((fonte, registro, hash_atual))
+
+    documentos = carga_paralela.carregar_fontes([fonte for fonte, _, _ in alteradas], processos)
+    for (fonte, registro, hash_atual), docs in zip(alteradas, documentos):
+        chunks = gerar_chunks(fonte, splitter, docs)
+        ids_antigos = set(registro["chunks"]) if registro else set()
+        remover.update(ids_antigos - chunks.keys())
+        for id_, chunk in chunks.items():
+            if id_ not in ids_antigos:
+                novos_docs[id_] = chunk
+
+        stat = fonte.caminho.stat()
+        manifesto["fontes"][fonte.nome] = {
+            "arquivo": fonte.caminho.name,
+            "hash": hash_atual or hash_arquivo(fonte.caminho),
+            "tamanho": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "carregador": nome_carregador(fonte),
+            "chunking": estrategia_da_fonte(fonte.nome),
+            "chunks": list(chunks.keys()),
+        }
+        relatorio.fontes_alteradas.append(fonte.nome)
+
+    # Fontes que saíram da configuração
+    for nome in list(manifesto["fontes"]):
+        if nome not in nomes_fontes:
+            remover.update(manifesto["fontes"].pop(nome)["chunks"])
+            relatorio.fontes_removidas.append(nome)
+
+    if vectorstore is None:
+        if not novos_docs:
+            raise ValueError("Nenhum documento encontrado para indexar")
+        vectorstore = FAISS.from_documents(
+            list(novos_docs.values()), embeddings, ids=list(novos_docs.keys())
+        )
+        relatorio.chunks_adicionados = len(novos_docs)
+        indices_faiss.converter(vectorstore, tipo_indice)
+        return vectorstore, manifesto, relatorio
+
+    # Considera apenas ids realmente presentes, para tolerar um manifesto
+    # gravado antes de uma falha no meio da atualização anterior
+    presentes = set(vectorstore.index_to_docstore_id.values())
+    remover &= presentes
+    inserir = {id_: doc for id_, doc in novos_docs.items() if id_ not in presentes}
+    tipo_atual = indices_faiss.tipo_do_indice(vectorstore.index)
+    total_final = vectorstore.index.ntotal - len(remover) + len(inserir)
+    tipo_final = indices_faiss.tipo_efetivo(tipo_indice, total_final)
+    if not (remover or inserir) and tipo_atual == tipo_final:
+        return vectorstore, manifesto, relatorio
+
+    # Remoção e inserção são feitas sobre um Flat em memória, convertido no final
+    indices_faiss.para_flat_mutavel(vectorstore, embeddings)
+    if remover:
+        vectorstore.delete(list(remover))
+        relatorio.chunks_removidos = len(remover)
+    if inserir:
+        vectorstore.add_documents(list(inserir.values()), ids=list(inserir.keys()))
+        relatorio.chunks_adicionados = len(inserir)
+    indices_faiss.converter(vectorstore, tipo_indice)
+    relatorio.indice_convertido = tipo_atual != tipo_final
+
+    return vectorstore, manifesto, relatorio
+
+
+def salvar_indice(vectorstore, manifesto, caminho_indice):
+    """Salva o índice FAISS e, em seguida, o manifesto correspondente"""
+    caminho_indice = Path(caminho_indice)
+    temporario = caminho_indice / ".novo"
+    # Grava ao lado e troca por rename: um índice memory-mapped por outro
+    # processo nunca vê um arquivo truncado
+    indices_faiss.salvar_local(vectorstore, temporario)
+    for arquivo in temporario.iterdir():
+        os.replace(arquivo, caminho_indice / arquivo.name)
+    temporario.rmdir()
+    gravar_manifesto(manifesto, caminho_indice)
@@ -0,0 +1,485 @@
+"""
+Índice versionado e imutável.
+
+Cada versão do índice é gravada em um diretório próprio, que não é mais
+alterado, e publicada trocando o ponteiro ATUAL; os processos abrem a
+versão publicada memory-mapped e somente-leitura.
+
+No modo "local" (padrão de SCR_INDICE_MODO), o índice fica em
+agente/vectorstore e o próprio app ou serviço reindexa as fontes alteradas
+ao iniciar. No modo "compartilhado", fica em SCR_INDICE_DIR (padrão
+agente/indice) e um construtor publica as versões para todas as réplicas
+do host: as páginas vêm do cache de páginas do sistema, uma única vez.
+
+Layout:
+  versoes/<data>-<versão>/   index.faiss, chunks.sqlite, bm25.json, manifest.json
+  ATUAL                      nome da versão publicada (trocado por rename)
+
+O FAISS só mapeia do arquivo as listas invertidas dos índices IVF (Flat e
+HNSW são lidos para a memória de cada processo), por isso o tipo padrão
+das versões do modo compartilhado é IVF-Flat; SCR_INDICE_FAISS escolhe
+outro.
+
+Uma nova versão é gravada em um diretório oculto, validada (contagens,
+BM25 e buscas de prova) e só então publicada; se a construção falhar ou a
+validação reprovar, a versão anterior continua publicada. reverter() volta
+ATUAL para a versão anterior e coletar_versoes() apaga as antigas,
+mantendo as MANTER_VERSOES mais recentes.
+
+O construtor (python indice_versionado.py [--intervalo s] [--do-zero]
+[--reverter]) reindexa só as fontes alteradas a partir da versão
+publicada e publica uma nova versão; se ainda não há versão, o primeiro
+processo a constrói (sob a trava entre processos). Os processos verificam
+ATUAL periodicamente e passam para a nova versão sem reiniciar
+(IndiceVersionado.atualizar); buscas em andamento terminam na versão
+anterior, que continua legível mesmo depois de apagada.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from dotenv import load_dotenv
+
+from cache_embeddings import criar_embeddings
+from recursos import (EMBEDDINGS_CACHE_PATH, INDICE_VERSIONADO_PATH, VECTORSTORE_PATH,
+                      fontes, trava_indice)
+
+
+logger = logging.getLogger(__name__)
+
+MODOS_INDICE = ("local", "compartilhado")
+PONTEIRO_NOME = "ATUAL"
+VERSOES_NOME = "versoes"
+TRAVA_NOME = ".trava"
+# Intervalo mínimo (s) entre leituras de ATUAL por um worker
+INTERVALO_VERIFICACAO = 5.0
+# Tipo FAISS cujos vetores ficam no arquivo mapeado (páginas compartilhadas)
+TIPO_COMPARTILHADO = "IVF-Flat"
+# Versões mantidas em disco (a publicada é sempre mantida)
+MANTER_VERSOES = 3
+# Buscas de prova na validação e fração mínima que precisa encontrar o próprio chunk
+AMOSTRA_VALIDACAO = 8
+ACERTO_MINIMO_VALIDACAO = 0.75
+# Espera (s) antes de fechar o chunks.sqlite de uma versão substituída:
+# maior que o tempo limite máximo de uma pergunta em andamento (api.py)
+PRAZO_FECHAMENTO = 600.0
+# Arquivos do índice salvo direto em agente/vectorstore (antes das versões)
+ARQUIVOS_LEGADOS = ("index.faiss", "chunks.sqlite", "manifest.json", "bm25.json", "index.pkl")
+
+
+class ErroValidacao(Exception):
+    """Versão construída reprovada na validação (não é publicada)"""
+
+
+class IndiceOcupado(Exception):
+    """Outro processo detém a trava do índice (construção em andamento)"""
+
+
+def modo_indice():
+    modo = os.getenv("SCR_INDICE_MODO", "local").lower()
+    if modo not in MODOS_INDICE:
+        raise ValueError(f"SCR_INDICE_MODO inválido: {modo} (opções: {', '.join(MODOS_INDICE)})")
+    return modo
+
+
+def raiz_indice():
+    """Diretório do índice versionado no modo configurado"""
+    return INDICE_VERSIONADO_PATH if modo_indice() == "compartilhado" else VECTORSTORE_PATH
+
+
+def tipo_publicado():
+    """
+    Tipo do índice das versões publicadas: SCR_INDICE_FAISS (ou o padrão de
+    indices_faiss) no modo local; no compartilhado, TIPO_COMPARTILHADO se
+    SCR_INDICE_FAISS não for definido
+    """
+    from indices_faiss import tipo_configurado
+    if modo_indice() == "compartilhado" and not os.getenv("SCR_INDICE_FAISS"):
+        return TIPO_COMPARTILHADO
+    return tipo_configurado()
+
+
+@dataclass
+class VersaoIndice:
+    """Versão publicada aberta por um processo"""
+    nome: str
+    versao: str
+    vectorstore: Any
+    bm25: Any
+    caminho: Path
+
+
+def caminho_versao(nome, raiz):
+    return Path(raiz) / VERSOES_NOME / nome
+
+
+def listar_versoes(raiz):
+    """Versões completas em disco, da mais antiga para a mais recente"""
+    versoes = Path(raiz) / VERSOES_NOME
+    if not versoes.exists():
+        return []
+    # O nome começa pela data: a ordem alfabética é a cronológica
+    return sorted(p.name for p in versoes.iterdir() if p.is_dir() and not p.name.startswith("."))
+
+
+def versao_publicada(raiz):
+    """Nome da versão apontada por ATUAL, ou None se nada foi publicado"""
+    try:
+        nome = (Path(raiz) / PONTEIRO_NOME).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    return nome or None
+
+
+def _apontar(nome, raiz):
+    """Troca ATUAL de forma atômica (arquivo temporário + rename)"""
+    ponteiro = Path(raiz) / PONTEIRO_NOME
+    temporario = ponteiro.with_name(f".{PONTEIRO_NOME}.{os.getpid()}")
+    with open(temporario, "w", encoding="utf-8") as f:
+        f.write(nome)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, ponteiro)
+
+
+def _fechar(vectorstore):
+    """Fecha a conexão com o chunks.sqlite de um vectorstore aberto por carregar_local"""
+    fechar = getattr(vectorstore.docstore, "fechar", None)
+    if fechar is not None:
+        fechar()
+
+
+def publicar(vectorstore, manifesto, raiz, embeddings=None, ao_progredir=None):
+    """
+    Grava o vectorstore, o BM25 e o manifesto como uma nova versão
+    (somente-leitura), valida a cópia gravada (se embeddings for dado) e
+    aponta ATUAL para ela. Retorna o nome da versão; se a validação
+    reprovar, levanta ErroValidacao e ATUAL não muda.
+    """
+    from bm25 import IndiceBM25
+    from indexacao import gravar_manifesto, versao_indice
+    import indices_faiss
+
+    progredir = ao_progredir or (lambda etapa: None)
+    versao = versao_indice(manifesto)
+    versoes = Path(raiz) / VERSOES_NOME
+    versoes.mkdir(parents=True, exist_ok=True)
+    # Com microssegundos: duas publicações do mesmo conteúdo no mesmo
+    # segundo não colidem, e a ordem alfabética continua a cronológica
+    nome = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{versao}"
+    # Diretório oculto até estar completo e validado: quem lista as versões
+    # nunca vê uma pela metade
+    temporario = versoes / f".{nome}.{os.getpid()}"
+    try:
+        progredir("Gravando a nova versão")
+        indices_faiss.salvar_local(vectorstore, temporario)
+        IndiceBM25.do_vectorstore(vectorstore, versao).salvar(temporario)
+        gravar_manifesto(manifesto, temporario)
+        if embeddings is not None:
+            progredir("Validando a nova versão")
+            validar_versao(temporario, embeddings, manifesto)
+        for arquivo in temporario.iterdir():
+            arquivo.chmod(0o444)
+        os.rename(temporario, versoes / nome)
+    except BaseException:
+        shutil.rmtree(temporario, ignore_errors=True)
+        raise
+    progredir("Publicando")
+    _apontar(nome, raiz)
+    logger.info("Índice publicado: %s (%d chunks)", nome, vectorstore.index.ntotal)
+    return nome
+
+
+def validar_versao(caminho, embeddings, manifesto):
+    """
+    Confere uma versão gravada antes de publicá-la, abrindo-a como os
+    processos a abrirão: vetores, posições e chunks com as contagens do
+    manifesto, BM25 da mesma versão e buscas de prova com o texto de uma
+    amostra de chunks (os embeddings vêm do cache). Levanta ErroValidacao.
+    """
+    from bm25 import IndiceBM25
+    from indexacao import versao_indice
+    from indices_faiss import carregar_local
+
+    try:
+        vectorstore = carregar_local(caminho, embeddings, mmap=True)
+    except Exception as e:
+        raise ErroValidacao(f"índice ilegível: {e}") from e
+    try:
+        total = vectorstore.index.ntotal
+        esperado = sum(len(registro["chunks"]) for registro in manifesto["fontes"].values())
+        if total == 0 or total != esperado:
+            raise ErroValidacao(f"{total} vetores no índice e {esperado} chunks no manifesto")
+        bm25 = IndiceBM25.carregar(caminho, versao_indice(manifesto))
+        if bm25 is None or len(bm25.ids) != total:
+            raise ErroValidacao("BM25 ausente ou com outra contagem de documentos")
+
+        posicoes = range(0, total, max(1, total // AMOSTRA_VALIDACAO))[:AMOSTRA_VALIDACAO]
+        amostra = []
+        for posicao in posicoes:
+            id_ = vectorstore.index_to_docstore_id[posicao]
+            doc = vectorstore.docstore.search(id_)
+            if isinstance(doc, str):
+                raise ErroValidacao(f"chunk {id_} (posição {posicao}) ausente do chunks.sqlite")
+            amostra.append((id_, doc.page_content))
+        vetores = embeddings.embed_documents([texto for _, texto in amostra])
+        acertos = 0
+        for (id_, _), vetor in zip(amostra, vetores):
+            resultados = vectorstore.similarity_search_with_score_by_vector(vetor, k=5)
+            acertos += any(doc.id == id_ for doc, _ in resultados)
+        if acertos < ACERTO_MINIMO_VALIDACAO * len(amostra):
+            raise ErroValidacao(f"buscas de prova: {acertos} de {len(amostra)} chunks encontrados")
+    finally:
+        # Antes do rename do diretório temporário
+        _fechar(vectorstore)
+
+
+def abrir_versao(nome, embeddings, raiz):
+    """Abre uma versão publicada: índice memory-mapped, chunks.sqlite e BM25 já gravados"""
+    from bm25 import IndiceBM25
+    from indexacao import ler_manifesto, versao_indice
+    from indices_faiss import carregar_local
+
+    caminho = caminho_versao(nome, raiz)
+    manifesto = ler_manifesto(caminho)
+    if manifesto is None:
+        raise ValueError(f"Versão {nome} sem manifesto válido")
+    versao = versao_indice(manifesto)
+    vectorstore = carregar_local(caminho, embeddings, mmap=True)
+    bm25 = IndiceBM25.carregar(caminho, versao)
+    if bm25 is None:
+        # A versão é somente-leitura: o BM25 fica só em memória
+        logger.warning("Versão %s sem BM25 gravado; construído em memória", nome)
+        bm25 = IndiceBM25.do_vectorstore(vectorstore, versao)
+    return VersaoIndice(nome, versao, vectorstore, bm25, caminho)
+
+
+def construir(embeddings, raiz, tipo_indice=None, do_zero=False, manter=MANTER_VERSOES,
+              ao_progredir=None):
+    """
+    Atualiza o índice a partir da versão publicada (ou do zero, com
+    do_zero=True) e publica uma nova versão, validada, se algo mudou; em
+    seguida apaga as versões antigas. A versão publicada continua em uso
+    durante a construção. Retorna (nome publicado ou None, relatório).
+    """
+    from indexacao import atualizar_vectorstore
+    from indices_faiss import carregar_local
+
+    raiz = Path(raiz)
+    raiz.mkdir(parents=True, exist_ok=True)
+    with trava_indice(raiz / TRAVA_NOME):
+        anterior = versao_publicada(raiz)
+        vectorstore, caminho = None, raiz
+        if anterior is not None and not do_zero:
+            caminho = caminho_versao(anterior, raiz)
+            try:
+                vectorstore = carregar_local(caminho, embeddings, mmap=True)
+            except Exception as e:
+                logger.warning("Versão publicada %s ilegível (%s); reconstruindo", anterior, e)
+        elif not do_zero and (raiz / "index.faiss").exists():
+            # Índice salvo antes das versões: aproveitado como base da primeira
+            try:
+                vectorstore = carregar_local(raiz, embeddings, mmap=True)
+            except Exception as e:
+                logger.warning("Índice em %s ilegível (%s); reconstruindo", raiz, e)
+        if ao_progredir is not None:
+            ao_progredir("Reconstruindo o índice" if do_zero else "Atualizando o índice")
+        # A versão publicada não é alterada: a atualização trabalha em uma cópia em memória
+        base = vectorstore
+        vectorstore, manifesto, relatorio = atualizar_vectorstore(
+            vectorstore, fontes(), embeddings, caminho, tipo_indice=tipo_indice or tipo_publicado()
+        )
+        try:
+            if do_zero:
+                relatorio.reconstruido = True
+            elif not relatorio.precisa_salvar and anterior is not None:
+                return None, relatorio
+            nome = publicar(vectorstore, manifesto, raiz, embeddings, ao_progredir)
+        finally:
+            if base is not None:
+                _fechar(base)
+        for arquivo in ARQUIVOS_LEGADOS:
+            (raiz / arquivo).unlink(missing_ok=True)
+        coletar_versoes(raiz, manter)
+        return nome, relatorio
+
+
+def reverter(raiz, esperar=True):
+    """
+    Aponta ATUAL para a versão anterior à publicada (em disco). Retorna o
+    nome dela, ou None se não houver versão anterior. Com esperar=False,
+    levanta IndiceOcupado em vez de esperar uma construção em andamento.
+    """
+    raiz = Path(raiz)
+    with ExitStack() as pilha:
+        try:
+            pilha.enter_context(trava_indice(raiz / TRAVA_NOME, esperar=esperar))
+        except BlockingIOError as e:
+            raise IndiceOcupado(f"Índice em {raiz} em construção por outro processo") from e
+        atual = versao_publicada(raiz)
+        anteriores = [nome for nome in listar_versoes(raiz) if atual is None or nome < atual]
+        if not anteriores:
+            return None
+        _apontar(anteriores[-1], raiz)
+    logger.info("Índice revertido: %s -> %s", atual, anteriores[-1])
+    return anteriores[-1]
+
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def coletar_versoes(raiz, manter=MANTER_VERSOES):
+    """
+    Apaga as versões além das manter mais recentes (nunca a publicada) e as
+    gravações interrompidas de processos que já terminaram. Chamada sob a
+    trava do índice; quem ainda usa uma versão apagada continua lendo os
+    arquivos abertos. Retorna os nomes apagados.
+    """
+    raiz = Path(raiz)
+    versoes = listar_versoes(raiz)
+    manter_nomes = set(versoes[-manter:]) if manter > 0 else set()
+    manter_nomes.add(versao_publicada(raiz))
+    apagadas = [nome for nome in versoes if nome not in manter_nomes]
+    for nome in apagadas:
+        shutil.rmtree(caminho_versao(nome, raiz), ignore_errors=True)
+    for temporario in (raiz / VERSOES_NOME).glob(".*"):
+        pid = temporario.name.rsplit(".", 1)[-1]
+        if pid.isdigit() and not _processo_vivo(int(pid)):
+            shutil.rmtree(temporario, ignore_errors=True)
+            apagadas.append(temporario.name)
+    if apagadas:
+        logger.info("Versões antigas do índice apagadas: %s", ", ".join(apagadas))
+    return apagadas
+
+
+class IndiceVersionado:
+    """
+    Versão publicada aberta por um processo. atualizar() relê ATUAL (no
+    máximo a cada intervalo segundos) e troca de versão quando ele muda.
+    """
+
+    def __init__(self, embeddings, raiz=None, intervalo=INTERVALO_VERIFICACAO):
+        self.embeddings = embeddings
+        self.raiz = Path(raiz or raiz_indice())
+        self.intervalo = intervalo
+        self.atual = None
+        # Relatório da última construção feita por abrir(), se houve
+        self.relatorio = None
+        # Versões substituídas, fechadas PRAZO_FECHAMENTO segundos depois
+        # (perguntas em andamento ainda as usam): [(versão, momento da troca)]
+        self._substituidas = []
+        self._lock = threading.Lock()
+        self._verificado = 0.0
+
+    def abrir(self, atualizar=False, ao_progredir=None):
+        """
+        Abre a versão publicada; com atualizar=True (ou se ainda não há
+        nenhuma), antes reindexa as fontes alteradas e publica
+        """
+        if atualizar or versao_publicada(self.raiz) is None:
+            _, self.relatorio = construir(self.embeddings, self.raiz, ao_progredir=ao_progredir)
+        with self._lock:
+            self.atual = abrir_versao(versao_publicada(self.raiz), self.embeddings, self.raiz)
+            self._verificado = time.monotonic()
+        return self.atual
+
+    def atualizar(self, ao_trocar=None, forcar=False):
+        """
+        Passa para a versão publicada, se mudou, e chama ao_trocar(versão)
+        antes de liberar a trava. Retorna True se trocou.
+        """
+        agora = time.monotonic()
+        if not forcar and agora - self._verificado < self.intervalo:
+            return False
+        self._verificado = agora
+        self._fechar_substituidas(agora)
+        nome = versao_publicada(self.raiz)
+        if nome is None or (self.atual is not None and nome == self.atual.nome):
+            return False
+        with self._lock:
+            if self.atual is not None and nome == self.atual.nome:
+                return False
+            try:
+                nova = abrir_versao(nome, self.embeddings, self.raiz)
+            except Exception as e:
+                logger.warning("Não foi possível abrir a versão %s do índice: %s", nome, e)
+                return False
+            anterior, self.atual = self.atual, nova
+            if ao_trocar is not None:
+                ao_trocar(nova)
+            if anterior is not None:
+                self._substituidas.append((anterior, time.monotonic()))
+        logger.info("Índice: %s -> %s", anterior.nome if anterior else None, nome)
+        return True
+
+    def _fechar_substituidas(self, agora, prazo=PRAZO_FECHAMENTO):
+        """Fecha o chunks.sqlite das versões substituídas há mais de prazo segundos"""
+        with self._lock:
+            vencidas = [versao for versao, momento in self._substituidas if agora - momento >= prazo]
+            self._substituidas = [(v, m) for v, m in self._substituidas if agora - m < prazo]
+        for versao in vencidas:
+            _fechar(versao.vectorstore)
+            logger.info("Versão %s do índice fechada", versao.nome)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construtor do índice versionado (ver indice_versionado.py)")
+    parser.add_argument("--dir", help="diretório do índice versionado (padrão: o do modo SCR_INDICE_MODO)")
+    parser.add_argument("--intervalo", type=float, default=0,
+                        help="verifica as fontes a cada N segundos (0: uma vez e sai)")
+    parser.add_argument("--do-zero", action="store_true", help="reconstrói o índice inteiro e publica")
+    parser.add_argument("--reverter", action="store_true", help="volta para a versão anterior e sai")
+    parser.add_argument("--manter", type=int, default=MANTER_VERSOES, help="versões mantidas em disco")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    load_dotenv()
+    raiz = Path(args.dir) if args.dir else raiz_indice()
+    if args.reverter:
+        nome = reverter(raiz)
+        print(f"Publicada a versão {nome}" if nome else "Não há versão anterior à publicada")
+        return
+    embeddings = criar_embeddings(EMBEDDINGS_CACHE_PATH)
+    do_zero = args.do_zero
+    while True:
+        try:
+            nome, relatorio = construir(embeddings, raiz, do_zero=do_zero, manter=args.manter)
+        except ErroValidacao as e:
+            print(f"Versão reprovada na validação ({e}); mantida a {versao_publicada(raiz)}")
+            nome = None
+            if not args.intervalo:
+                sys.exit(1)
+        do_zero = False
+        if nome is not None:
+            alteradas = ", ".join(relatorio.fontes_alteradas + relatorio.fontes_removidas)
+            motivo = alteradas or ("reconstrução" if relatorio.reconstruido
+                                   else "conversão do índice" if relatorio.indice_convertido
+                                   else "datas de modificação")
+            print(f"Publicada a versão {nome} (fontes: {motivo}; "
+                  f"+{relatorio.chunks_adicionados} / -{relatorio.chunks_removidos} chunks)")
+        elif not args.intervalo:
+            print(f"Índice atualizado: {versao_publicada(raiz)}")
+        if not args.intervalo:
+            break
+        time.sleep(args.intervalo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Tipos de índice FAISS e carga memory-mapped.
+
+O tipo é escolhido por SCR_INDICE_FAISS (padrão "Flat"):
+  - Flat: busca exata, todos os vetores em memória
+  - HNSW: grafo de vizinhança, busca aproximada rápida (usa mais memória)
+  - IVF-Flat: listas invertidas por centróide; com mmap as listas ficam em disco
+  - IVF-PQ: listas invertidas com vetores comprimidos por product quantization
+
+As atualizações incrementais do vectorstore são feitas sobre um índice
+Flat (o único que aceita remoção por id em todos os casos); ao final ele é
+convertido para o tipo configurado a partir dos vetores exatos.
+"""
+
+import logging
+import math
+import os
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from docstore_sqlite import CHUNKS_NOME, DocstoreSQLite, gravar_docstore
+
+
+logger = logging.getLogger(__name__)
+
+TIPOS_INDICE = ("Flat", "HNSW", "IVF-Flat", "IVF-PQ")
+TIPO_PADRAO = "Flat"
+
+# Parâmetros de construção e busca
+HNSW_M = 32
+HNSW_EF_CONSTRUCAO = 80
+HNSW_EF_BUSCA = 64
+IVF_NPROBE = 16
+PQ_BITS = 8
+# Abaixo disso o treino dos codebooks PQ (2^PQ_BITS centróides) não é confiável
+MIN_VETORES_PQ = 1000
+# Pontos de treino por centróide recomendados pelo FAISS
+_MIN_PONTOS_POR_CENTROIDE = 39
+
+
+def tipo_configurado():
+    tipo = os.getenv("SCR_INDICE_FAISS", TIPO_PADRAO)
+    if tipo not in TIPOS_INDICE:
+        raise ValueError(f"SCR_INDICE_FAISS inválido: {tipo} (opções: {', '.join(TIPOS_INDICE)})")
+    return tipo
+
+
+def tipo_do_indice(index):
+    """Tipo (de TIPOS_INDICE) de um índice FAISS já construído"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "HNSW"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "IVF-PQ"
+    if isinstance(index, faiss.IndexIVF):
+        return "IVF-Flat"
+    return "Flat"
+
+
+def _n_listas(n_vetores):
+    """nlist ~ 4*sqrt(n), limitado para haver pontos de treino suficientes"""
+    return max(1, min(int(4 * math.sqrt(n_vetores)), n_vetores // _MIN_PONTOS_POR_CENTROIDE))
+
+
+def _n_subquantizadores(dimensao):
+    """Maior divisor da dimensão até dimensao/16 (ex.: 1536 -> 96 subvetores de 16)"""
+    for m in range(max(1, dimensao // 16), 0, -1):
+        if dimensao % m == 0:
+            return m
+    return 1
+
+
+def tipo_efetivo(tipo, n_vetores):
+    """Tipo realmente construído: IVF-PQ recai em Flat se há poucos vetores para treinar"""
+    if tipo == "IVF-PQ" and n_vetores < MIN_VETORES_PQ:
+        return "Flat"
+    return tipo
+
+
+def descricao_fabrica(tipo, dimensao, n_vetores):
+    """String de index_factory para o tipo"""
+    tipo = tipo_efetivo(tipo, n_vetores)
+    if tipo == "HNSW":
+        return f"HNSW{HNSW_M},Flat"
+    if tipo == "IVF-Flat":
+        return f"IVF{_n_listas(n_vetores)},Flat"
+    if tipo == "IVF-PQ":
+        return f"IVF{_n_listas(n_vetores)},PQ{_n_subquantizadores(dimensao)}x{PQ_BITS}"
+    return "Flat"
+
+
+def ajustar_busca(index):
+    """Parâmetros de busca (efSearch, nprobe) de índices aproximados"""
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = HNSW_EF_BUSCA
+    elif isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(IVF_NPROBE, base.nlist)
+    return index
+
+
+def criar_indice(tipo, vetores):
+    """Constrói (e treina, se preciso) um índice do tipo com os vetores, na ordem dada"""
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+    n, dimensao = vetores.shape
+    index = faiss.index_factory(dimensao, descricao_fabrica(tipo, dimensao, n))
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCAO
+    if isinstance(base, faiss.IndexIVFPQ):
+        # O treino polissêmico (ligado por padrão) custa minutos e não é usado na busca
+        base.do_polysemous_training = False
+    if not index.is_trained:
+        index.train(vetores)
+    if n:
+        index.add(vetores)
+    return ajustar_busca(index)
+
+
+def vetores_do_indice(index):
+    """Todos os vetores de um índice Flat, na ordem dos ids internos"""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def para_flat_mutavel(vectorstore, embeddings):
+    """
+    Garante que o vectorstore tem um índice Flat próprio (não mapeado em
+    memória) e um docstore em memória antes de remover/inserir chunks, para
+    que o chunks.sqlite em uso só seja trocado no salvamento. Índices
+    aproximados são refeitos a partir dos textos do docstore, reembedados
+    pelo cache.
+    """
+    if isinstance(vectorstore.docstore, DocstoreSQLite):
+        vectorstore.docstore = vectorstore.docstore.em_memoria()
+    if tipo_do_indice(vectorstore.index) == "Flat":
+        vectorstore.index = faiss.clone_index(vectorstore.index)
+        return vectorstore
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+    textos = [vectorstore.docstore.search(id_).page_content for id_ in ids]
+    vetores = np.array(embeddings.embed_documents(textos), dtype=np.float32) if textos \
+        else np.empty((0, vectorstore.index.d), dtype=np.float32)
+    vectorstore.index = criar_indice("Flat", vetores)
+    return vectorstore
+
+
+def converter(vectorstore, tipo):
+    """Troca o índice Flat do vectorstore por um do tipo pedido (mesma ordem de ids)"""
+    if tipo_efetivo(tipo, vectorstore.index.ntotal) == tipo_do_indice(vectorstore.index):
+        return vectorstore
+    if tipo_do_indice(vectorstore.index) != "Flat":
+        raise ValueError("A conversão parte de um índice Flat")
+    vectorstore.index = criar_indice(tipo, vetores_do_indice(vectorstore.index))
+    return vectorstore
+
+
+def carregar_local(caminho, embeddings, mmap=True):
+    """
+    Equivalente a FAISS.load_local com leitura somente-leitura e
+    memory-mapped do índice (as listas invertidas de IVF ficam em disco).
+    Dos chunks só o mapeamento posição -> id é lido agora; textos e
+    metadados vêm do chunks.sqlite sob demanda, para os resultados da busca.
+    """
+    caminho = Path(caminho)
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    index = ajustar_busca(faiss.read_index(str(caminho / "index.faiss"), flags))
+    docstore = DocstoreSQLite(caminho / CHUNKS_NOME)
+    index_to_docstore_id = docstore.ler_posicoes()
+    if len(index_to_docstore_id) != index.ntotal:
+        raise ValueError(
+            f"Índice com {index.ntotal} vetores e {len(index_to_docstore_id)} posições em {CHUNKS_NOME}"
+        )
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def salvar_local(vectorstore, caminho):
+    """Substituto de FAISS.save_local: index.faiss + chunks.sqlite (sem pickle)"""
+    caminho = Path(caminho)
+    caminho.mkdir(parents=True, exist_ok=True)
+    faiss.write_index(vectorstore.index, str(caminho / "index.faiss"))
+    gravar_docstore(vectorstore, caminho)
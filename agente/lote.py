@@ -0,0 +1,332 @@
+"""
+Execução em lote de perguntas padrão contra os modelos do agente SCR 3040.
+
+Lê as perguntas de um CSV ou JSONL (coluna/chave "pergunta" e, opcional,
+"id"), responde cada uma com cada modelo pela mesma cadeia do app e do
+serviço (servico.Servico) e grava resposta, fontes, tempos, tokens e custo
+em JSONL ou Parquet.
+
+  - concorrência limitada (--concorrencia perguntas em andamento)
+  - balde de fichas por modelo (--rpm, --rpm-modelo gpt-4o=30); um erro de
+    limite da API (429) pausa o balde do modelo pelo tempo pedido
+  - novas tentativas com espera exponencial e jitter para limite, timeout
+    e erros transitórios da API
+  - checkpoint: cada resultado é gravado assim que termina (no próprio
+    JSONL de saída ou, para Parquet, em <saida>.parcial.jsonl); rodar o
+    mesmo comando de novo retoma a partir do que falta (falhas são refeitas)
+
+Cada pergunta é respondida sem histórico de conversa.
+
+Uso:
+  python agente/lote.py perguntas.csv --saida respostas.parquet
+                        [--modelos GPT-4o GPT-4o-mini] [--concorrencia 8]
+                        [--rpm 60] [--rpm-modelo gpt-4o=30] [--tentativas 4]
+                        [--timeout 60] [--sem-cache]
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import openai
+from dotenv import load_dotenv
+
+from recursos import MODELOS_DISPONIVEIS, TIMEOUT_MODELO_PADRAO, nome_do_modelo
+from servico import Servico
+
+
+logger = logging.getLogger(__name__)
+
+RPM_PADRAO = 60
+CONCORRENCIA_PADRAO = 8
+TENTATIVAS_PADRAO = 4
+ESPERA_BASE = 2.0
+ESPERA_MAXIMA = 60.0
+
+# Erros que valem nova tentativa
+ERROS_TRANSITORIOS = (
+    asyncio.TimeoutError,
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class BaldeDeFichas:
+    """Limita as chamadas a um modelo a por_minuto, com rajadas de até capacidade"""
+
+    def __init__(self, por_minuto, capacidade=None):
+        self.taxa = por_minuto / 60
+        self.capacidade = capacidade or max(1.0, por_minuto / 10)
+        self.fichas = self.capacidade
+        self.atualizado = time.monotonic()
+        self.pausado_ate = 0.0
+        self._lock = asyncio.Lock()
+
+    def _repor(self, agora):
+        self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+
+    async def adquirir(self):
+        # O lock atende os pedidos em ordem de chegada
+        async with self._lock:
+            while True:
+                agora = time.monotonic()
+                self._repor(agora)
+                if agora < self.pausado_ate:
+                    await asyncio.sleep(self.pausado_ate - agora)
+                    continue
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                await asyncio.sleep((1 - self.fichas) / self.taxa)
+
+    def pausar(self, segundos):
+        """Depois de um 429: ninguém usa o modelo por segundos, e o balde recomeça vazio"""
+        self.pausado_ate = max(self.pausado_ate, time.monotonic() + segundos)
+        self.fichas = 0.0
+
+
+def ler_perguntas(caminho):
+    """Lista de {"id", "pergunta"} de um CSV (com cabeçalho) ou JSONL"""
+    caminho = Path(caminho)
+    if caminho.suffix.lower() == ".jsonl":
+        with open(caminho, encoding="utf-8") as f:
+            linhas = [json.loads(l) for l in f if l.strip()]
+    else:
+        with open(caminho, encoding="utf-8-sig", newline="") as f:
+            linhas = list(csv.DictReader(f))
+    perguntas = []
+    for i, linha in enumerate(linhas, start=1):
+        texto = (linha.get("pergunta") or "").strip()
+        if texto:
+            perguntas.append({"id": str(linha.get("id") or i), "pergunta": texto})
+    ids = [p["id"] for p in perguntas]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"IDs repetidos em {caminho}")
+    return perguntas
+
+
+def arquivo_checkpoint(saida):
+    saida = Path(saida)
+    if saida.suffix.lower() == ".parquet":
+        return saida.with_name(saida.name + ".parcial.jsonl")
+    return saida
+
+
+def ler_checkpoint(caminho):
+    """Resultados já gravados, por (id, modelo); o último de cada par prevalece"""
+    resultados = {}
+    if not Path(caminho).exists():
+        return resultados
+    with open(caminho, encoding="utf-8") as f:
+        for linha in f:
+            try:
+                registro = json.loads(linha)
+            except json.JSONDecodeError:
+                # Linha truncada por uma interrupção no meio da gravação
+                continue
+            resultados[(registro["id"], registro["modelo"])] = registro
+    return resultados
+
+
+def _espera(tentativa, erro):
+    """Segundos até a próxima tentativa (Retry-After da API, se houver)"""
+    resposta = getattr(erro, "response", None)
+    depois = resposta.headers.get("retry-after") if resposta is not None else None
+    try:
+        if depois is not None:
+            return min(float(depois), ESPERA_MAXIMA)
+    except ValueError:
+        pass
+    return min(ESPERA_BASE * 2 ** (tentativa - 1), ESPERA_MAXIMA) * random.uniform(0.5, 1.0)
+
+
+def _descrever(erro, args):
+    if isinstance(erro, asyncio.TimeoutError):
+        return f"Tempo limite de {args.timeout:g}s excedido"
+    return f"{type(erro).__name__}: {str(erro)[:300]}"
+
+
+def _registro(item, modelo, resposta=None, erro=None, tentativas=0, duracao=0.0):
+    registro = {
+        "id": item["id"],
+        "pergunta": item["pergunta"],
+        "modelo": modelo,
+        "resposta": resposta.resposta if resposta else None,
+        "origem": resposta.origem if resposta else None,
+        "fontes": [
+            {"source": doc.metadata.get("source"), "page": doc.metadata.get("page")}
+            for doc in (resposta.documentos if resposta else [])
+        ],
+        "duracao": round(duracao, 3),
+        "tentativas": tentativas,
+        "erro": erro,
+    }
+    metricas = resposta.metricas if resposta else None
+    if metricas:
+        registro["tokens_entrada"] = metricas["tokens"]["entrada"]
+        registro["tokens_saida"] = metricas["tokens"]["saida"]
+        registro["custo_usd"] = metricas["custo_usd"]
+        registro.update({f"tempo_{etapa}": duracao for etapa, duracao in metricas["etapas"].items()})
+    return registro
+
+
+async def responder(servico, item, modelo, balde, args):
+    """Responde com novas tentativas; devolve o registro (com erro, se todas falharem)"""
+    inicio = time.perf_counter()
+    for tentativa in range(1, args.tentativas + 1):
+        await balde.adquirir()
+        conversa_id = f"lote-{uuid.uuid4().hex}"
+        try:
+            resposta = await servico.perguntar(item["pergunta"], modelo, conversa_id, args.timeout,
+                                               usar_cache=not args.sem_cache, modo="lote")
+            return _registro(item, modelo, resposta, tentativas=tentativa,
+                             duracao=time.perf_counter() - inicio)
+        except ERROS_TRANSITORIOS as e:
+            if tentativa == args.tentativas:
+                erro = _descrever(e, args)
+                break
+            espera = _espera(tentativa, e)
+            if isinstance(e, openai.RateLimitError):
+                balde.pausar(espera)
+            logger.info("%s/%s: %s; nova tentativa em %.1fs", item["id"], modelo, type(e).__name__, espera)
+            await asyncio.sleep(espera)
+        except Exception as e:
+            erro = _descrever(e, args)
+            break
+        finally:
+            servico.conversas.remover(conversa_id)
+    return _registro(item, modelo, erro=erro, tentativas=tentativa, duracao=time.perf_counter() - inicio)
+
+
+async def executar(servico, tarefas, baldes, args, checkpoint):
+    """Consome as tarefas com um número fixo de workers, gravando cada resultado ao terminar"""
+    fila = asyncio.Queue()
+    for tarefa in tarefas:
+        fila.put_nowait(tarefa)
+    concluidas = 0
+    falhas = 0
+
+    with open(checkpoint, "a", encoding="utf-8") as saida:
+        async def worker():
+            nonlocal concluidas, falhas
+            while True:
+                try:
+                    item, modelo = fila.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                registro = await responder(servico, item, modelo, baldes[modelo], args)
+                saida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                saida.flush()
+                concluidas += 1
+                falhas += registro["erro"] is not None
+                situacao = f"erro ({registro['erro'][:80]})" if registro["erro"] else f"{registro['origem']}"
+                print(f"[{concluidas}/{len(tarefas)}] {modelo} {item['id']}: {situacao} "
+                      f"em {registro['duracao']:.1f}s", file=sys.stderr)
+
+        await asyncio.gather(*(worker() for _ in range(min(args.concorrencia, len(tarefas)) or 1)))
+    return falhas
+
+
+def gravar_saida(resultados, saida):
+    """Grava os resultados na ordem das perguntas e dos modelos"""
+    saida = Path(saida)
+    if saida.suffix.lower() == ".parquet":
+        import pandas as pd
+        pd.DataFrame(resultados).to_parquet(saida, index=False)
+    else:
+        # O checkpoint é o próprio arquivo: reescreve sem as tentativas repetidas
+        temporario = saida.with_name(saida.name + ".tmp")
+        with open(temporario, "w", encoding="utf-8") as f:
+            for registro in resultados:
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        temporario.replace(saida)
+
+
+def resumo(resultados):
+    por_modelo = {}
+    for r in resultados:
+        m = por_modelo.setdefault(r["modelo"], {"n": 0, "erros": 0, "duracao": 0.0, "custo": 0.0})
+        m["n"] += 1
+        m["erros"] += r["erro"] is not None
+        m["duracao"] += r["duracao"]
+        m["custo"] += r.get("custo_usd") or 0.0
+    print(f"\n{'Modelo':<16}{'perguntas':>10}{'erros':>7}{'tempo médio':>13}{'custo US$':>11}")
+    for modelo, m in por_modelo.items():
+        print(f"{modelo:<16}{m['n']:>10}{m['erros']:>7}{m['duracao'] / max(m['n'], 1):>12.1f}s{m['custo']:>11.4f}")
+
+
+def _limites(args, modelos):
+    rpm_modelo = {}
+    for item in args.rpm_modelo:
+        modelo, _, valor = item.partition("=")
+        nome = nome_do_modelo(modelo.strip())
+        if nome is None or not valor:
+            raise SystemExit(f"--rpm-modelo inválido: {item} (ex.: gpt-4o=30)")
+        rpm_modelo[nome] = float(valor)
+    return {modelo: BaldeDeFichas(rpm_modelo.get(modelo, args.rpm)) for modelo in modelos}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("perguntas", help="CSV ou JSONL com a coluna/chave \"pergunta\" (e \"id\", opcional)")
+    parser.add_argument("--saida", required=True, help="arquivo .jsonl ou .parquet")
+    parser.add_argument("--modelos", nargs="+", default=list(MODELOS_DISPONIVEIS),
+                        help="rótulos ou nomes da API (padrão: todos)")
+    parser.add_argument("--concorrencia", type=int, default=CONCORRENCIA_PADRAO)
+    parser.add_argument("--rpm", type=float, default=RPM_PADRAO, help="chamadas por minuto por modelo")
+    parser.add_argument("--rpm-modelo", action="append", default=[], help="limite de um modelo (gpt-4o=30)")
+    parser.add_argument("--tentativas", type=int, default=TENTATIVAS_PADRAO)
+    parser.add_argument("--timeout", type=float, default=TIMEOUT_MODELO_PADRAO, help="segundos por tentativa")
+    parser.add_argument("--sem-cache", action="store_true", help="não usa respostas do cache semântico")
+    args = parser.parse_args()
+
+    if args.concorrencia < 1 or args.tentativas < 1 or args.rpm <= 0:
+        raise SystemExit("--concorrencia, --tentativas e --rpm devem ser positivos")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    load_dotenv()
+
+    modelos = []
+    for modelo in args.modelos:
+        nome = nome_do_modelo(modelo)
+        if nome is None:
+            raise SystemExit(f"Modelo desconhecido: {modelo} (opções: {', '.join(MODELOS_DISPONIVEIS)})")
+        modelos.append(nome)
+    perguntas = ler_perguntas(args.perguntas)
+    checkpoint = arquivo_checkpoint(args.saida)
+    anteriores = ler_checkpoint(checkpoint)
+    tarefas = [
+        (item, modelo) for item in perguntas for modelo in modelos
+        if anteriores.get((item["id"], modelo), {}).get("erro", True) is not None
+    ]
+    print(f"{len(perguntas)} perguntas x {len(modelos)} modelos; {len(tarefas)} a executar "
+          f"({len(perguntas) * len(modelos) - len(tarefas)} já no checkpoint)", file=sys.stderr)
+
+    if tarefas:
+        servico = Servico()
+        try:
+            asyncio.run(executar(servico, tarefas, _limites(args, modelos), args, checkpoint))
+        except KeyboardInterrupt:
+            raise SystemExit(f"\nInterrompido; o progresso está em {checkpoint}. Rode o mesmo comando para retomar.")
+
+    concluidos = ler_checkpoint(checkpoint)
+    resultados = [concluidos[(item["id"], modelo)] for item in perguntas for modelo in modelos
+                  if (item["id"], modelo) in concluidos]
+    gravar_saida(resultados, args.saida)
+    if checkpoint != Path(args.saida) and all(r["erro"] is None for r in resultados):
+        checkpoint.unlink()
+    resumo(resultados)
+    print(f"\nResultados em {args.saida}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
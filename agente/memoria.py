@@ -0,0 +1,245 @@
+"""
+Memória das conversas com orçamento de tokens.
+
+ConversationBufferMemory guarda todos os turnos: o histórico enviado à
+reescrita da pergunta e ao prompt de resposta ({chat_history}) cresce sem
+limite. MemoriaComOrcamento mantém os últimos turnos na íntegra e resume
+os mais antigos, incrementalmente, em um resumo progressivo; os tokens são
+contados com tiktoken.
+
+O modo vem de SCR_MEMORIA: "orcamento" (padrão) ou "completa" (buffer
+original). Limites: SCR_MEMORIA_TURNOS (turnos mantidos na íntegra) e
+SCR_MEMORIA_MAX_TOKENS (resumo + turnos).
+"""
+
+import logging
+import os
+import time
+from functools import lru_cache
+from typing import Optional
+
+from langchain.memory import ConversationBufferMemory
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import SystemMessage, get_buffer_string
+from langchain.prompts import PromptTemplate
+
+
+logger = logging.getLogger(__name__)
+
+TURNOS_INTEGRAIS = 4
+MAX_TOKENS_HISTORICO = 2000
+MAX_TOKENS_RESUMO = 400
+# Modelo de referência para a contagem (o200k_base, família gpt-4o)
+MODELO_TOKENS = "gpt-4o-mini"
+
+TEMPLATE_RESUMO = """Você mantém um resumo progressivo de uma conversa sobre o documento SCR 3040
+do Banco Central do Brasil. Incorpore as novas falas ao resumo atual, em no máximo
+{max_palavras} palavras. Preserve campos, atributos, códigos de crítica, valores e
+conclusões citados; omita cumprimentos e repetições.
+
+Resumo atual:
+{resumo}
+
+Novas falas:
+{falas}
+
+Novo resumo:"""
+
+PROMPT_RESUMO = PromptTemplate(
+    template=TEMPLATE_RESUMO,
+    input_variables=["max_palavras", "resumo", "falas"]
+)
+
+
+@lru_cache(maxsize=None)
+def _codificador(modelo):
+    """Codificador do tiktoken; None sem o arquivo de BPE (ex.: sem rede), tentado uma vez"""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(modelo)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning("tiktoken indisponível (%s); estimando 4 caracteres por token", e)
+        return None
+
+
+def contar_tokens(texto, modelo=MODELO_TOKENS):
+    codificador = _codificador(modelo)
+    if codificador is None:
+        return len(texto) // 4
+    return len(codificador.encode(texto))
+
+
+def truncar_tokens(texto, max_tokens, modelo=MODELO_TOKENS):
+    """Corta o texto em max_tokens (mantém o início)"""
+    codificador = _codificador(modelo)
+    if codificador is None:
+        return texto[:max_tokens * 4]
+    tokens = codificador.encode(texto)
+    return texto if len(tokens) <= max_tokens else codificador.decode(tokens[:max_tokens])
+
+
+class MemoriaComOrcamento(BaseChatMemory):
+    """
+    Últimos turnos na íntegra e os anteriores em um resumo progressivo.
+
+    Depois de cada turno, os turnos mais antigos são retirados enquanto houver
+    mais que turnos_integrais ou o histórico (resumo + turnos) passar de
+    max_tokens; os retirados são incorporados ao resumo por uma chamada ao
+    llm. O resumo é limitado a max_tokens_resumo.
+    """
+
+    llm: BaseLanguageModel
+    memory_key: str = "chat_history"
+    human_prefix: str = "Human"
+    ai_prefix: str = "AI"
+    turnos_integrais: int = TURNOS_INTEGRAIS
+    max_tokens: int = MAX_TOKENS_HISTORICO
+    max_tokens_resumo: int = MAX_TOKENS_RESUMO
+    resumo: str = ""
+    turnos_resumidos: int = 0
+    # Chamada de resumo do último save_context (para as métricas), ou None
+    ultimo_resumo: Optional[dict] = None
+
+    @property
+    def memory_variables(self):
+        return [self.memory_key]
+
+    def mensagens(self):
+        mensagens = list(self.chat_memory.messages)
+        if self.resumo:
+            mensagens.insert(0, SystemMessage(content=f"Resumo da conversa anterior: {self.resumo}"))
+        return mensagens
+
+    def load_memory_variables(self, inputs):
+        mensagens = self.mensagens()
+        if self.return_messages:
+            return {self.memory_key: mensagens}
+        return {self.memory_key: get_buffer_string(mensagens, human_prefix=self.human_prefix,
+                                                   ai_prefix=self.ai_prefix)}
+
+    def tokens_historico(self):
+        """Tokens do histórico que entra nos prompts (resumo + turnos)"""
+        return sum(contar_tokens(str(m.content)) for m in self.mensagens())
+
+    def _retirar_excedentes(self):
+        """Retira do buffer os turnos que passam dos limites; devolve as mensagens retiradas"""
+        mensagens = list(self.chat_memory.messages)
+        tokens = [contar_tokens(str(m.content)) for m in mensagens]
+        total = contar_tokens(self.resumo) + sum(tokens)
+        corte = 0
+        # O turno mais recente fica sempre, mesmo acima do orçamento
+        while len(mensagens) - corte > 2 and (
+                len(mensagens) - corte > 2 * self.turnos_integrais or total > self.max_tokens):
+            total -= tokens[corte] + tokens[corte + 1]
+            corte += 2
+        if not corte:
+            return []
+        self.chat_memory.clear()
+        self.chat_memory.add_messages(mensagens[corte:])
+        self.turnos_resumidos += corte // 2
+        return mensagens[:corte]
+
+    def _prompt_resumo(self, retiradas):
+        return PROMPT_RESUMO.format(
+            max_palavras=int(self.max_tokens_resumo * 0.6),
+            resumo=self.resumo or "(vazio)",
+            falas=get_buffer_string(retiradas, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        )
+
+    def _atualizar_resumo(self, prompt, resposta, inicio):
+        self.resumo = truncar_tokens(resposta.content.strip(), self.max_tokens_resumo)
+        self.ultimo_resumo = {
+            "modelo": getattr(self.llm, "model_name", None),
+            "duracao": time.perf_counter() - inicio,
+            "prompt": prompt,
+            "mensagem": resposta,
+        }
+
+    def save_context(self, inputs, outputs):
+        super().save_context(inputs, outputs)
+        self.ultimo_resumo = None
+        retiradas = self._retirar_excedentes()
+        if retiradas:
+            prompt, inicio = self._prompt_resumo(retiradas), time.perf_counter()
+            try:
+                self._atualizar_resumo(prompt, self.llm.invoke(prompt), inicio)
+            except Exception as e:
+                # Sem resumo novo, os turnos retirados são perdidos, mas o prompt continua limitado
+                logger.warning("Não foi possível resumir o histórico: %s", e)
+
+    async def asave_context(self, inputs, outputs):
+        await super().asave_context(inputs, outputs)
+        self.ultimo_resumo = None
+        retiradas = self._retirar_excedentes()
+        if retiradas:
+            prompt, inicio = self._prompt_resumo(retiradas), time.perf_counter()
+            try:
+                self._atualizar_resumo(prompt, await self.llm.ainvoke(prompt), inicio)
+            except Exception as e:
+                logger.warning("Não foi possível resumir o histórico: %s", e)
+
+    def clear(self):
+        super().clear()
+        self.resumo = ""
+        self.turnos_resumidos = 0
+
+    async def aclear(self):
+        await super().aclear()
+        self.resumo = ""
+        self.turnos_resumidos = 0
+
+
+def modo_configurado():
+    modo = os.getenv("SCR_MEMORIA", "orcamento").lower()
+    if modo not in ("orcamento", "completa"):
+        raise ValueError(f"SCR_MEMORIA inválido: {modo} (opções: orcamento, completa)")
+    return modo
+
+
+def criar_memoria(llm_resumo, modo=None):
+    """Memória de uma conversa no modo configurado; llm_resumo resume os turnos antigos"""
+    if (modo or modo_configurado()) == "completa":
+        return ConversationBufferMemory(
+            memory_key="chat_history",
+            return_messages=True,
+            output_key="answer"
+        )
+    return MemoriaComOrcamento(
+        llm=llm_resumo,
+        return_messages=True,
+        output_key="answer",
+        turnos_integrais=int(os.getenv("SCR_MEMORIA_TURNOS", TURNOS_INTEGRAIS)),
+        max_tokens=int(os.getenv("SCR_MEMORIA_MAX_TOKENS", MAX_TOKENS_HISTORICO))
+    )
+
+
+def desfazer_ultimo_turno(memoria):
+    """Remove a última pergunta e resposta (ex.: resposta refeita por outro modelo)"""
+    mensagens = list(memoria.chat_memory.messages)
+    if len(mensagens) >= 2:
+        memoria.chat_memory.clear()
+        memoria.chat_memory.add_messages(mensagens[:-2])
+
+
+def historico_vazio(memoria):
+    """True se a conversa ainda não tem turnos (nem resumo)"""
+    return not memoria.chat_memory.messages and not getattr(memoria, "resumo", "")
+
+
+def copiar_memoria(memoria):
+    """
+    Cópia da memória com histórico próprio: o turno salvo nela só entra na
+    conversa se a cópia substituir a original (ex.: resposta dentro do prazo)
+    """
+    return memoria.model_copy(update={"chat_memory": memoria.chat_memory.model_copy(deep=True)})
+
+
+def tokens_da_memoria(memoria):
+    """Tokens do histórico de qualquer memória de conversa (para métricas)"""
+    if isinstance(memoria, MemoriaComOrcamento):
+        return memoria.tokens_historico()
+    return sum(contar_tokens(str(m.content)) for m in memoria.chat_memory.messages)
@@ -0,0 +1,298 @@
+"""
+Métricas por pergunta: tempo de cada etapa, tokens e custo estimado.
+
+MedidorEtapas é um callback da cadeia que cronometra a reescrita da
+pergunta (condensacao), a busca nos documentos (recuperacao) e a geração
+da resposta (geracao), e soma os tokens de cada chamada ao LLM (uso
+informado pela API ou, sem ele, contado com tiktoken). O resumo da memória
+e a busca na internet são registrados à parte. O custo usa os preços de
+MODELOS_DISPONIVEIS (US$ por milhão de tokens).
+
+ColetorMetricas grava um registro JSON por linha (SCR_METRICAS_ARQUIVO;
+"nenhum" desativa), mantém as latências recentes para p50/p95 e exporta
+no formato de texto do Prometheus (endpoint /metricas do serviço ou, com
+SCR_METRICAS_PROMETHEUS, um arquivo para o textfile collector).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from pathlib import Path
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from memoria import contar_tokens
+from recursos import METRICAS_PATH, MODELOS_DISPONIVEIS
+
+
+logger = logging.getLogger(__name__)
+
+ETAPAS = ("condensacao", "recuperacao", "geracao", "resumo_memoria", "busca_web")
+# Latências recentes usadas nos percentis
+JANELA_PERCENTIS = 500
+# Limites (s) dos buckets do histograma do Prometheus
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _precos_por_modelo():
+    return {
+        info["nome"]: (info.get("preco_entrada", 0.0), info.get("preco_saida", 0.0))
+        for info in MODELOS_DISPONIVEIS.values()
+    }
+
+
+PRECOS = _precos_por_modelo()
+
+
+def custo(modelo, tokens_entrada, tokens_saida):
+    """Custo estimado em US$; 0 para modelos sem preço conhecido"""
+    preco_entrada, preco_saida = PRECOS.get(modelo, (0.0, 0.0))
+    return (tokens_entrada * preco_entrada + tokens_saida * preco_saida) / 1e6
+
+
+def uso_de_tokens(mensagem, prompt):
+    """(entrada, saída, estimado): uso informado pela API ou contagem local"""
+    uso = getattr(mensagem, "usage_metadata", None)
+    if uso:
+        return uso["input_tokens"], uso["output_tokens"], False
+    return contar_tokens(prompt), contar_tokens(str(getattr(mensagem, "content", mensagem))), True
+
+
+class MedidorEtapas(BaseCallbackHandler):
+    """
+    Cronometra as etapas de uma pergunta. As chamadas ao LLM antes da busca
+    nos documentos são a reescrita da pergunta; as depois, a resposta.
+    """
+
+    # Registra na thread da chamada (também no caminho assíncrono)
+    run_inline = True
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.inicio = time.perf_counter()
+        self.etapas = defaultdict(float)
+        self.chamadas = []
+        self._abertas = {}
+        self._recuperou = False
+        self._lock = threading.Lock()
+
+    def _abrir(self, run_id, etapa, **dados):
+        with self._lock:
+            self._abertas[run_id] = (etapa, time.perf_counter(), dados)
+
+    def _fechar(self, run_id):
+        with self._lock:
+            etapa, inicio, dados = self._abertas.pop(run_id, (None, None, None))
+            if etapa is not None:
+                self.etapas[etapa] += time.perf_counter() - inicio
+            return etapa, dados
+
+    def _iniciar_llm(self, run_id, prompt, invocation_params):
+        params = invocation_params or {}
+        modelo = params.get("model_name") or params.get("model") or self.modelo
+        etapa = "geracao" if self._recuperou else "condensacao"
+        self._abrir(run_id, etapa, modelo=modelo, prompt=prompt)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        # Cada execução da cadeia (ex.: pergunta refeita por outro modelo) recomeça na reescrita
+        if parent_run_id is None:
+            self._recuperou = False
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, invocation_params=None, **kwargs):
+        prompt = "\n".join(str(m.content) for lote in messages for m in lote)
+        self._iniciar_llm(run_id, prompt, invocation_params)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, invocation_params=None, **kwargs):
+        self._iniciar_llm(run_id, "\n".join(prompts), invocation_params)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        etapa, dados = self._fechar(run_id)
+        if etapa is None:
+            return
+        geracao = response.generations[0][0] if response.generations and response.generations[0] else None
+        mensagem = getattr(geracao, "message", None) or getattr(geracao, "text", "")
+        self._registrar_tokens(etapa, dados["modelo"], mensagem, dados["prompt"])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._fechar(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._abrir(run_id, "recuperacao")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._fechar(run_id)
+        self._recuperou = True
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._fechar(run_id)
+        self._recuperou = True
+
+    def _registrar_tokens(self, etapa, modelo, mensagem, prompt):
+        entrada, saida, estimado = uso_de_tokens(mensagem, prompt)
+        with self._lock:
+            self.chamadas.append({"etapa": etapa, "modelo": modelo, "entrada": entrada,
+                                  "saida": saida, "estimado": estimado})
+
+    def registrar_etapa(self, etapa, duracao):
+        """Etapa medida fora da cadeia (ex.: busca na internet)"""
+        if duracao is not None:
+            with self._lock:
+                self.etapas[etapa] += duracao
+
+    def registrar_resumo(self, memoria):
+        """Resumo feito pela memória ao salvar o turno (ver MemoriaComOrcamento.ultimo_resumo)"""
+        resumo = getattr(memoria, "ultimo_resumo", None)
+        if resumo:
+            self.registrar_etapa("resumo_memoria", resumo["duracao"])
+            self._registrar_tokens("resumo_memoria", resumo["modelo"], resumo["mensagem"], resumo["prompt"])
+
+    def registro(self, origem, **extras):
+        """Registro da pergunta (um dict serializável em JSON)"""
+        with self._lock:
+            chamadas = list(self.chamadas)
+            etapas = {etapa: round(self.etapas[etapa], 4) for etapa in ETAPAS if etapa in self.etapas}
+        entrada = sum(c["entrada"] for c in chamadas)
+        saida = sum(c["saida"] for c in chamadas)
+        return {
+            "instante": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "modelo": self.modelo,
+            "origem": origem,
+            "duracao_total": round(time.perf_counter() - self.inicio, 4),
+            "etapas": etapas,
+            "tokens": {"entrada": entrada, "saida": saida,
+                       "estimado": any(c["estimado"] for c in chamadas)},
+            "custo_usd": round(sum(custo(c["modelo"], c["entrada"], c["saida"]) for c in chamadas), 6),
+            "chamadas": chamadas,
+            **extras,
+        }
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def _rotulos(**rotulos):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in rotulos.items()) + "}"
+
+
+class ColetorMetricas:
+    """Grava os registros em JSONL e agrega latências, tokens e custo do processo"""
+
+    def __init__(self, arquivo=None, arquivo_prometheus=None, janela=JANELA_PERCENTIS):
+        self.arquivo = Path(arquivo) if arquivo else None
+        self.arquivo_prometheus = Path(arquivo_prometheus) if arquivo_prometheus else None
+        self._lock = threading.Lock()
+        self._recentes = defaultdict(lambda: deque(maxlen=janela))
+        self._buckets = defaultdict(lambda: [0] * len(BUCKETS))
+        self._soma = defaultdict(float)
+        self._contagem = defaultdict(int)
+        self._perguntas = defaultdict(int)
+        self._tokens = defaultdict(int)
+        self._custo = defaultdict(float)
+        # rota do roteamento automático -> [perguntas, duração, custo]
+        self._rotas = defaultdict(lambda: [0, 0.0, 0.0])
+        if self.arquivo:
+            self.arquivo.parent.mkdir(parents=True, exist_ok=True)
+
+    def registrar(self, registro):
+        with self._lock:
+            etapas = dict(registro["etapas"], total=registro["duracao_total"])
+            for etapa, duracao in etapas.items():
+                self._recentes[etapa].append(duracao)
+                self._soma[etapa] += duracao
+                self._contagem[etapa] += 1
+                for i, limite in enumerate(BUCKETS):
+                    if duracao <= limite:
+                        self._buckets[etapa][i] += 1
+            self._perguntas[(registro["modelo"], registro["origem"])] += 1
+            if registro.get("rota"):
+                rota = self._rotas[registro["rota"]["rota"]]
+                rota[0] += 1
+                rota[1] += registro["duracao_total"]
+                rota[2] += registro["custo_usd"]
+            for chamada in registro["chamadas"]:
+                self._tokens[(chamada["modelo"], "entrada")] += chamada["entrada"]
+                self._tokens[(chamada["modelo"], "saida")] += chamada["saida"]
+                self._custo[chamada["modelo"]] += custo(chamada["modelo"], chamada["entrada"], chamada["saida"])
+            try:
+                if self.arquivo:
+                    with open(self.arquivo, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                if self.arquivo_prometheus:
+                    temporario = self.arquivo_prometheus.with_suffix(".tmp")
+                    temporario.write_text(self._prometheus_sem_lock(), encoding="utf-8")
+                    os.replace(temporario, self.arquivo_prometheus)
+            except OSError as e:
+                logger.warning("Não foi possível gravar as métricas: %s", e)
+
+    def percentis(self):
+        """{etapa: (p50, p95, n)} das latências recentes, na ordem de ETAPAS"""
+        with self._lock:
+            return {
+                etapa: (_percentil(self._recentes[etapa], 50), _percentil(self._recentes[etapa], 95),
+                        len(self._recentes[etapa]))
+                for etapa in ETAPAS + ("total",) if self._recentes.get(etapa)
+            }
+
+    def rotas(self):
+        """{rota: (perguntas, duração média, custo médio)} do roteamento automático"""
+        with self._lock:
+            return {rota: (n, duracao / n, valor / n) for rota, (n, duracao, valor) in self._rotas.items()}
+
+    def custo_total(self):
+        with self._lock:
+            return sum(self._custo.values())
+
+    def prometheus(self):
+        with self._lock:
+            return self._prometheus_sem_lock()
+
+    def _prometheus_sem_lock(self):
+        linhas = [
+            "# HELP scr_etapa_duracao_segundos Duração de cada etapa da resposta",
+            "# TYPE scr_etapa_duracao_segundos histogram",
+        ]
+        for etapa in sorted(self._contagem):
+            # Os buckets já são cumulativos (cada um conta as durações <= limite)
+            for limite, quantidade in zip(BUCKETS, self._buckets[etapa]):
+                linhas.append(f"scr_etapa_duracao_segundos_bucket{_rotulos(etapa=etapa, le=limite)} {quantidade}")
+            linhas.append(f"scr_etapa_duracao_segundos_bucket{_rotulos(etapa=etapa, le='+Inf')} "
+                          f"{self._contagem[etapa]}")
+            linhas.append(f"scr_etapa_duracao_segundos_sum{_rotulos(etapa=etapa)} {self._soma[etapa]:.6f}")
+            linhas.append(f"scr_etapa_duracao_segundos_count{_rotulos(etapa=etapa)} {self._contagem[etapa]}")
+        linhas += ["# HELP scr_perguntas_total Perguntas respondidas", "# TYPE scr_perguntas_total counter"]
+        for (modelo, origem), n in sorted(self._perguntas.items()):
+            linhas.append(f"scr_perguntas_total{_rotulos(modelo=modelo, origem=origem)} {n}")
+        linhas += ["# HELP scr_tokens_total Tokens enviados e gerados", "# TYPE scr_tokens_total counter"]
+        for (modelo, tipo), n in sorted(self._tokens.items()):
+            linhas.append(f"scr_tokens_total{_rotulos(modelo=modelo, tipo=tipo)} {n}")
+        linhas += ["# HELP scr_custo_dolares_total Custo estimado (US$)", "# TYPE scr_custo_dolares_total counter"]
+        for modelo, valor in sorted(self._custo.items()):
+            linhas.append(f"scr_custo_dolares_total{_rotulos(modelo=modelo)} {valor:.6f}")
+        if self._rotas:
+            linhas += ["# HELP scr_rota_perguntas_total Perguntas por rota do roteamento automático",
+                       "# TYPE scr_rota_perguntas_total counter"]
+            for rota, (n, _, _) in sorted(self._rotas.items()):
+                linhas.append(f"scr_rota_perguntas_total{_rotulos(rota=rota)} {n}")
+            linhas += ["# HELP scr_rota_duracao_segundos_total Duração somada por rota",
+                       "# TYPE scr_rota_duracao_segundos_total counter"]
+            for rota, (_, duracao, _) in sorted(self._rotas.items()):
+                linhas.append(f"scr_rota_duracao_segundos_total{_rotulos(rota=rota)} {duracao:.6f}")
+            linhas += ["# HELP scr_rota_custo_dolares_total Custo estimado por rota (US$)",
+                       "# TYPE scr_rota_custo_dolares_total counter"]
+            for rota, (_, _, valor) in sorted(self._rotas.items()):
+                linhas.append(f"scr_rota_custo_dolares_total{_rotulos(rota=rota)} {valor:.6f}")
+        return "\n".join(linhas) + "\n"
+
+
+def criar_coletor():
+    """Coletor com os destinos configurados por SCR_METRICAS_ARQUIVO e SCR_METRICAS_PROMETHEUS"""
+    arquivo = os.getenv("SCR_METRICAS_ARQUIVO", str(METRICAS_PATH))
+    if arquivo.strip().lower() == "nenhum":
+        arquivo = None
+    return ColetorMetricas(arquivo, os.getenv("SCR_METRICAS_PROMETHEUS"))
@@ -0,0 +1,120 @@
+"""
+Camada de recuperação dos agentes: reescrita da pergunta só quando
+necessária e cache dos resultados do retriever.
+
+A ConversationalRetrievalChain já pula a reescrita (condense) sem
+histórico; com histórico, faz sempre uma chamada ao LLM antes da busca.
+CondensacaoSeNecessaria evita essa chamada quando a pergunta se sustenta
+sozinha (sem "isso", "e se...", "o mesmo campo"...).
+
+RetrieverComCache memoriza os documentos do retriever por (pergunta
+reescrita normalizada, parâmetros da busca, versão do índice) em um LRU
+limitado, compartilhado entre sessões e modelos.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from langchain.chains import LLMChain
+from langchain_core.retrievers import BaseRetriever
+
+from cache_embeddings import normalizar_texto
+from texto import sem_acentos
+
+
+MAX_ITENS_CACHE = 512
+# Perguntas mais curtas que isso costumam depender do histórico ("E o prazo?")
+MIN_PALAVRAS_AUTOCONTIDA = 5
+
+# Referências ao que foi dito antes na conversa. "este"/"esta" ficam de
+# fora: sem acentos, "esta" é também o verbo ("Qual campo está...")
+_REFERENCIAS = re.compile(
+    r"^(e|mas|entao|tambem)\b|"
+    r"\b(isso|isto|disso|disto|nisso|nisto|esse|essa|esses|essas|desse|dessa|desses|dessas|nesse|nessa|"
+    r"deste|desta|neste|nesta|aquele|aquela|daquele|daquela|ele|ela|eles|elas|dele|dela|deles|"
+    r"delas|nele|nela|o mesmo|a mesma|os mesmos|as mesmas|acima|anterior|anteriormente|mencionad\w*|"
+    r"citad\w*|referid\w*|previamente|ultima resposta|voce disse)\b"
+)
+
+
+def pergunta_autocontida(pergunta):
+    """True se a pergunta pode ir à busca sem ser reescrita com o histórico"""
+    normalizada = sem_acentos(pergunta).strip()
+    if len(normalizada.split()) < MIN_PALAVRAS_AUTOCONTIDA:
+        return False
+    return not _REFERENCIAS.search(normalizada)
+
+
+class CondensacaoSeNecessaria(LLMChain):
+    """Cadeia de reescrita que devolve a própria pergunta quando ela é autocontida"""
+
+    def _call(self, inputs, run_manager=None):
+        if pergunta_autocontida(inputs["question"]):
+            return {self.output_key: inputs["question"]}
+        return super()._call(inputs, run_manager)
+
+    async def _acall(self, inputs, run_manager=None):
+        if pergunta_autocontida(inputs["question"]):
+            return {self.output_key: inputs["question"]}
+        return await super()._acall(inputs, run_manager)
+
+
+class CacheRecuperacao:
+    """LRU de resultados de busca, com contadores de acertos"""
+
+    def __init__(self, max_itens=MAX_ITENS_CACHE):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def obter(self, chave):
+        with self._lock:
+            documentos = self._itens.get(chave)
+            if documentos is None:
+                self.misses += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return list(documentos)
+
+    def guardar(self, chave, documentos):
+        with self._lock:
+            self._itens[chave] = list(documentos)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "itens": len(self._itens),
+                "hits": self.hits,
+                "misses": self.misses,
+                "taxa_acerto": self.hits / total if total else 0.0,
+            }
+
+
+class RetrieverComCache(BaseRetriever):
+    """Envolve um retriever com o CacheRecuperacao; parametros e versao entram na chave"""
+
+    retriever: Any
+    cache: Any
+    parametros: str = ""
+    versao: Any = None
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        chave = (normalizar_texto(query).lower(), self.parametros, self.versao)
+        documentos = self.cache.obter(chave)
+        if documentos is None:
+            documentos = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+            self.cache.guardar(chave, documentos)
+        return documentos
@@ -0,0 +1,120 @@
+"""
+Configuração e recursos compartilhados pelo app Streamlit e pelo serviço
+HTTP (api.py): caminhos, fontes indexadas, modelos disponíveis e a trava
+do índice, sem dependência de interface (o índice em si está em
+indice_versionado.py).
+
+Importar este módulo é barato (o app o usa antes do primeiro render):
+indexação, FAISS e carregadores só são importados quando as funções que
+os usam são chamadas.
+"""
+
+import fcntl
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).parent
+PDF_PATH = BASE_DIR / "SCR_InstrucoesDePreenchimento_Doc3040.pdf"
+XLS_PATH = BASE_DIR / "SCR3040_Leiaute.xls"
+XLS_CRITICAS_PATH = BASE_DIR / "SCR3040_Criticas.xls"
+XML_PATH = BASE_DIR / "simulacao_3040.xml"
+# Índice versionado do modo local (ver indice_versionado.py)
+VECTORSTORE_PATH = BASE_DIR / "vectorstore"
+# Fora do vectorstore para sobreviver ao "Recriar Vectorstore"
+EMBEDDINGS_CACHE_PATH = BASE_DIR / "cache" / "embeddings.sqlite"
+RESPOSTAS_CACHE_PATH = BASE_DIR / "cache" / "respostas.sqlite"
+LEIAUTE_CACHE_PATH = BASE_DIR / "cache" / "leiaute.json"
+METRICAS_PATH = BASE_DIR / "cache" / "metricas.jsonl"
+# Índice versionado do modo compartilhado (ver indice_versionado.py)
+INDICE_VERSIONADO_PATH = Path(os.getenv("SCR_INDICE_DIR", BASE_DIR / "indice"))
+
+# Tempo limite padrão (s) de cada modelo no modo comparação
+TIMEOUT_MODELO_PADRAO = 60
+
+# Opção de roteamento automático de modelo (ver roteador.py)
+ROTULO_AUTOMATICO = "Automático"
+NOME_AUTOMATICO = "auto"
+
+# Modelos disponíveis; preços em US$ por milhão de tokens (entrada/saída).
+# qualidade (1-3) é usada pelo roteamento automático (roteador.py)
+MODELOS_DISPONIVEIS = {
+    "GPT-4o-mini": {
+        "nome": "gpt-4o-mini",
+        "descricao": "Modelo mais rápido e econômico",
+        "custo": "Baixo",
+        "preco_entrada": 0.15,
+        "preco_saida": 0.60,
+        "qualidade": 2
+    },
+    "GPT-3.5-turbo": {
+        "nome": "gpt-3.5-turbo",
+        "descricao": "Modelo balanceado (velocidade/custo)",
+        "custo": "Muito Baixo",
+        "preco_entrada": 0.50,
+        "preco_saida": 1.50,
+        "qualidade": 1
+    },
+    "GPT-4o": {
+        "nome": "gpt-4o",
+        "descricao": "Modelo mais avançado e preciso",
+        "custo": "Alto",
+        "preco_entrada": 2.50,
+        "preco_saida": 10.00,
+        "qualidade": 3
+    },
+    "GPT-4-turbo": {
+        "nome": "gpt-4-turbo",
+        "descricao": "Modelo GPT-4 otimizado",
+        "custo": "Alto",
+        "preco_entrada": 10.00,
+        "preco_saida": 30.00,
+        "qualidade": 3
+    }
+}
+
+
+def nome_do_modelo(modelo):
+    """Aceita o rótulo ("GPT-4o") ou o nome da API ("gpt-4o"); None se desconhecido"""
+    if modelo in MODELOS_DISPONIVEIS:
+        return MODELOS_DISPONIVEIS[modelo]["nome"]
+    if any(info["nome"] == modelo for info in MODELOS_DISPONIVEIS.values()):
+        return modelo
+    return None
+
+
+def rotulo_do_modelo(nome):
+    """Rótulo de exibição ("GPT-4o") do nome da API ("gpt-4o")"""
+    return next((rotulo for rotulo, info in MODELOS_DISPONIVEIS.items() if info["nome"] == nome), nome)
+
+
+@lru_cache(maxsize=None)
+def fontes():
+    """Fontes indexadas, na ordem em que entram no vectorstore"""
+    from dicionario_leiaute import carregar_leiaute
+    from indexacao import Fonte, carregar_pdf, carregar_xls_linhas, carregar_xml, particionar_pdf
+    return [
+        Fonte("PDF", PDF_PATH, carregar_pdf, particionar=particionar_pdf),
+        Fonte("XLS_Leiaute", XLS_PATH, carregar_leiaute),
+        Fonte("XLS_Criticas", XLS_CRITICAS_PATH, carregar_xls_linhas, obrigatoria=False),
+        Fonte("XML", XML_PATH, carregar_xml),
+    ]
+
+
+@contextmanager
+def trava_indice(caminho, esperar=True):
+    """
+    Trava exclusiva entre processos enquanto o índice é verificado/atualizado.
+    Com esperar=False, levanta BlockingIOError se outro processo a detém.
+    """
+    caminho = Path(caminho)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    with open(caminho, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
@@ -0,0 +1,164 @@
+"""
+Representação colunar de remessas Doc3040.
+
+Cada tag do documento vira uma tabela Arrow (colunas = atributos, todos
+como texto, como no XML). As tabelas se ligam pelo código do cliente
+(Cli.Cd, repetido em Op.CdCli) e pelo IPOC da operação (repetido em Venc,
+Gar, Inf e ContInstFinRes4966). O cabeçalho <Doc3040> vira a tabela
+"Doc3040", com uma linha.
+
+As tabelas podem ser gravadas em Parquet e reabertas com memory-map, para
+que análises, validação e comparação entre remessas não precisem ler o XML
+de novo.
+
+Uso: python remessa.py remessa.xml diretorio_destino
+"""
+
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from doc3040 import iterar_elementos
+
+
+TABELA_CABECALHO = "Doc3040"
+TABELAS = ("Cli", "Op", "Venc", "Gar", "Inf", "ContInstFinRes4966")
+# Tags filhas de <Op> e a tabela correspondente
+_FILHAS_OP = {"Venc", "Gar", "Inf", "ContInstFinRes4966"}
+# Linhas acumuladas em listas Python antes de virarem um lote Arrow
+TAMANHO_LOTE = 65536
+
+
+class _Colunas:
+    """Acumula linhas em listas por coluna e as converte em lotes Arrow"""
+
+    def __init__(self, tamanho_lote=TAMANHO_LOTE):
+        self.tamanho_lote = tamanho_lote
+        self.colunas = {}
+        self.linhas = 0
+        self.lotes = []
+
+    def adicionar(self, registro):
+        for nome in registro.keys() - self.colunas.keys():
+            self.colunas[nome] = [None] * self.linhas
+        for nome, valores in self.colunas.items():
+            valores.append(registro.get(nome))
+        self.linhas += 1
+        if self.linhas >= self.tamanho_lote:
+            self._fechar_lote()
+
+    def _fechar_lote(self):
+        if self.linhas:
+            self.lotes.append(pa.table(
+                {nome: pa.array(valores, pa.string()) for nome, valores in self.colunas.items()}
+            ))
+        self.colunas = {nome: [] for nome in self.colunas}
+        self.linhas = 0
+
+    def tabela(self):
+        self._fechar_lote()
+        if not self.lotes:
+            return pa.table({nome: pa.array([], pa.string()) for nome in self.colunas})
+        # Atributos que só aparecem em lotes posteriores viram nulos nos anteriores
+        return pa.concat_tables(self.lotes, promote_options="default")
+
+
+def _para_pandas(tabela):
+    """DataFrame com strings Arrow, sem converter os valores em objetos Python"""
+    return tabela.to_pandas(types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get)
+
+
+@dataclass
+class Remessa:
+    """Cabeçalho (<Doc3040>) e tabelas de uma remessa"""
+    cabecalho: dict
+    tabelas: dict = field(default_factory=dict)
+
+    def __getitem__(self, nome):
+        return self.tabelas[nome]
+
+    @property
+    def total_operacoes(self):
+        return len(self.tabelas["Op"])
+
+    @classmethod
+    def de_arrow(cls, tabelas_arrow):
+        cabecalho = tabelas_arrow[TABELA_CABECALHO].to_pylist()
+        return cls(
+            cabecalho=cabecalho[0] if cabecalho else {},
+            tabelas={nome: _para_pandas(tabelas_arrow[nome]) for nome in TABELAS},
+        )
+
+
+def ler_tabelas_arrow(caminho):
+    """Lê o XML em streaming e monta as tabelas Arrow da remessa"""
+    acumuladores = {nome: _Colunas() for nome in TABELAS}
+    cabecalho = {}
+    for raiz, elem in iterar_elementos(caminho):
+        cabecalho = raiz.attrib
+        # Agregados (<Agreg>) não fazem parte das tabelas individualizadas
+        if elem.tag != "Cli":
+            continue
+        cd_cli = elem.get("Cd")
+        acumuladores["Cli"].adicionar(elem.attrib)
+        for op in elem.iter("Op"):
+            acumuladores["Op"].adicionar({**op.attrib, "CdCli": cd_cli})
+            ipoc = op.get("IPOC")
+            for filho in op:
+                if filho.tag in _FILHAS_OP:
+                    acumuladores[filho.tag].adicionar({**filho.attrib, "IPOC": ipoc})
+
+    tabelas = {nome: acc.tabela() for nome, acc in acumuladores.items()}
+    tabelas[TABELA_CABECALHO] = pa.Table.from_pylist([dict(cabecalho)]) if cabecalho \
+        else pa.table({})
+    return tabelas
+
+
+def ler_remessa(caminho):
+    """Lê o XML da remessa em tabelas (DataFrames com strings Arrow)"""
+    return Remessa.de_arrow(ler_tabelas_arrow(caminho))
+
+
+def salvar_parquet(tabelas_arrow, diretorio):
+    """Grava cada tabela em diretorio/<tabela>.parquet"""
+    diretorio = Path(diretorio)
+    diretorio.mkdir(parents=True, exist_ok=True)
+    for nome, tabela in tabelas_arrow.items():
+        pq.write_table(tabela, diretorio / f"{nome}.parquet", compression="zstd")
+
+
+def abrir_tabelas_arrow(diretorio, memory_map=True):
+    """Reabre as tabelas Parquet (memory-mapped por padrão)"""
+    diretorio = Path(diretorio)
+    tabelas = {}
+    for nome in (TABELA_CABECALHO, *TABELAS):
+        arquivo = diretorio / f"{nome}.parquet"
+        if not arquivo.exists():
+            raise FileNotFoundError(f"Tabela {nome} não encontrada em {diretorio}")
+        tabelas[nome] = pq.read_table(arquivo, memory_map=memory_map)
+    return tabelas
+
+
+def abrir_remessa(diretorio, memory_map=True):
+    """Remessa a partir do diretório Parquet, sem reler o XML"""
+    return Remessa.de_arrow(abrir_tabelas_arrow(diretorio, memory_map=memory_map))
+
+
+def converter(caminho_xml, diretorio):
+    """Converte o XML da remessa em Parquet; retorna as tabelas Arrow"""
+    tabelas = ler_tabelas_arrow(caminho_xml)
+    salvar_parquet(tabelas, diretorio)
+    return tabelas
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Uso: python remessa.py remessa.xml diretorio_destino")
+        sys.exit(2)
+    tabelas = converter(sys.argv[1], sys.argv[2])
+    for nome, tabela in tabelas.items():
+        print(f"{nome}: {tabela.num_rows} linhas, {tabela.num_columns} colunas")
@@ -0,0 +1,159 @@
+"""
+Roteamento automático de modelo (opção "Automático").
+
+Cada modelo de MODELOS_DISPONIVEIS tem um nível de qualidade; a pergunta
+recebe o nível que exige e vai ao modelo mais barato que o atinge. O nível
+sobe a partir de sinais disponíveis antes de chamar o LLM:
+  - similaridade do chunk mais próximo (vetor da pergunta no FAISS)
+  - tamanho da pergunta e várias perguntas em uma
+  - tipo: interpretação ("por que", "compare", "exemplo"...) ou consulta
+    ("o que é", "qual o formato"...), e campos do leiaute citados
+Consultas que o dicionário do leiaute responde nem chegam ao roteador.
+
+Se a resposta do modelo escolhido sai incerta ("não encontrei essa
+informação no contexto"), a pergunta é refeita uma vez no nível seguinte.
+As decisões vão para o log e para as métricas (campo "rota").
+"""
+
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+
+from recursos import MODELOS_DISPONIVEIS
+from texto import sem_acentos
+
+
+logger = logging.getLogger(__name__)
+
+# Nível de uma pergunta sem sinais (o do modelo econômico)
+NIVEL_BASE = 2
+# Sinais de dificuldade necessários para subir de nível
+SINAIS_PARA_SUBIR = 2
+# Similaridade de cosseno do melhor chunk: abaixo disso, contexto fraco
+SIMILARIDADE_BAIXA = 0.35
+MAX_PALAVRAS_SIMPLES = 20
+MAX_PALAVRAS = 45
+K_SINAIS = 4
+
+_INTERPRETACAO = re.compile(
+    r"\b(por ?que|compar\w*|diferenc\w*|explique|exemplo\w*|cenario\w*|calcul\w*|passo a passo|simul\w*|"
+    r"monte|gere|elabore|em que casos|quando devo|impacto\w*|relacao entre|justifique)\b"
+)
+_CONSULTA = re.compile(
+    r"^(o que (e|significa)|qual (e )?(o|a) (codigo|tamanho|formato|dominio|tag|nome|tipo|significado)|"
+    r"quais (sao )?(os|as) (codigos|valores|tags)|quantos|existe)\b"
+)
+_RESPOSTA_INCERTA = re.compile(
+    r"\bnao (tenho|encontrei|ha|consta|possuo|foi possivel|e possivel (determinar|afirmar))\b|"
+    r"\bnao (esta|estao) (clar|disponive|especificad|mencionad|explicit)\w*|"
+    r"\binformac\w+ (nao|insuficiente)|\bcontexto (fornecido )?nao\b"
+)
+
+
+@dataclass
+class Decisao:
+    modelo: str
+    nivel: int
+    rota: str
+    motivos: list = field(default_factory=list)
+    sinais: dict = field(default_factory=dict)
+    escalada_de: str = None
+
+    def como_dict(self):
+        return asdict(self)
+
+
+def niveis_dos_modelos(modelos=MODELOS_DISPONIVEIS):
+    """[(qualidade, custo por milhão entrada+saída, nome da API)] do mais barato ao mais caro"""
+    return sorted(
+        ((info.get("qualidade", 1), info.get("preco_entrada", 0.0) + info.get("preco_saida", 0.0), info["nome"])
+         for info in modelos.values()),
+        key=lambda item: (item[1], -item[0])
+    )
+
+
+def modelo_para_nivel(nivel, modelos=MODELOS_DISPONIVEIS):
+    """Modelo mais barato com qualidade >= nivel (ou o de maior qualidade)"""
+    niveis = niveis_dos_modelos(modelos)
+    for qualidade, _, nome in niveis:
+        if qualidade >= nivel:
+            return nome
+    return max(niveis, key=lambda item: (item[0], -item[1]))[2]
+
+
+def qualidade_do_modelo(nome, modelos=MODELOS_DISPONIVEIS):
+    return next((info.get("qualidade", 1) for info in modelos.values() if info["nome"] == nome), 1)
+
+
+def resposta_incerta(resposta):
+    return bool(_RESPOSTA_INCERTA.search(sem_acentos(resposta or "")))
+
+
+class Roteador:
+    """Escolhe o modelo da pergunta; ver o docstring do módulo"""
+
+    def __init__(self, vectorstore, dicionario=None, modelos=MODELOS_DISPONIVEIS):
+        self.vectorstore = vectorstore
+        self.dicionario = dicionario
+        self.modelos = modelos
+
+    def similaridade(self, pergunta, vetor=None):
+        """Cosseno do chunk mais próximo (vetores normalizados: cos = 1 - d²/2)"""
+        if vetor is not None:
+            resultados = self.vectorstore.similarity_search_with_score_by_vector(list(vetor), k=K_SINAIS)
+        else:
+            resultados = self.vectorstore.similarity_search_with_score(pergunta, k=K_SINAIS)
+        if not resultados:
+            return None
+        distancia = min(float(d) for _, d in resultados)
+        return max(-1.0, min(1.0, 1 - distancia / 2))
+
+    def sinais(self, pergunta, vetor=None):
+        normalizada = sem_acentos(pergunta).strip()
+        sinais = {
+            "palavras": len(normalizada.split()),
+            "perguntas": max(1, pergunta.count("?")),
+            "interpretacao": bool(_INTERPRETACAO.search(normalizada)),
+            "consulta": bool(_CONSULTA.match(normalizada)),
+            "campos": len(self.dicionario.campos_mencionados(pergunta)) if self.dicionario else 0,
+        }
+        try:
+            similaridade = self.similaridade(pergunta, vetor)
+            sinais["similaridade"] = None if similaridade is None else round(similaridade, 3)
+        except Exception as e:
+            logger.warning("Similaridade indisponível para o roteamento: %s", e)
+            sinais["similaridade"] = None
+        return sinais
+
+    def decidir(self, pergunta, vetor=None):
+        """Decisao com o modelo da pergunta; vetor é o embedding normalizado, se já calculado"""
+        sinais = self.sinais(pergunta, vetor)
+        motivos = []
+        if sinais["interpretacao"]:
+            motivos.append("pergunta de interpretação")
+        if sinais["palavras"] > MAX_PALAVRAS or sinais["perguntas"] > 1:
+            motivos.append("pergunta longa ou composta")
+        if sinais["similaridade"] is not None and sinais["similaridade"] < SIMILARIDADE_BAIXA:
+            motivos.append(f"contexto pouco similar ({sinais['similaridade']:.2f})")
+        pontos = len(motivos)
+        # Consultas curtas e diretas a um campo conhecido compensam um sinal
+        if (sinais["consulta"] or sinais["campos"]) and sinais["palavras"] <= MAX_PALAVRAS_SIMPLES:
+            pontos -= 1
+        nivel = NIVEL_BASE + 1 if pontos >= SINAIS_PARA_SUBIR else NIVEL_BASE
+        modelo = modelo_para_nivel(nivel, self.modelos)
+        decisao = Decisao(modelo, nivel, "forte" if nivel > NIVEL_BASE else "economica",
+                          motivos or ["sem sinais de dificuldade"], sinais)
+        logger.info("Roteamento: %s (nível %d; %s) %s", modelo, nivel, "; ".join(decisao.motivos), sinais)
+        return decisao
+
+    def escalar(self, decisao, resposta):
+        """Decisao no nível seguinte se a resposta saiu incerta e há modelo melhor; senão None"""
+        if decisao.escalada_de is not None or not resposta_incerta(resposta):
+            return None
+        atual = qualidade_do_modelo(decisao.modelo, self.modelos)
+        modelo = modelo_para_nivel(atual + 1, self.modelos)
+        if qualidade_do_modelo(modelo, self.modelos) <= atual:
+            return None
+        logger.info("Roteamento: resposta incerta de %s; escalando para %s", decisao.modelo, modelo)
+        return Decisao(modelo, atual + 1, "escalada", decisao.motivos + ["resposta incerta"],
+                       decisao.sinais, escalada_de=decisao.modelo)
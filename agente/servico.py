@@ -0,0 +1,271 @@
+"""
+Núcleo assíncrono do agente SCR 3040, sem interface.
+
+Carrega uma vez por processo o índice (memory-mapped e compartilhado pelo
+sistema operacional entre os workers), o BM25, o dicionário do leiaute e
+o cache de respostas, e atende perguntas concorrentes. recarregar_indice()
+passa para a versão do índice publicada por outro processo (construtor,
+app ou outro worker; ver indice_versionado.py) sem reiniciar. Cada conversa tem,
+no servidor, uma memória por modelo; conversas inativas expiram.
+
+Usado pelo serviço HTTP (api.py).
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from agentes import RegistroAgentes
+from busca_web import BuscaWeb, criar_backend as criar_backend_busca_web
+from cache_embeddings import criar_embeddings
+from cache_semantico import CacheSemantico
+from dicionario_leiaute import carregar_dicionario
+from indice_versionado import IndiceVersionado, modo_indice
+from memoria import criar_memoria, desfazer_ultimo_turno, historico_vazio
+from metricas import MedidorEtapas, criar_coletor
+from recuperacao import pergunta_autocontida
+from recursos import (EMBEDDINGS_CACHE_PATH, LEIAUTE_CACHE_PATH, NOME_AUTOMATICO, RESPOSTAS_CACHE_PATH,
+                      TIMEOUT_MODELO_PADRAO, XLS_PATH)
+from roteador import Roteador
+from streaming import StreamingResposta
+
+
+logger = logging.getLogger(__name__)
+
+MAX_CONVERSAS = 5000
+TTL_CONVERSA_SEGUNDOS = 4 * 3600
+# Threads para as partes síncronas (retriever, memória, cache); limitam a concorrência
+THREADS_PADRAO = 64
+
+
+def threads_configuradas():
+    return int(os.getenv("SCR_API_THREADS", THREADS_PADRAO))
+
+
+@dataclass
+class Conversa:
+    """Memórias e agentes de uma conversa, um por modelo"""
+    memorias: dict = field(default_factory=dict)
+    agentes: dict = field(default_factory=dict)
+    travas: dict = field(default_factory=dict)
+    acessada: float = field(default_factory=time.monotonic)
+
+    def memoria(self, modelo, criar):
+        if modelo not in self.memorias:
+            self.memorias[modelo] = criar()
+        return self.memorias[modelo]
+
+    def trava(self, modelo):
+        """Perguntas da mesma conversa ao mesmo modelo são atendidas em ordem"""
+        if modelo not in self.travas:
+            self.travas[modelo] = asyncio.Lock()
+        return self.travas[modelo]
+
+
+class Conversas:
+    """Conversas ativas, com descarte LRU e por inatividade"""
+
+    def __init__(self, max_conversas=MAX_CONVERSAS, ttl_segundos=TTL_CONVERSA_SEGUNDOS):
+        self.max_conversas = max_conversas
+        self.ttl_segundos = ttl_segundos
+        self._conversas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, conversa_id):
+        agora = time.monotonic()
+        with self._lock:
+            while self._conversas:
+                antiga_id, antiga = next(iter(self._conversas.items()))
+                if agora - antiga.acessada <= self.ttl_segundos and len(self._conversas) < self.max_conversas:
+                    break
+                del self._conversas[antiga_id]
+            conversa = self._conversas.pop(conversa_id, None) or Conversa()
+            conversa.acessada = agora
+            self._conversas[conversa_id] = conversa
+            return conversa
+
+    def remover(self, conversa_id):
+        with self._lock:
+            return self._conversas.pop(conversa_id, None) is not None
+
+    def __len__(self):
+        return len(self._conversas)
+
+
+@dataclass
+class Resposta:
+    resposta: str
+    modelo: str
+    origem: str
+    documentos: list = field(default_factory=list)
+    duracao: float = 0.0
+    tempo_primeiro_token: float = None
+    resultado_web: str = None
+    metricas: dict = None
+    # Decisão do roteamento automático (modelo "auto"), como dict
+    rota: dict = None
+
+
+class Servico:
+    """Componentes carregados uma vez por processo e o atendimento das perguntas"""
+
+    def __init__(self):
+        self.embeddings = criar_embeddings(EMBEDDINGS_CACHE_PATH)
+        # No modo local o processo reindexa as fontes alteradas ao iniciar;
+        # no compartilhado, abre a versão publicada pelo construtor
+        self.indice = IndiceVersionado(self.embeddings)
+        atual = self.indice.abrir(atualizar=modo_indice() == "local")
+        self.vectorstore, self.versao, self.bm25 = atual.vectorstore, atual.versao, atual.bm25
+        self.registro = RegistroAgentes()
+        self.registro.sincronizar(self.vectorstore, self.versao, self.bm25)
+        try:
+            self.dicionario = carregar_dicionario(XLS_PATH, LEIAUTE_CACHE_PATH)
+        except Exception as e:
+            logger.warning("Dicionário do leiaute indisponível: %s", e)
+            self.dicionario = None
+        self.cache = CacheSemantico(criar_embeddings(EMBEDDINGS_CACHE_PATH), RESPOSTAS_CACHE_PATH)
+        self.cache.invalidar_outras_versoes(self.versao)
+        try:
+            self.busca_web = BuscaWeb(criar_backend_busca_web())
+        except Exception as e:
+            logger.warning("Busca na internet desativada: %s", e)
+            self.busca_web = BuscaWeb(None)
+        self.conversas = Conversas()
+        self.metricas = criar_coletor()
+        self.roteador = Roteador(self.vectorstore, self.dicionario)
+
+    def recarregar_indice(self):
+        """Passa para a versão publicada, se mudou; True se trocou"""
+        return self.indice.atualizar(ao_trocar=self._usar_versao)
+
+    def _usar_versao(self, atual):
+        # Perguntas em andamento terminam com os componentes da versão anterior
+        self.vectorstore, self.versao, self.bm25 = atual.vectorstore, atual.versao, atual.bm25
+        self.registro.sincronizar(self.vectorstore, self.versao, self.bm25)
+        self.roteador = Roteador(self.vectorstore, self.dicionario)
+        self.cache.invalidar_outras_versoes(self.versao)
+
+    async def perguntar(self, pergunta, modelo, conversa_id, timeout=TIMEOUT_MODELO_PADRAO,
+                        ao_atualizar=None, incluir_web=False, usar_cache=True, modo="api"):
+        """
+        Responde à pergunta na conversa: dicionário do leiaute, cache
+        semântico ou agente RAG, nessa ordem. Com ao_atualizar(texto), a
+        resposta do agente é repassada em streaming (ao_atualizar(None) indica
+        que a resposta recomeçou em outro modelo). Com usar_cache=False o
+        agente sempre responde (e a resposta renova o cache). O modelo
+        "auto" é escolhido pelo roteador.
+        """
+        conversa = self.conversas.obter(conversa_id)
+        busca_web = self.busca_web.iniciar(pergunta) if incluir_web else None
+        medidor = MedidorEtapas(modelo)
+        async with conversa.trava(modelo):
+            resposta = await asyncio.wait_for(
+                self._responder(pergunta, modelo, conversa, ao_atualizar, medidor, usar_cache), timeout
+            )
+        if busca_web is not None:
+            resposta.resultado_web = await asyncio.to_thread(busca_web.resultado)
+            medidor.registrar_etapa("busca_web", busca_web.duracao)
+        resposta.metricas = medidor.registro(resposta.origem, modo=modo, rota=resposta.rota,
+                                             tempo_primeiro_token=resposta.tempo_primeiro_token)
+        self.metricas.registrar(resposta.metricas)
+        return resposta
+
+    async def _responder(self, pergunta, modelo, conversa, ao_atualizar, medidor, usar_cache=True):
+        memoria = conversa.memoria(modelo, lambda: criar_memoria(self.registro.llm_resumo()))
+        inicio = time.perf_counter()
+
+        direta = self.dicionario.responder(pergunta) if self.dicionario else None
+        if direta is not None:
+            await asyncio.to_thread(memoria.save_context, {"question": pergunta}, {"answer": direta})
+            medidor.registrar_resumo(memoria)
+            return Resposta(direta, modelo, "dicionario", duracao=time.perf_counter() - inicio)
+
+        # Uma pergunta que depende da conversa ("E o prazo?") não consulta o cache
+        independente = historico_vazio(memoria) or pergunta_autocontida(pergunta)
+        usar_cache = usar_cache and independente
+        vetor = None
+        cacheada = None
+        try:
+            vetor = await asyncio.to_thread(self.cache.vetor, pergunta)
+            if usar_cache and modelo != NOME_AUTOMATICO:
+                cacheada = await asyncio.to_thread(self.cache.buscar, pergunta, modelo, self.versao, vetor=vetor)
+        except Exception as e:
+            logger.warning("Cache de respostas indisponível: %s", e)
+            cacheada = None
+
+        decisao = None
+        if modelo == NOME_AUTOMATICO:
+            decisao = await asyncio.to_thread(self.roteador.decidir, pergunta, vetor)
+            modelo = medidor.modelo = decisao.modelo
+            if usar_cache and vetor is not None:
+                cacheada = await asyncio.to_thread(self.cache.buscar, pergunta, modelo, self.versao, vetor=vetor)
+        if cacheada is not None:
+            await asyncio.to_thread(memoria.save_context, {"question": pergunta}, {"answer": cacheada.resposta})
+            medidor.registrar_resumo(memoria)
+            return Resposta(cacheada.resposta, modelo, "cache", cacheada.documentos,
+                            duracao=time.perf_counter() - inicio,
+                            rota=decisao.como_dict() if decisao else None)
+
+        resultado, handler = await self._invocar_agente(pergunta, modelo, conversa, memoria,
+                                                        ao_atualizar, medidor)
+        escalada = self.roteador.escalar(decisao, resultado["answer"]) if decisao else None
+        if escalada is not None:
+            # Refaz no modelo mais forte; a resposta incerta sai do histórico
+            desfazer_ultimo_turno(memoria)
+            decisao, modelo = escalada, escalada.modelo
+            medidor.modelo = modelo
+            if ao_atualizar is not None:
+                ao_atualizar(None)
+            resultado, handler = await self._invocar_agente(pergunta, modelo, conversa, memoria,
+                                                            ao_atualizar, medidor)
+        duracao = time.perf_counter() - inicio
+        documentos = resultado.get("source_documents", [])
+        if vetor is not None:
+            try:
+                if independente:
+                    await asyncio.to_thread(self.cache.gravar, pergunta, modelo, self.versao,
+                                            resultado["answer"], documentos, duracao, vetor=vetor)
+                elif resultado.get("generated_question"):
+                    # Pergunta de seguimento: gravada pela pergunta reescrita, autocontida
+                    await asyncio.to_thread(self.cache.gravar, resultado["generated_question"], modelo,
+                                            self.versao, resultado["answer"], documentos, duracao)
+            except Exception as e:
+                logger.warning("Não foi possível gravar no cache de respostas: %s", e)
+        return Resposta(resultado["answer"], modelo, "modelo", documentos, duracao,
+                        handler.tempo_primeiro_token if handler else None,
+                        rota=decisao.como_dict() if decisao else None)
+
+    async def _invocar_agente(self, pergunta, modelo, conversa, memoria, ao_atualizar, medidor):
+        streaming = ao_atualizar is not None
+        # O tempo limite é aplicado por wait_for (cancela a chamada assíncrona),
+        # então os LLMs compartilhados não dependem do timeout de cada pedido
+        agente = self.registro.obter_agente(conversa.agentes, memoria, model_name=modelo,
+                                            streaming=streaming)
+        config = {"callbacks": [medidor]}
+        handler = None
+        if streaming:
+            handler = StreamingResposta(ao_atualizar)
+            # Tokens na ordem de chegada, no loop de eventos
+            handler.run_inline = True
+            config["callbacks"].append(handler)
+        resultado = await agente.ainvoke({"question": pergunta}, config=config)
+        medidor.registrar_resumo(memoria)
+        return resultado, handler
+
+    async def comparar(self, pergunta, modelos, conversa_id, timeout=TIMEOUT_MODELO_PADRAO):
+        """Mesma pergunta a vários modelos em paralelo; dict modelo -> Resposta ou exceção"""
+        resultados = await asyncio.gather(
+            *(self.perguntar(pergunta, modelo, conversa_id, timeout) for modelo in modelos),
+            return_exceptions=True
+        )
+        return dict(zip(modelos, resultados))
+
+
+def criar_executor():
+    """Executor padrão do loop: as partes síncronas da cadeia rodam nele"""
+    return ThreadPoolExecutor(max_workers=threads_configuradas(), thread_name_prefix="scr-api")
@@ -0,0 +1,43 @@
+"""
+Streaming da resposta do agente token a token.
+
+Só o LLM que gera a resposta final é marcado com TAG_RESPOSTA; o LLM que
+reescreve a pergunta com base no histórico (condense) não faz streaming e
+seus tokens, se houver, são ignorados pelo handler.
+"""
+
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+TAG_RESPOSTA = "resposta_final"
+
+
+class StreamingResposta(BaseCallbackHandler):
+    """
+    Acumula os tokens da resposta e repassa o texto parcial para
+    ao_atualizar(texto) a cada token. Registra o tempo até o primeiro token.
+    """
+
+    def __init__(self, ao_atualizar, tag=TAG_RESPOSTA):
+        self.ao_atualizar = ao_atualizar
+        self.tag = tag
+        self.texto = ""
+        self.inicio = time.perf_counter()
+        self.instante_primeiro_token = None
+
+    def on_llm_new_token(self, token, *, tags=None, **kwargs):
+        if self.tag not in (tags or []):
+            return
+        if self.instante_primeiro_token is None:
+            self.instante_primeiro_token = time.perf_counter()
+        self.texto += token
+        self.ao_atualizar(self.texto)
+
+    @property
+    def tempo_primeiro_token(self):
+        """Segundos entre a criação do handler e o primeiro token (None se não houve)"""
+        if self.instante_primeiro_token is None:
+            return None
+        return self.instante_primeiro_token - self.inicio
@@ -0,0 +1,13 @@
+"""
+Normalização de texto para comparar perguntas e respostas, sem
+dependências pesadas (usada pelo dicionário do leiaute, pelo roteador,
+pela camada de recuperação e pelo índice BM25).
+"""
+
+import unicodedata
+
+
+def sem_acentos(texto):
+    """Texto em minúsculas e sem acentos ("Está" -> "esta")"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
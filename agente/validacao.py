@@ -0,0 +1,509 @@
+"""
+Motor de validação das críticas do SCR 3040 sobre remessas Doc3040.
+
+As críticas de SCR3040_Criticas.xls que podem ser verificadas apenas com os
+atributos de Cli, Op, Venc, Gar, Inf e ContInstFinRes4966 são expressas como
+predicados vetorizados (pandas/NumPy) sobre as tabelas da remessa. A planilha
+fornece o catálogo: título, descrição e se a crítica está habilitada.
+
+Uso: python validacao.py remessa.xml
+     python validacao.py diretorio_parquet   (convertido com remessa.py)
+"""
+
+import logging
+import re
+import sys
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from remessa import ler_remessa, abrir_remessa
+
+
+logger = logging.getLogger(__name__)
+
+XLS_CRITICAS_PATH = Path(__file__).parent / "SCR3040_Criticas.xls"
+# Abas da planilha com críticas aplicáveis a dados de uma remessa
+_ABAS_CRITICAS = ("Campos Obrigatórios", "Formato", "Semântica", "Individualizadas", "Agregadas")
+
+COLUNAS_VIOLACOES = ["codigo", "regra", "tabela", "IPOC", "cliente"]
+
+
+@dataclass
+class Critica:
+    """Crítica verificável: predicado que marca as linhas inválidas de uma tabela"""
+    codigo: str
+    titulo: str
+    tabela: str
+    predicado: Callable
+
+
+CRITICAS = {}
+
+
+def critica(codigo, titulo, tabela="Op"):
+    """Registra um predicado de crítica"""
+    def registrar(predicado):
+        CRITICAS[codigo] = Critica(codigo, titulo, tabela, predicado)
+        return predicado
+    return registrar
+
+
+def carregar_catalogo(caminho=XLS_CRITICAS_PATH):
+    """Lê código, regra, descrição e habilitação das críticas na planilha"""
+    catalogo = {}
+    abas = pd.read_excel(caminho, sheet_name=list(_ABAS_CRITICAS), header=3, dtype=str)
+    for aba, df in abas.items():
+        df = df.rename(columns=lambda c: str(c).strip())
+        for _, linha in df.dropna(subset=["Código"]).iterrows():
+            catalogo[linha["Código"].strip()] = {
+                "aba": aba,
+                "regra": str(linha.get("Regra", "")).strip(),
+                "descricao": str(linha.get("Descrição", "")).strip(),
+                "habilitada": str(linha.get("Habilitado?", "")).strip().lower() == "s",
+            }
+    return catalogo
+
+
+# ---------------------------------------------------------------------------
+# Preparação das tabelas
+# ---------------------------------------------------------------------------
+
+def _coluna(df, nome):
+    """Coluna como texto; série vazia (NA) se o atributo não aparece na remessa"""
+    if nome in df.columns:
+        return df[nome]
+    return pd.Series(pd.NA, index=df.index, dtype="string")
+
+
+def _numero(serie):
+    return pd.to_numeric(serie, errors="coerce")
+
+
+def _data(serie):
+    return pd.to_datetime(serie, format="%Y-%m-%d", errors="coerce")
+
+
+class _Contexto:
+    """Tabelas da remessa com as junções e colunas derivadas usadas pelas críticas"""
+
+    def __init__(self, remessa):
+        self.cabecalho = remessa.cabecalho
+        self.cli = remessa["Cli"]
+        self.gar = remessa["Gar"]
+        self.inf = remessa["Inf"]
+        self.cont = remessa["ContInstFinRes4966"]
+
+        op = remessa["Op"]
+        # Atributos do cliente replicados na operação
+        cli = self.cli.drop_duplicates("Cd") if "Cd" in self.cli.columns else self.cli
+        cli = cli.add_prefix("Cli_")
+        if "Cli_Cd" in cli.columns and len(op):
+            op = op.merge(cli, left_on="CdCli", right_on="Cli_Cd", how="left")
+
+        # Matriz de vencimentos (saldo > 0) alinhada às operações
+        venc = remessa["Venc"]
+        codigos = sorted(
+            (c for c in venc.columns if re.fullmatch(r"v\d+", c)), key=lambda c: int(c[1:])
+        )
+        self.op = op.reset_index(drop=True)
+        self.codigos_venc = np.array([int(c[1:]) for c in codigos], dtype=np.int32)
+        self.venc = np.zeros((len(self.op), len(codigos)), dtype=bool)
+        if codigos and len(self.op):
+            valores = venc[codigos].astype("float64[pyarrow]").fillna(0.0)
+            valores["IPOC"] = venc["IPOC"]
+            valores = valores.groupby("IPOC", sort=False).sum()
+            alinhados = valores.reindex(self.op["IPOC"]).fillna(0.0)
+            self.venc = alinhados.to_numpy(dtype=float) > 0
+        self.mod = _coluna(self.op, "Mod").fillna("")
+        # Posição da operação de cada linha de ContInstFinRes4966 (-1 se órfã);
+        # com IPOC repetido (crítica I04) vale a primeira ocorrência
+        ipocs = _coluna(self.op, "IPOC")
+        primeiras = np.flatnonzero(~ipocs.duplicated().to_numpy())
+        posicoes = pd.Index(ipocs.iloc[primeiras]).get_indexer(_coluna(self.cont, "IPOC"))
+        self.cont_op = np.where(posicoes >= 0, primeiras[posicoes], -1)
+        self._cache = {}
+
+    def _memo(self, chave, calcular):
+        if chave not in self._cache:
+            self._cache[chave] = calcular()
+        return self._cache[chave]
+
+    def numero(self, campo):
+        """Atributo numérico da operação (NaN se ausente ou inválido)"""
+        return self._memo(("numero", campo), lambda: _numero(_coluna(self.op, campo)).astype(float))
+
+    def tabela(self, nome):
+        return {"Cli": self.cli, "Op": self.op, "Gar": self.gar,
+                "Inf": self.inf, "ContInstFinRes4966": self.cont}[nome]
+
+    def vencimentos(self, minimo, maximo=None):
+        """Operações com saldo em algum vencimento vMIN..vMAX (inclusive)"""
+        maximo = maximo if maximo is not None else minimo
+        colunas = (self.codigos_venc >= minimo) & (self.codigos_venc <= maximo)
+        return pd.Series(self.venc[:, colunas].any(axis=1), index=self.op.index)
+
+    def ops_com_inf(self, padrao):
+        """Operações com alguma informação adicional cujo Tp casa com o regex"""
+        tp = _coluna(self.inf, "Tp").fillna("")
+        ipocs = _coluna(self.inf, "IPOC")[tp.str.fullmatch(padrao)]
+        return _coluna(self.op, "IPOC").isin(set(ipocs.dropna()))
+
+    def caracteristica(self, codigo):
+        """Operações marcadas com a característica especial (lista separada por ';')"""
+        carac = _coluna(self.op, "CaracEspecial").fillna("")
+        return carac.str.contains(rf"(?:^|;)\s*{codigo}\s*(?:;|$)", regex=True)
+
+    def modalidade_em(self, *prefixos):
+        return self._memo(("mod", prefixos), lambda: self.mod.str.startswith(tuple(prefixos)))
+
+    def natureza_em(self, *naturezas):
+        return self.numero("NatuOp").isin(naturezas)
+
+    def saida(self):
+        """Operações com informação adicional de saída (03xx)"""
+        return self._memo("saida", lambda: self.ops_com_inf(r"03\d\d"))
+
+
+# Modalidades (grupo de 2 dígitos) e naturezas das críticas da Res. 4.966
+_MODS_4966 = tuple(f"{m:02d}" for m in (*range(1, 12), 13, 14, 18))
+_NATUREZAS_4966 = (1, 2, 3, 11, 13, 14, 15, 32)
+
+
+def _escopo_4966(ctx):
+    return ctx.modalidade_em(*_MODS_4966) & ctx.natureza_em(*_NATUREZAS_4966) & ~ctx.saida()
+
+
+def _cont_da_op(ctx, mascara_op):
+    """Leva uma máscara de operações para as linhas de ContInstFinRes4966"""
+    mascara = np.append(np.asarray(mascara_op, dtype=bool), False)
+    return pd.Series(mascara[ctx.cont_op], index=ctx.cont.index)
+
+
+# ---------------------------------------------------------------------------
+# Críticas
+# ---------------------------------------------------------------------------
+
+@critica("C10", "Campos de reavaliação de garantia", tabela="Gar")
+def _c10(ctx):
+    return _coluna(ctx.gar, "DtReav").notna() & _coluna(ctx.gar, "VlrData").isna()
+
+
+@critica("C11", "Data de vencimento")
+def _c11(ctx):
+    return _coluna(ctx.op, "DtVencOp").isna() & ~ctx.vencimentos(199)
+
+
+@critica("C28", "Valor contratado - obrigatoriedade")
+def _c28(ctx):
+    rotativas = ctx.mod.isin(["0101", "0210", "0213", "0214", "0217", "0406", "1304"]) | ctx.modalidade_em("19")
+    sem_valor = ctx.numero("VlrContr").fillna(0) == 0
+    return ~rotativas & ctx.vencimentos(81, 999) & sem_valor
+
+
+@critica("C33", "Aplicabilidade de Dias de Atraso")
+def _c33(ctx):
+    # Dias de atraso só em operações vencidas (v205 a v330), e obrigatório nelas
+    atraso = ctx.numero("DiaAtraso")
+    vencidas = ctx.vencimentos(205, 330)
+    return ((atraso.fillna(0) > 0) & ~vencidas) | (atraso.isna() & vencidas)
+
+
+@critica("C47", "Obrigatoriedade do atributo TotalCli", tabela="Cli")
+def _c47(ctx):
+    # Crítica de cabeçalho: reportada na primeira linha de cliente
+    mascara = pd.Series(False, index=ctx.cli.index)
+    if not ctx.cabecalho.get("TotalCli") and len(mascara):
+        mascara.iloc[0] = True
+    return mascara
+
+
+@critica("C72", "Preenchimento proibido para o campo Estágio do Instrumento Financeiro (EstInstFin)",
+         tabela="ContInstFinRes4966")
+def _c72(ctx):
+    simplificada = ctx.cabecalho.get("MetodApPE") == "S"
+    return _coluna(ctx.cont, "EstInstFin").notna() & simplificada
+
+
+@critica("C74", "Preenchimento obrigatório para o campo Carteira Provisão Mínima (CartProvMin)",
+         tabela="ContInstFinRes4966")
+def _c74(ctx):
+    escopo = ctx.modalidade_em(*(f"{m:02d}" for m in (*range(1, 15), 18))) \
+        & ctx.natureza_em(*_NATUREZAS_4966) & ~ctx.saida()
+    valida = _coluna(ctx.cont, "CartProvMin").isin(["C1", "C2", "C3", "C4", "C5"])
+    return _cont_da_op(ctx, escopo) & ~valida
+
+
+@critica("C76", "Preenchimento proibido para o campo Quantidade de Instrumento (QtdInst)",
+         tabela="ContInstFinRes4966")
+def _c76(ctx):
+    return _cont_da_op(ctx, ~ctx.modalidade_em("18")) & _coluna(ctx.cont, "QtdInst").notna()
+
+
+@critica("C78", "Classificação contábil VJORA permitida apenas nas modalidades 14 e 18",
+         tabela="ContInstFinRes4966")
+def _c78(ctx):
+    permitidas = ctx.modalidade_em("14", "18") & ~ctx.caracteristica(39)
+    return (_coluna(ctx.cont, "ClasAtFin") == "2") & _cont_da_op(ctx, ~permitidas)
+
+
+@critica("C79", "Preenchimento obrigatório para o campo Valor Contábil Bruto (VlrContBr)",
+         tabela="ContInstFinRes4966")
+def _c79(ctx):
+    return _cont_da_op(ctx, _escopo_4966(ctx)) & _coluna(ctx.cont, "VlrContBr").isna()
+
+
+@critica("F02", "Datas")
+def _f02(ctx):
+    invalida = pd.Series(False, index=ctx.op.index)
+    for campo in ("DtContr", "DtVencOp", "DtaProxParcela"):
+        valor = _coluna(ctx.op, campo)
+        invalida |= valor.notna() & _data(valor).isna()
+    return invalida
+
+
+@critica("F03", "Código do contrato")
+def _f03(ctx):
+    return _coluna(ctx.op, "Contrt").fillna("").str.strip() == ""
+
+
+@critica("S03", "Ocultação de operação em prejuízo há mais de 48 meses")
+def _s03(ctx):
+    return ctx.vencimentos(330) & ~ctx.caracteristica(11)
+
+
+@critica("S05", "Limite de crédito - vencimentos possíveis")
+def _s05(ctx):
+    outros = ~np.isin(ctx.codigos_venc, (20, 40))
+    com_outros = ctx.venc[:, outros].any(axis=1)
+    return ctx.modalidade_em("19") & com_outros
+
+
+@critica("S06", "Vencimentos 20 e 40 - modalidade possível")
+def _s06(ctx):
+    return (ctx.vencimentos(20) | ctx.vencimentos(40)) & ~ctx.modalidade_em("19")
+
+
+@critica("S14", "Compatibilidade entre data de vencimento e data de contratação de uma operação")
+def _s14(ctx):
+    return (_data(_coluna(ctx.op, "DtVencOp")) < _data(_coluna(ctx.op, "DtContr"))) & ~ctx.saida()
+
+
+@critica("S15", "Compatibilidade de data de contratação")
+def _s15(ctx):
+    return _data(_coluna(ctx.op, "DtContr")) > pd.Timestamp(date.today())
+
+
+@critica("S21", "Coobrigação com distribuição de vencimentos incompatíveis")
+def _s21(ctx):
+    return ctx.modalidade_em("15") & ctx.vencimentos(310, 330)
+
+
+# Faixas de S28: (DiaAtraso mínimo, máximo, primeiro vencimento proibido)
+_FAIXAS_S28 = [
+    (1, 14, 210), (15, 30, 220), (31, 60, 230), (61, 90, 240), (91, 120, 245),
+    (121, 150, 250), (151, 180, 255), (181, 240, 260), (241, 300, 270),
+    (301, 360, 280), (361, 540, 290),
+]
+
+
+@critica("S28", "Dias de atraso da parcela mais atrasada de operações vencidas deve ser compatível com vencimentos")
+def _s28(ctx):
+    atraso = ctx.numero("DiaAtraso").to_numpy()
+    invalida = np.zeros(len(ctx.op), dtype=bool)
+    for minimo, maximo, proibido in _FAIXAS_S28:
+        na_faixa = (atraso >= minimo) & (atraso <= maximo)
+        invalida |= na_faixa & ctx.vencimentos(proibido, 290).to_numpy()
+    sem_atraso = np.isnan(atraso) | (atraso == 0)
+    invalida |= sem_atraso & ctx.vencimentos(205, 290).to_numpy()
+    return pd.Series(invalida, index=ctx.op.index)
+
+
+@critica("S29", "Dias de atraso da parcela mais atrasada de operações em prejuízo deve ser compatível com vencimentos")
+def _s29(ctx):
+    atraso = ctx.numero("DiaAtraso").fillna(0)
+    return (
+        (ctx.vencimentos(310) & (atraso <= 180))
+        | (ctx.vencimentos(320) & (atraso <= 540))
+        | (ctx.vencimentos(330) & (atraso <= 1620))
+    )
+
+
+@critica("S52", "Compatibilidade de informação de taxa de juros - cartão de crédito")
+def _s52(ctx):
+    return (ctx.mod == "1304") & (ctx.numero("TaxEft").fillna(0) != 0)
+
+
+@critica("S53", "Crédito a liberar - não aplicabilidade")
+def _s53(ctx):
+    mods = ctx.mod.isin(["0101", "0204", "0210", "1304", "0213", "0214"])
+    return mods & (ctx.vencimentos(60) | ctx.vencimentos(80))
+
+
+@critica("S59", "Garantia FGTS", tabela="Gar")
+def _s59(ctx):
+    pessoais = set(_coluna(ctx.op, "IPOC")[ctx.mod.isin(["0202", "0203"])].dropna())
+    return (_coluna(ctx.gar, "Tp") == "0889") & ~_coluna(ctx.gar, "IPOC").isin(pessoais)
+
+
+@critica("S60", "Crédito rotativo - não migrado")
+def _s60(ctx):
+    return (ctx.mod == "0218") & ctx.caracteristica(18)
+
+
+@critica("S61", "Obrigatoriedade do campo valor contratado para as modalidades 0210 e 0406")
+def _s61(ctx):
+    sem_valor = ctx.numero("VlrContr").fillna(0) == 0
+    return ctx.mod.isin(["0210", "0406"]) & ctx.caracteristica(18) & sem_valor
+
+
+@critica("S63", "Compatibilidade de informação entre Porte e Faturamento", tabela="Cli")
+def _s63(ctx):
+    return (_coluna(ctx.cli, "PorteCli") == "0") & (_numero(_coluna(ctx.cli, "FatAnual")) > 1)
+
+
+@critica("S68", "Compatibilidade de informação entre Porte e Faturamento (faturamento até 1)", tabela="Cli")
+def _s68(ctx):
+    fat = _numero(_coluna(ctx.cli, "FatAnual"))
+    return (fat <= 1) & ~_coluna(ctx.cli, "PorteCli").isin(["0", "1"])
+
+
+@critica("S75", "Duplicidade de Informações Adicionais", tabela="Inf")
+def _s75(ctx):
+    if not len(ctx.inf):
+        return pd.Series(False, index=ctx.inf.index)
+    return ctx.inf.duplicated(keep="first")
+
+
+@critica("S81", "Concatenação IPOC - data posterior à de contratação")
+def _s81(ctx):
+    # IPOC = CNPJ (8) + Mod (4) + Tp do cliente (1) + Cd do cliente + Contrt;
+    # após a contratação a modalidade pode mudar, os demais elementos não
+    ipoc = _coluna(ctx.op, "IPOC").fillna("")
+    cnpj_ok = ipoc.str.slice(0, 8) == ctx.cabecalho.get("CNPJ", "")
+    tp_ok = ipoc.str.slice(12, 13) == _coluna(ctx.op, "Cli_Tp").fillna("")
+    cd = _coluna(ctx.op, "CdCli").fillna("")
+    tamanho_cd = cd.str.len()
+    cd_ok = pd.Series(False, index=ctx.op.index)
+    # O tamanho do código do cliente varia com o tipo (8, 11 ou 14 dígitos)
+    for tamanho in tamanho_cd.unique():
+        linhas = tamanho_cd == tamanho
+        cd_ok[linhas] = ipoc[linhas].str.slice(13, 13 + int(tamanho)) == cd[linhas]
+    return ~(cnpj_ok & tp_ok & cd_ok)
+
+
+@critica("S83", "Compatibilidade de tipo de cliente e identificação do cliente", tabela="Cli")
+def _s83(ctx):
+    digitos = _coluna(ctx.cli, "Cd").fillna("").str.len()
+    esperado = _coluna(ctx.cli, "Tp").map({"1": 11, "2": 8, "3": 14, "4": 14, "5": 14, "6": 14})
+    return esperado.notna() & (digitos != esperado)
+
+
+@critica("I03", "Cliente informado mais de uma vez", tabela="Cli")
+def _i03(ctx):
+    cd = _coluna(ctx.cli, "Cd")
+    chave = ctx.cli[["Cd", "Tp"]] if {"Cd", "Tp"} <= set(ctx.cli.columns) else cd
+    return chave.duplicated(keep="first") & cd.notna()
+
+
+@critica("I04", "Operação informada mais de uma vez para o mesmo cliente")
+def _i04(ctx):
+    chave = ctx.op[["CdCli", "Contrt", "Mod"]] if {"CdCli", "Contrt", "Mod"} <= set(ctx.op.columns) \
+        else ctx.op[[]]
+    if chave.empty:
+        return pd.Series(False, index=ctx.op.index)
+    return chave.duplicated(keep="first")
+
+
+# ---------------------------------------------------------------------------
+# Execução
+# ---------------------------------------------------------------------------
+
+def _violacoes(ctx, critica_, titulo):
+    tabela = ctx.tabela(critica_.tabela)
+    if tabela.empty:
+        return None
+    mascara = pd.Series(critica_.predicado(ctx), index=tabela.index).fillna(False).astype(bool)
+    if not mascara.any():
+        return None
+    linhas = tabela.loc[mascara]
+    if critica_.tabela == "Cli":
+        cliente = _coluna(linhas, "Cd")
+    elif "CdCli" in linhas.columns:
+        cliente = linhas["CdCli"]
+    else:
+        # Tabelas filhas de <Op>: cliente obtido pelo IPOC
+        mapa = ctx.op.drop_duplicates("IPOC").set_index("IPOC")["CdCli"]
+        cliente = _coluna(linhas, "IPOC").map(mapa)
+    return pd.DataFrame({
+        "codigo": critica_.codigo,
+        "regra": titulo,
+        "tabela": critica_.tabela,
+        "IPOC": _coluna(linhas, "IPOC").to_numpy(),
+        "cliente": cliente.to_numpy(),
+    })
+
+
+def validar(remessa, catalogo=None, codigos=None):
+    """
+    Executa as críticas suportadas sobre a remessa.
+
+    Retorna um DataFrame com uma linha por violação (codigo, regra, tabela,
+    IPOC, cliente). Críticas desabilitadas no catálogo não são executadas.
+    """
+    if catalogo is None:
+        try:
+            catalogo = carregar_catalogo()
+        except Exception as e:
+            logger.warning("Catálogo de críticas indisponível (%s); executando todas", e)
+            catalogo = {}
+
+    ctx = _Contexto(remessa)
+    partes = []
+    for codigo, critica_ in CRITICAS.items():
+        if codigos is not None and codigo not in codigos:
+            continue
+        info = catalogo.get(codigo)
+        if info is not None and not info["habilitada"]:
+            continue
+        titulo = info["regra"] if info else critica_.titulo
+        violacoes = _violacoes(ctx, critica_, titulo)
+        if violacoes is not None:
+            partes.append(violacoes)
+
+    if not partes:
+        return pd.DataFrame(columns=COLUNAS_VIOLACOES)
+    return pd.concat(partes, ignore_index=True).sort_values(["codigo", "IPOC"], ignore_index=True)
+
+
+def agrupar_violacoes(violacoes):
+    """Violações agrupadas por código da crítica e IPOC, com a contagem"""
+    return (
+        violacoes.groupby(["codigo", "regra", "IPOC"], dropna=False)
+        .size()
+        .rename("ocorrencias")
+        .reset_index()
+    )
+
+
+def validar_arquivo(caminho, catalogo=None):
+    """Lê a remessa (XML ou diretório Parquet) e executa as críticas"""
+    if Path(caminho).is_dir():
+        return validar(abrir_remessa(caminho), catalogo=catalogo)
+    return validar(ler_remessa(caminho), catalogo=catalogo)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Uso: python validacao.py remessa.xml|diretorio_parquet")
+        sys.exit(2)
+    resultado = validar_arquivo(sys.argv[1])
+    if resultado.empty:
+        print("✅ Nenhuma violação encontrada")
+    else:
+        print(agrupar_violacoes(resultado).to_string(index=False))
+    sys.exit(1 if len(resultado) else 0)